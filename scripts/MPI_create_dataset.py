@@ -4,26 +4,42 @@ Format data base into hdf5 file containing every time stamp associated with a
 granule, with associated dataset of radiance, reflectance, cloudmask, sun view
 geometry, and geolocation.
 '''
+import numpy as np
 from read_MODIS_02 import prepare_data
 from read_MODIS_03 import *
 from read_MODIS_35 import *
-from regrid import regrid_MODIS_2_MAIA
+from read_MODIS_granule import Granule
+from regrid import get_regrid_idx, TargetGrid
+from regrid_cache import RegridCache
+from prescreen import Prescreen
+from granule_catalog import GranuleCatalog
+from processing_manifest import ProcessingManifest, load_manifest,\
+                                get_input_checksum, needs_processing
+from mpi_work_queue import dispatch, work, get_tasks, format_utilization
+from async_io import Prefetcher, AsyncWriter
+from database_index import write_database_index, get_manifest_shard_index
+from database_encoding import encode, get_attributes, pack_valid_mask,\
+                              flag_fill_value, geometry_fill_value, float_fill_value
+from product_spec import default_product_spec, check_product_spec, plan_reads,\
+                         load_product_spec, geometry_fieldnames, cloud_mask_names,\
+                         cloud_mask_tests_names
 import h5py
 import sys
 import os
 import time
-import pytaf
+import threading
 from pyhdf.SD import SD
 
 #import matplotlib.pyplot as plt
 
-def save_crop(subgroup, dataset_name, cropped_data, compress=True):
+def save_crop(subgroup, dataset_name, cropped_data, compress=True, attributes=None):
     '''
     INPUT:
           cropped data from regrid_MODIS_2_MAIA
           subgroup: - h5py group - belongs to subgroup of MODIS dataset i.e.
                                    radiance
           dataset_name: - str - name to save data to
+          attributes: - dict - CF attributes from database_encoding.get_attributes
     RETURN:
           save cropped data into hdf5 file without closing it. This is to add
           data into the hdf5 file and then freeing dereferenced pointers in
@@ -32,14 +48,61 @@ def save_crop(subgroup, dataset_name, cropped_data, compress=True):
     try:
         if compress:
             #add dataset to 'group'
-            subgroup.create_dataset(dataset_name, data=cropped_data, compression="gzip")
+            #shuffle groups the bytes of the int16/float32 fields for gzip
+            subgroup.create_dataset(dataset_name, data=cropped_data, compression="gzip",\
+                                    shuffle=np.ndim(cropped_data) > 0)
         else:
             subgroup.create_dataset(dataset_name, data=cropped_data)
     except:
         subgroup[dataset_name][:] = cropped_data
 
+    if attributes is not None:
+        for attribute, value in attributes.items():
+            subgroup[dataset_name].attrs[attribute] = value
+
+def write_granule(hf, group_name, datasets):
+    '''
+    INPUT:
+          hf         - h5py file - shard to write to
+          group_name - str       - time stamp of the granule
+          datasets   - list      - (subgroup, dataset name, data, compress,
+                                   attributes) from build_data_base; subgroup
+                                   '' is the granule group itself
+    RETURN:
+          writes the granule group; a half written group is removed if a
+          write fails, so a retry starts clean
+    '''
+    group = hf.create_group(group_name)
+    try:
+        for subgroup_name, dataset_name, data, compress, attributes in datasets:
+            if subgroup_name:
+                subgroup = group.require_group(subgroup_name)
+            else:
+                subgroup = group
+            save_crop(subgroup, dataset_name, data, compress, attributes)
+    except:
+        del hf[group_name]
+        raise
+
+def regrid_crop(data, crop_idx):
+    '''
+    INPUT:
+          data     - numpy array - swath data; the last 2 axes are the swath
+          crop_idx - tuple       - (row, col) from regrid_MODIS_2_MAIA, or None
+                                   if data was already gathered onto the MAIA
+                                   grid when it was read
+    RETURN:
+          data on the MAIA grid
+    '''
+    if crop_idx is None:
+        return data
+
+    return data[..., crop_idx[0], crop_idx[1]]
+
 def build_data_base(filename_MOD_02, filename_MOD_03, filename_MOD_35, hf_path, hf, \
-                    group_name, fieldname, target_lat, target_lon):
+                    group_name, target_lat, target_lon, product_spec=default_product_spec,\
+                    gather_first=True, target_grid=None, regrid_cache=None,\
+                    granule=None):
     '''
     INPUT:
         filename_MOD_02 - str   - filepath to MOD02
@@ -49,324 +112,500 @@ def build_data_base(filename_MOD_02, filename_MOD_03, filename_MOD_35, hf_path,
         PTA_lon         - float - lon of projected target area
         hf_path         - str   - file path to previously created hdf5 file to
                                   store it in. (1 HDF5 file)/PTA
+        hf              - h5py file - open hf_path; if None nothing is
+                                  written and the datasets are returned, i.e.
+                                  for async_io.AsyncWriter
         group_name      - str   - time stamp of granule to name subgroup
+        product_spec    - dict  - bands and fields to save, see
+                                  product_spec.default_product_spec; only the
+                                  reads and decodes it needs are done
+        gather_first    - bool  - gather the raw counts/scaled ints at the
+                                  regrid indices before calibrating/decoding
+                                  them, so pixels outside the PTA are never
+                                  converted; if False the full swath is
+                                  calibrated and cropped afterwards
+        target_grid     - regrid.TargetGrid - KD-tree over target_lat/lon
+                                  built once and reused for every granule;
+                                  if None a tree is built over the swath
+        regrid_cache    - regrid_cache.RegridCache - on disk cache of regrid
+                                  indices shared by repeat passes; if None
+                                  the indices are always searched
+        granule         - read_MODIS_granule.Granule - granule already read
+                                  by Granule.load, i.e. on a prefetch thread;
+                                  if None the three files are opened here
     RETURN:
-        saves all calculated fields into hdf 5 file structure
+        saves all calculated fields into hdf 5 file structure, or returns
+        them as a list for write_granule if hf is None
     '''
 
-    rad_or_ref              = True
-    radiance_250_Aggr1km, scale_factor_rad_250m, scale_factor_ref_250m    = prepare_data(filename_MOD_02, fieldname[1], rad_or_ref)
-    radiance_500_Aggr1km, scale_factor_rad_500m, scale_factor_ref_500m    = prepare_data(filename_MOD_02, fieldname[3], rad_or_ref)
-    radiance_1KM, scale_factor_rad_1km, scale_factor_ref_1km              = prepare_data(filename_MOD_02, fieldname[4], rad_or_ref)
-
-    rad_or_ref              = False
-    reflectance_250_Aggr1km, scale_factor_rad_250m, scale_factor_ref_250m = prepare_data(filename_MOD_02, fieldname[1], rad_or_ref)
-    reflectance_500_Aggr1km, scale_factor_rad_500m, scale_factor_ref_500m = prepare_data(filename_MOD_02, fieldname[3], rad_or_ref)
-    reflectance_1KM, scale_factor_rad_1km, scale_factor_ref_1km           = prepare_data(filename_MOD_02, fieldname[4], rad_or_ref)
-
-    #grab scale factors for MODIS bands 3,4,1,2,6,26 (MAIA bands 4,5,6,9,12,13)
-    band_index = {'1':0,
-                  '2':1,
-                  '3':0,
-                  '4':1,
-                  '6':3,
-                  '26':14
-                  }
-
-    scale_factor_ref_500m_final = []
-    scale_factor_rad_500m_final = []
-    scale_factor_ref_1km_final  = []
-    scale_factor_rad_1km_final  = []
-
-    for band, index in band_index.items():
-        band = int(band)
-
-        if band == 3 or band == 4 or band ==6:
-            scale_factor_ref_500m_final.append(scale_factor_ref_500m[index])
-            scale_factor_rad_500m_final.append(scale_factor_rad_500m[index])
-        elif band == 26:
-            scale_factor_ref_1km_final.append(scale_factor_ref_1km[index])
-            scale_factor_rad_1km_final.append(scale_factor_rad_1km[index])
-        else:
-            pass
-    scale_factor_ref_500m_final = np.array(scale_factor_ref_500m_final)
-    scale_factor_rad_500m_final = np.array(scale_factor_rad_500m_final)
-    scale_factor_ref_1km_final  = np.array(scale_factor_ref_1km_final)
-    scale_factor_rad_1km_final  = np.array(scale_factor_rad_1km_final)
-
-    #in order MAIA  bands 6,9,4,5,12,13
-    #in order MODIS bands 1,2,3,4,6 ,26
-    scale_factor_rad = np.concatenate((scale_factor_rad_250m, scale_factor_rad_500m_final, scale_factor_rad_1km_final), axis=0)
-    scale_factor_ref = np.concatenate((scale_factor_ref_250m, scale_factor_ref_500m_final, scale_factor_ref_1km_final), axis=0)
+    product_spec = check_product_spec(product_spec)
+    read_plan    = plan_reads(product_spec)
 
-    #calculate band weighted solar irradiance using scale factors above
-    E_std_0 = np.pi * scale_factor_rad / scale_factor_ref
+    #open each of the MOD02/03/35 files once for the whole granule
+    #a product is only opened if the plan reads from it
+    if granule is None:
+        granule = Granule(filename_MOD_02, filename_MOD_03, filename_MOD_35)
 
     #calculate geolocation
-    lat = get_lat(filename_MOD_03).astype(np.float64)
-    lon = get_lon(filename_MOD_03).astype(np.float64)
+    lat = granule.get_lat().astype(np.float64)
+    lon = granule.get_lon().astype(np.float64)
+
+    #regrid first so everything else can be read straight onto the MAIA grid
+    #one KD-tree search gives both row and col indices and the fill mask
+    #repeat passes reuse cached indices; the cache searches on a miss
+    if regrid_cache is not None:
+        regrid_row_idx, regrid_col_idx, fill_mask = regrid_cache.get_regrid_idx(\
+                                lat, lon, target_lat, target_lon, target_grid)
+    elif target_grid is None:
+        regrid_row_idx, regrid_col_idx, fill_mask = get_regrid_idx(lat, lon,\
+                                                        target_lat, target_lon)
+    else:
+        regrid_row_idx, regrid_col_idx, fill_mask = target_grid.get_regrid_idx(lat, lon)
+
+    #grab fill values in regrid col/row idx
+    #use these positions to write fill values when regridding the rest of the data
+    fill_val_idx = np.where(fill_mask)
 
-    #calculate geometry
-    solarZenith   = get_solarZenith(filename_MOD_03)
-    sensorZenith  = get_sensorZenith(filename_MOD_03)
-    solarAzimuth  = get_solarAzimuth(filename_MOD_03)
-    sensorAzimuth = get_sensorAzimuth(filename_MOD_03)
+    regrid_row_idx[fill_val_idx] = regrid_row_idx[0,0]
+    regrid_col_idx[fill_val_idx] = regrid_col_idx[0,0]
 
-    #calculate cloudmask
-    data_SD, hdf_file = get_data(filename_MOD_35, 'Cloud_Mask', 2, True)
-    data_SD_bit       = get_bits(data_SD, 0)
-    data_decoded_bits = decode_byte_1(data_SD_bit)
+    #read_idx gathers while reading, crop_idx crops after the fact
+    if gather_first:
+        read_idx, crop_idx = (regrid_row_idx, regrid_col_idx), None
+    else:
+        read_idx, crop_idx = None, (regrid_row_idx, regrid_col_idx)
+
+    #radiance, reflectance and band weighted solar irradiance from one read of
+    #each field; only the planes of the MODIS bands in the spec are read
+    radiance, reflectance, E_std_0_band = {}, {}, {}
+    for MOD02_fieldname, bands in read_plan['MOD_02'].items():
+        field_radiance, field_reflectance, field_E_std_0 = \
+              granule.get_radiance_and_reflectance(MOD02_fieldname, bands,\
+                                                   rad=read_plan['radiance'],\
+                                                   ref=read_plan['reflectance'],\
+                                                   regrid_idx=read_idx)
+        for index, band in enumerate(bands):
+            E_std_0_band[band] = field_E_std_0[index]
+            if read_plan['radiance']:
+                radiance[band]    = field_radiance[index]
+            if read_plan['reflectance']:
+                reflectance[band] = field_reflectance[index]
 
-    #calculate cloud mask tests
-    data_SD_cloud_mask       = data_SD
-    decoded_cloud_mask_tests = decode_tests(data_SD_cloud_mask, filename_MOD_35)
+    #calculate geometry
+    #kept as the MOD03 int16 counts, saved with their scale factor
+    sunView_geometry, sunView_scale_factor = {}, {}
+    for sun_key in read_plan['MOD_03']:
+        sunView_geometry[sun_key]     = granule.get_gathered_data('MOD_03',\
+                                            geometry_fieldnames[sun_key], read_idx)
+        sunView_scale_factor[sun_key] = granule.get_attributes('MOD_03',\
+                                            geometry_fieldnames[sun_key])['scale_factor']
+
+    #calculate cloudmask and cloud mask tests from one read of the Cloud_Mask
+    #bytes; Quality_Assurance is only needed by the tests
+    if read_plan['cloud_mask'] or read_plan['cloud_mask_tests']:
+        data_SD = granule.get_cloud_mask(read_idx)
+    if read_plan['cloud_mask']:
+        data_decoded_bits = decode_byte_1_shift(data_SD)
+    if read_plan['cloud_mask_tests']:
+        decoded_cloud_mask_tests = decode_tests_shift(data_SD,\
+                                            granule.get_quality_assurance(read_idx))
 
     #grab earth sun distance
-    earth_sun_dist = get_earth_sun_dist(filename_MOD_02)
+    if read_plan['MOD_02']:
+        earth_sun_dist = granule.get_earth_sun_dist()
 
     #get MOD03 surface types
-    MOD03_LandSeaMask = get_LandSeaMask(filename_MOD_03)
-
-    hdf_file.end()
-
-    #ceate structure in hdf file
-    group                       = hf.create_group(group_name)
-    subgroup_radiance           = group.create_group('radiance')
-    #subgroup_reflectance        = group.create_group('reflectance')
-    subgroup_scale_factors      = group.create_group('scale_factors')
-    subgroup_geolocation        = group.create_group('geolocation')
-    subgroup_sunView_geometry   = group.create_group('sunView_geometry')
-    subgroup_cloud_mask         = group.create_group('cloud_mask')
-    #subgroup_cloud_mask_test    = group.create_group('cloud_mask_tests')
-
-
-    nx, ny = np.shape(lat)
-    rows = np.arange(nx)
-    cols = np.arange(ny)
-    col_mesh, row_mesh = np.meshgrid(cols, rows)
-
-    regrid_row_idx = regrid_MODIS_2_MAIA(np.copy(lat),\
-                                         np.copy(lon),\
-                                         np.copy(target_lat),\
-                                         np.copy(target_lon),\
-                                         np.copy(row_mesh).astype(np.float64)).astype(np.int)
-
-    regrid_col_idx = regrid_MODIS_2_MAIA(np.copy(lat),\
-                                         np.copy(lon),\
-                                         np.copy(target_lat),\
-                                         np.copy(target_lon),\
-                                         np.copy(col_mesh).astype(np.float64)).astype(np.int)
-
-    #grab -999 fill values in regrid col/row idx
-    #use these positions to write fill values when regridding the rest of the data
-    fill_val = -999
-    fill_val_idx = np.where((regrid_row_idx == fill_val) | \
-                            (regrid_col_idx == fill_val)   )
-
-    regrid_row_idx[fill_val_idx] = regrid_row_idx[0,0]
-    regrid_col_idx[fill_val_idx] = regrid_col_idx[0,0]
-
-    #crop and save the datasets*************************************************
+    if read_plan['LandSeaMask']:
+        MOD03_LandSeaMask = granule.get_LandSeaMask(read_idx)
 
-    #save band weighted solar irradiance
-    save_crop(group, 'band_weighted_solar_irradiance', E_std_0)
+    granule.close()
 
-    #save earth sun distance
-    save_crop(group, 'earth_sun_distance', earth_sun_dist, compress=False)
+    #(subgroup, dataset name, data, compress, attributes) of the granule, in
+    #the order they are written
+    datasets = []
 
-    #reflectance and radiance
-
-    for band, index in band_index.items():
-        if band=='1' or band=='2':
-            crop_radiance = radiance_250_Aggr1km[index][regrid_row_idx, regrid_col_idx]
-            #crop_reflectance = reflectance_250_Aggr1km[index][regrid_row_idx, regrid_col_idx]
+    #crop and save the datasets*************************************************
 
-            #Apply fill values
-            crop_radiance[fill_val_idx]    = fill_val
-            #crop_reflectance[fill_val_idx] = fill_val
+    if read_plan['MOD_02']:
+        #save band weighted solar irradiance
+        #in the order of the radiance bands of the spec, then reflectance bands
+        spec_bands = []
+        for band in product_spec['radiance'] + product_spec['reflectance']:
+            if str(band) not in spec_bands:
+                spec_bands.append(str(band))
+        E_std_0 = np.array([E_std_0_band[band] for band in spec_bands])
+        datasets.append(('', 'band_weighted_solar_irradiance', E_std_0, True, None))
 
-        elif band=='3' or band=='4' or band=='6':
-            crop_radiance = radiance_500_Aggr1km[index][regrid_row_idx, regrid_col_idx]
-            #crop_reflectance = reflectance_500_Aggr1km[index][regrid_row_idx, regrid_col_idx]
+        #save earth sun distance
+        datasets.append(('', 'earth_sun_distance', earth_sun_dist, False, None))
 
-            #Apply fill values
-            crop_radiance[fill_val_idx]    = fill_val
-            #crop_reflectance[fill_val_idx] = fill_val
+    #pixels of the MAIA grid with a swath neighbor, one bit per pixel
+    datasets.append(('', 'valid_mask', pack_valid_mask(fill_mask), True,\
+                     {'shape': np.shape(fill_mask)}))
 
-        else:
-            crop_radiance = radiance_1KM[index][regrid_row_idx, regrid_col_idx]
-            #crop_reflectance = reflectance_1KM[index][regrid_row_idx, regrid_col_idx]
+    #reflectance and radiance
+    units = {'radiance': 'W m-2 sr-1 um-1', 'reflectance': '1'}
+    for subgroup_name, calibrated in (('radiance', radiance), ('reflectance', reflectance)):
+        if not product_spec[subgroup_name]:
+            continue
+        for band in product_spec[subgroup_name]:
+            crop_calibrated = regrid_crop(calibrated[str(band)], crop_idx)
 
             #Apply fill values
-            crop_radiance[fill_val_idx]    = fill_val
-            #crop_reflectance[fill_val_idx] = fill_val
+            crop_calibrated = encode(crop_calibrated, fill_val_idx, np.float32, float_fill_value)
 
-        #group_name is granule, radiance is subgroup, band_1 is dataset, then the data
-        save_crop(subgroup_radiance, 'band_{}'.format(band), crop_radiance)
-        #save_crop(subgroup_reflectance, 'band_{}'.format(band), crop_reflectance)
+            #group_name is granule, radiance is subgroup, band_1 is dataset, then the data
+            datasets.append((subgroup_name, 'band_{}'.format(band), crop_calibrated, True,\
+                             get_attributes(np.float32, float_fill_value,\
+                                            units=units[subgroup_name])))
 
     #*******************************************************************************
     #Sun view geometry
-    sunView_geometry = {'solarAzimuth':solarAzimuth,\
-                        'sensorAzimuth':sensorAzimuth,\
-                        'solarZenith':solarZenith,\
-                        'sensorZenith':sensorZenith
-                        }
     for sun_key, sun_val in sunView_geometry.items():
-        crop_sun = sun_val[regrid_row_idx, regrid_col_idx]
+        crop_sun = regrid_crop(sun_val, crop_idx)
 
         #Apply fill values
-        crop_sun[fill_val_idx] = fill_val
+        crop_sun = encode(crop_sun, fill_val_idx, np.int16, geometry_fill_value)
 
-        save_crop(subgroup_sunView_geometry, sun_key, crop_sun)
+        datasets.append(('sunView_geometry', sun_key, crop_sun, True,\
+                         get_attributes(np.int16, geometry_fill_value,\
+                                        sunView_scale_factor[sun_key], 'degrees')))
 
     #*******************************************************************************
     #Geo Location
-    crop_lat = np.copy(target_lat)
-    crop_lon = np.copy(target_lon)
-
-    #Apply fill values
-    crop_lat[fill_val_idx] = fill_val
-    crop_lon[fill_val_idx] = fill_val
+    geolocation = {'lat':target_lat, 'lon':target_lon}
+    for geo_key in product_spec['geolocation']:
+        #Apply fill values
+        crop_geo = encode(geolocation[geo_key], fill_val_idx, np.float32, float_fill_value)
 
-    save_crop(subgroup_geolocation, 'lat', crop_lat)
-    save_crop(subgroup_geolocation, 'lon', crop_lon)
+        datasets.append(('geolocation', geo_key, crop_geo, True,\
+                         get_attributes(np.float32, float_fill_value, units='degrees')))
 
     #*******************************************************************************
     #cloud mask
-    cloud_mask = {'Cloud_Mask_Flag':data_decoded_bits[0],\
-                  'Day_Night_Flag':data_decoded_bits[2],\
-                  'Sun_glint_Flag':data_decoded_bits[3],\
-                  'Snow_Ice_Background_Flag':data_decoded_bits[4],\
-                  'Land_Water_Flag':data_decoded_bits[5],\
-                  'Unobstructed_FOV_Quality_Flag':data_decoded_bits[1]\
-                  }
-    for cm_key, cm_val in cloud_mask.items():
-        crop_cm = cm_val[regrid_row_idx, regrid_col_idx]
+    for cm_key in product_spec['cloud_mask']:
+        cm_val = data_decoded_bits[cloud_mask_names.index(cm_key)]
+        crop_cm = regrid_crop(cm_val, crop_idx)
 
         #Apply fill values
-        crop_cm[fill_val_idx] = fill_val
+        crop_cm = encode(crop_cm, fill_val_idx, np.uint8, flag_fill_value)
 
-        save_crop(subgroup_cloud_mask, cm_key, crop_cm)
+        datasets.append(('cloud_mask', cm_key, crop_cm, True,\
+                         get_attributes(np.uint8, flag_fill_value)))
 
     #*******************************************************************************
     #add in MOD03 surface types
-    crop_MOD03_LandSeaMask = MOD03_LandSeaMask[regrid_row_idx, regrid_col_idx]
-    #put in main group since it is not compatible in a sub group
-    save_crop(group, 'MOD03_LandSeaMask', crop_MOD03_LandSeaMask)
+    if read_plan['LandSeaMask']:
+        crop_MOD03_LandSeaMask = regrid_crop(MOD03_LandSeaMask, crop_idx)
+        crop_MOD03_LandSeaMask = encode(crop_MOD03_LandSeaMask, fill_val_idx,\
+                                        np.uint8, flag_fill_value)
+        #put in main group since it is not compatible in a sub group
+        datasets.append(('', 'MOD03_LandSeaMask', crop_MOD03_LandSeaMask, True,\
+                         get_attributes(np.uint8, flag_fill_value)))
 
     #*******************************************************************************
-
     #cloud mask tests
     #cm test vals set to 9 are bad data
-    #cloud_mask_tests = {'High_Cloud_Flag_1380nm':decoded_cloud_mask_tests[0],\
-    #                    'Cloud_Flag_Visible_Ratio':decoded_cloud_mask_tests[2],\
-    #                    'Near_IR_Reflectance':decoded_cloud_mask_tests[3],\
-    #                    'Cloud_Flag_Spatial_Variability':decoded_cloud_mask_tests[4],\
-    #                    'Cloud_Flag_Visible_Reflectance':decoded_cloud_mask_tests[1]\
-    #                    }
-    #for cm_test_key, cm_test_val in cloud_mask_tests.items():
-    #    cm_test_val  = cm_test_val.astype(np.float64)
-    #    crop_cm_test = cm_test_val[regrid_row_idx, regrid_col_idx]
+    for cm_test_key in product_spec['cloud_mask_tests']:
+        cm_test_val  = decoded_cloud_mask_tests[cloud_mask_tests_names.index(cm_test_key)]
+        crop_cm_test = regrid_crop(cm_test_val, crop_idx)
+
+        #Apply fill values
+        crop_cm_test = encode(crop_cm_test, fill_val_idx, np.uint8, flag_fill_value)
+
+        datasets.append(('cloud_mask_tests', cm_test_key, crop_cm_test, True,\
+                         get_attributes(np.uint8, flag_fill_value)))
+
+    #*******************************************************************************
+    if hf is None:
+        return datasets
+    write_granule(hf, group_name, datasets)
 
-    #    #Apply fill values
-    #    crop_cm_test[fill_val_idx] = fill_val
+def finish_run(catalog, database_path, manifest_records):
+    '''
+    INPUT:
+          catalog          - GranuleCatalog - opened by rank 0; closed here
+          database_path    - str  - master file of the database
+          manifest_records - dict - load_manifest of every rank
+    Objective:
+        rank 0, after every rank closed its shard and manifest: the prescreen
+        results the ranks recorded go in the catalog in one transaction (no
+        concurrent sqlite writes over NFS) and every shard is indexed in the
+        master file
+    '''
+    catalog.update_prescreens([(record['time_stamp'], record['day_night'],\
+                                record['coverage']) for record in\
+                               manifest_records.values() if 'day_night' in record])
+    catalog.close()
 
-    #    save_crop(subgroup_cloud_mask_test, cm_test_key, crop_cm_test)
+    write_database_index(database_path, get_manifest_shard_index(manifest_records))
 
 if __name__ == '__main__':
     import mpi4py.MPI as MPI
-    import pandas as pd
-    import tables
-    tables.file._open_files.close_all()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='build the PTA database from '\
+                                     'MOD021KM/MOD03/MOD35_L2 granules')
+    parser.add_argument('product_spec', nargs='?', default=None,\
+                        help='json product spec to build another database '\
+                             'variant, see product_spec.py')
+    parser.add_argument('--resume', action='store_true',\
+                        help='only ingest granules missing from the manifest, '\
+                             'failed, or whose input files changed')
+    parser.add_argument('--schedule', choices=['dynamic', 'static'], default='dynamic',\
+                        help='dynamic: rank 0 hands granules to idle ranks, '\
+                             'largest first; static: contiguous slice per rank')
+    parser.add_argument('--prefetch', type=int, default=1,\
+                        help='granules read ahead on the reader thread')
+    parser.add_argument('--write-queue', type=int, default=2,\
+                        help='processed granules waiting for the writer thread')
+    args = parser.parse_args()
 
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     size = comm.Get_size()
 
-    for r in range(size):
-
-        if rank==r:
-            print('entering rank '+str(r))
-
-            #choose PTA from keeling
-            PTA_file_path   = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data'
-
-            #grab files names for PTA
-            filename_MOD_02 = np.array(os.listdir(PTA_file_path + '/MOD_02'))
-            filename_MOD_03 = np.array(os.listdir(PTA_file_path + '/MOD_03'))
-            filename_MOD_35 = np.array(os.listdir(PTA_file_path + '/MOD_35'))
-
-            #sort files by time so we can access corresponding files without
-            #searching in for loop
-            filename_MOD_02 = np.sort(filename_MOD_02)
-            filename_MOD_03 = np.sort(filename_MOD_03)
-            filename_MOD_35 = np.sort(filename_MOD_35)
-
-            #grab time stamp (YYYYDDD.HHMM) to name each group after the granule
-            #it comes from
-            filename_MOD_02_timeStamp = [x[10:22] for x in filename_MOD_02]
-            filename_MOD_03_timeStamp = [x[7:19]  for x in filename_MOD_03]
-            filename_MOD_35_timeStamp = [x[10:22] for x in filename_MOD_35]
-
-            #add full path to file
-            filename_MOD_02 = [PTA_file_path + '/MOD_02/' + x for x in filename_MOD_02]
-            filename_MOD_03 = [PTA_file_path + '/MOD_03/' + x for x in filename_MOD_03]
-            filename_MOD_35 = [PTA_file_path + '/MOD_35/' + x for x in filename_MOD_35]
-
-            #initialize some constants outside of the loop
-            fieldname       = ['EV_250_RefSB', 'EV_250_Aggr1km_RefSB',\
-                               'EV_500_RefSB', 'EV_500_Aggr1km_RefSB',\
-                               'EV_1KM_RefSB']
-
-            file_MAIA  = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MAIA.hdf5'
-            file_MAIA  = h5py.File(file_MAIA, 'r')
-            target_lat = file_MAIA['lat'][()].astype(np.float64)
-            target_lon = file_MAIA['lon'][()].astype(np.float64)
-
-            #define start and end file for a particular rank
-            #(size - 1) so last processesor can take the modulus
-            end               = len(filename_MOD_02)
-            processes_per_cpu = end // (size-1)
-            start             = rank * processes_per_cpu
-
-            if rank < (size-1):
-                end = (rank+1) * processes_per_cpu
-            elif rank==(size-1):
-                processes_per_cpu_last = end % (size-1)
-                end = (rank * processes_per_cpu) + processes_per_cpu_last
-
-            #create/open file
-            #open file to write status of algorithm to
-            database_loc = 'try2_database/LA_database_60_cores'
-            hf_path = '{}/{}/LA_PTA_database_mpi_start_{:0>5d}_end_{:0>5d}_try2.hdf5'.format(PTA_file_path, database_loc, start, end)
-            output_path = './MPI_create_dataset_output/create_dataset_status_start_{:0>5d}_end_{:0>5d}_try2.txt'.format(start, end)
-
-            with h5py.File(hf_path, 'w') as hf:
-                output = open(output_path, 'w')
-
-                i=1
-                print('entering for loop in rank '+str(r))
-                for MOD02, MOD03, MOD35, time_MOD02, time_MOD03, time_MOD35\
-                                       in zip(filename_MOD_02[start:end]          ,\
-                                              filename_MOD_03[start:end]          ,\
-                                              filename_MOD_35[start:end]          ,\
-                                              filename_MOD_02_timeStamp[start:end],\
-                                              filename_MOD_03_timeStamp[start:end],\
-                                              filename_MOD_35_timeStamp[start:end]):
-
-                    if int(time_MOD02[4:7]) >=48 and int(time_MOD02[4:7]) <= 55:
-                        #try:
-                        build_data_base(MOD02, MOD03, MOD35, hf_path, hf, time_MOD02, fieldname,\
-                                        target_lat, target_lon)
-
-                        #    output.write('{:0>5d}, {}, {}'.format(i, time_MOD02, 'added to database\n'))
-                        #except Exception as e:
-
-                        #    output.write('{:0>5d}, {}, {}, {}'.format(i, time_MOD02, e, '\n'))
-                        print(i)
-                    i+=1
-                print('done with for loop in rank '+str(r))
-                hf.close()
-                output.close()
-
+    print('entering rank '+str(rank))
+
+    #choose PTA from keeling
+    PTA_file_path   = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data'
+    database_loc    = 'try2_database/LA_database_60_cores'
+    #kept outside database_loc, which must only hold the hdf5 shards
+    manifest_dir    = '{}/try2_database/manifest'.format(PTA_file_path)
+    #one logical database: links to every granule in the rank shards
+    database_path   = '{}/try2_database/LA_PTA_database.hdf5'.format(PTA_file_path)
+
+    #skip night passes and granules that barely touch the PTA from a
+    #subsample of MOD03 lat/lon, before any radiance/cloud mask I/O; a resumed
+    #run prescreens again the granules skipped under other settings
+    prescreen_settings = {'min_coverage': 0.05, 'day_only': True}
+
+    #rank 0 decides what to ingest, with the DOY window applied before the
+    #work is distributed, and before any rank appends to the manifest
+    if rank == 0:
+        #MOD02/03/35 triplets matched on time stamp (YYYYDDD.HHMM) by the
+        #granule catalog (see granule_catalog.py to build it); only rank 0
+        #opens it, the other ranks put their prescreen results in the manifest
+        catalog_path = PTA_file_path + '/granule_catalog.sqlite'
+        catalog      = GranuleCatalog(catalog_path)
+        #GranuleCatalog creates a missing catalog empty; running on it would
+        #ingest nothing and still exit 0
+        if catalog.count() == 0:
+            print('granule catalog {} has no granules, build it with '\
+                  'granule_catalog.py'.format(catalog_path))
+            comm.Abort(1)
+        #files granule_validation found corrupt are left out
+        rows     = catalog.query(doy_start=48, doy_end=55, exclude_invalid=True)
+        granules = [dict(granule) for granule in rows]
+        for granule in granules:
+            granule['checksum'] = get_input_checksum([granule['MOD_02'],\
+                                           granule['MOD_03'], granule['MOD_35']])
+        if args.resume:
+            manifest_records = load_manifest(manifest_dir)
+            granules = [granule for granule in granules if needs_processing(\
+                        manifest_records.get(granule['time_stamp']), granule['checksum'],\
+                        prescreen_settings)]
+
+        #a resumed run writes new files instead of overwriting the
+        #ones holding already ingested granules
+        if args.resume:
+            run_name = time.strftime('resume_%Y%m%dT%H%M%S')
+        else:
+            run_name = 'try2'
+    else:
+        granules, run_name = None, None
+    run_name = comm.bcast(run_name, root=0)
+
+    if args.schedule == 'static':
+        granules = comm.bcast(granules, root=0)
+
+        #define start and end file for a particular rank
+        #(size - 1) so last processesor can take the modulus
+        end               = len(granules)
+        processes_per_cpu = end // (size-1)
+        start             = rank * processes_per_cpu
+
+        if rank < (size-1):
+            end = (rank+1) * processes_per_cpu
+        elif rank==(size-1):
+            processes_per_cpu_last = end % (size-1)
+            end = (rank * processes_per_cpu) + processes_per_cpu_last
+
+        shard_name = 'start_{:0>5d}_end_{:0>5d}_{}'.format(start, end, run_name)
+
+    elif rank == 0:
+        #rank 0 only dispatches; the input size stands in for the cost
+        weights = [granule['size_MOD_02'] + granule['size_MOD_03'] + granule['size_MOD_35']\
+                   for granule in granules]
+        stats   = dispatch(comm, granules, weights)
+
+        utilization = format_utilization(stats)
+        print(utilization)
+        with open('./MPI_create_dataset_output/utilization_{}.txt'.format(run_name), 'w') as output:
+            output.write(utilization + '\n')
+
+        #every shard and manifest is closed once all workers reach the barrier
+        comm.Barrier()
+        finish_run(catalog, database_path, load_manifest(manifest_dir))
+        sys.exit(0)
+
+    else:
+        shard_name = 'rank_{:0>5d}_{}'.format(rank, run_name)
+
+    #what to save for each granule
+    if args.product_spec is not None:
+        product_spec = load_product_spec(args.product_spec)
+    else:
+        product_spec = default_product_spec
+
+    file_MAIA  = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MAIA.hdf5'
+    file_MAIA  = h5py.File(file_MAIA, 'r')
+    target_lat = file_MAIA['lat'][()].astype(np.float64)
+    target_lon = file_MAIA['lon'][()].astype(np.float64)
+
+    #KD-tree over the MAIA grid, reused by every granule of this rank
+    target_grid = TargetGrid(target_lat, target_lon)
+
+    #regrid indices shared by repeat passes of the ground track
+    regrid_cache = RegridCache(PTA_file_path + '/regrid_idx_cache')
+
+    prescreen = Prescreen(target_lat, target_lon, **prescreen_settings)
+
+    #create/open file
+    #open file to write status of algorithm to
+    hf_path = '{}/{}/LA_PTA_database_mpi_{}.hdf5'.format(PTA_file_path, database_loc, shard_name)
+    output_path = './MPI_create_dataset_output/create_dataset_status_{}.txt'.format(shard_name)
+
+    manifest = ProcessingManifest(manifest_dir, rank)
+
+    #reads planned once, the reader thread loads exactly what build_data_base uses
+    read_plan = plan_reads(check_product_spec(product_spec))
+
+    with h5py.File(hf_path, 'w') as hf:
+        output = open(output_path, 'w')
+        #the main and the writer thread both log granules
+        output_lock = threading.Lock()
+
+        def log(line):
+            with output_lock:
+                output.write(line)
+
+        def load_granule(granule):
+            #reader thread: every HDF4 read of the granule, prescreen included
+            if granule['coverage'] is None:
+                screen = prescreen.check(granule['MOD_03'])
+            else:
+                screen = {'process'  : prescreen.passes(granule['coverage'],\
+                                                        granule['day_night']),\
+                          'coverage' : granule['coverage'],\
+                          'day_night': granule['day_night']}
+            if not screen['process']:
+                return screen, None
+
+            loaded = Granule(granule['MOD_02'], granule['MOD_03'], granule['MOD_35'])
+            try:
+                loaded.load(read_plan)
+            except:
+                loaded.close()
+                raise
+
+            return screen, loaded
+
+        def write_and_flush(time_stamp, datasets):
+            #writer thread
+            write_granule(hf, time_stamp, datasets)
+            #on disk before the manifest says so
+            hf.flush()
+
+        def ingest_granule(prefetched):
+            granule, loaded, error = prefetched
+            MOD02, MOD03, MOD35 = granule['MOD_02'], granule['MOD_03'], granule['MOD_35']
+            #time stamp names each group after the granule it comes from
+            time_MOD02 = granule['time_stamp']
+            checksum   = granule['checksum']
+
+            if error is not None:
+                manifest.record(time_MOD02, 'failed', hf_path, checksum, repr(error))
+                log('{}, {}, {}'.format(time_MOD02, error, '\n'))
+                return
+
+            #prescreen results recorded by earlier runs are reused; a new one
+            #goes in every manifest record of the granule for rank 0
+            screen, loaded_granule = loaded
+            if granule['coverage'] is None:
+                new_screen = (screen['day_night'], screen['coverage'])
+            else:
+                new_screen = None
+
+            def on_written(error):
+                #writer thread; write_granule already dropped a partial group
+                if error is None:
+                    manifest.record(time_MOD02, 'done', hf_path, checksum,\
+                                    prescreen=new_screen)
+                    log('{}, {}'.format(time_MOD02, 'added to database\n'))
+                else:
+                    manifest.record(time_MOD02, 'failed', hf_path, checksum, repr(error),\
+                                    prescreen=new_screen)
+                    log('{}, {}, {}'.format(time_MOD02, error, '\n'))
+
+            #nothing may escape to work(), a granule that fails is recorded
+            #as failed and the rank goes on with the next one
+            try:
+                if not screen['process']:
+                    log('{}, skipped {} coverage {:.3f}\n'.format(\
+                        time_MOD02, screen['day_night'], screen['coverage']))
+                    manifest.record(time_MOD02, 'skipped', None, checksum,\
+                                    prescreen=new_screen,\
+                                    prescreen_settings=prescreen_settings)
+                    return
+
+                datasets = build_data_base(MOD02, MOD03, MOD35, hf_path, None, time_MOD02,\
+                                           target_lat, target_lon, product_spec=product_spec,\
+                                           target_grid=target_grid, regrid_cache=regrid_cache,\
+                                           granule=loaded_granule)
+
+                #blocks while the writer is args.write_queue granules behind
+                writer.submit((time_MOD02, datasets), on_written)
+            except Exception as e:
+                manifest.record(time_MOD02, 'failed', hf_path, checksum, repr(e),\
+                                prescreen=new_screen)
+                log('{}, {}, {}'.format(time_MOD02, e, '\n'))
+
+        print('entering for loop in rank '+str(rank))
+        prefetch = args.prefetch
+        if args.schedule == 'static':
+            tasks = granules[start:end]
+        else:
+            #asks rank 0 for the next granule while this one is processed
+            tasks = get_tasks(comm)
+            #that is MPI from the reader thread, the main thread sends the
+            #report; without THREAD_SERIALIZED everything stays on this thread
+            if prefetch > 0 and MPI.Query_thread() < MPI.THREAD_SERIALIZED:
+                print('rank {}: MPI thread level below THREAD_SERIALIZED, '\
+                      'prefetch disabled'.format(rank))
+                prefetch = 0
+        prefetched_tasks = Prefetcher(load_granule, tasks, depth=prefetch)
+
+        with AsyncWriter(write_and_flush, max_queue=args.write_queue) as writer:
+            if args.schedule == 'static':
+                try:
+                    for prefetched in prefetched_tasks:
+                        ingest_granule(prefetched)
+                except:
+                    prefetched_tasks.close()
+                    raise
+            else:
+                #closes prefetched_tasks and reports to rank 0 if it fails
+                work(comm, ingest_granule, prefetched_tasks)
+        print('done with for loop in rank '+str(rank))
+        print('regrid cache hits {} misses {}'.format(regrid_cache.hits, regrid_cache.misses))
+        print('prescreen skipped {} granules'.format(prescreen.skipped))
+        hf.close()
+        output.close()
+        manifest.close()
+
+    #once all ranks closed their shards and manifests, rank 0 alone writes
+    #the catalog and the master file
+    comm.Barrier()
+    if rank == 0 and args.schedule == 'static':
+        finish_run(catalog, database_path, load_manifest(manifest_dir))
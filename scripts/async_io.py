@@ -0,0 +1,144 @@
+'''
+author: Javier Villegas
+
+Overlap of the I/O and compute of database ingest on one rank. A Prefetcher
+runs the HDF4 reads of the next granules on one background thread while the
+current granule is regridded; one thread only, since HDF4 is not thread
+safe. An AsyncWriter writes the finished granules to the hdf5 shard from a
+bounded queue, so the reads, the regridding and the gzip writes of three
+different granules run at the same time. Both queues are bounded, which
+caps the granules held in memory at prefetch depth + writer depth + 1.
+'''
+import threading
+import queue
+import sys
+
+#marks the end of a queue
+_stop = object()
+
+class Prefetcher(object):
+    '''
+    INPUT:
+          load  - function - called on the background thread with each item,
+                             i.e. reads a granule into memory
+          items - iterable - consumed on the background thread only, so it
+                             may itself do I/O, i.e. ask for the next task
+          depth - int      - items loaded ahead of the one being processed;
+                             0 loads each item on the iterating thread, with
+                             no background thread
+    Iterate over it to get (item, loaded, error) in the order of items;
+    error is the exception load raised (loaded is None) or None. Call
+    close() if the iteration is abandoned before the end.
+    '''
+
+    def __init__(self, load, items, depth=1):
+        self.load    = load
+        self.items   = items
+        self._cancel = threading.Event()
+        if depth < 1:
+            self.loaded, self.thread = None, None
+            return
+        self.loaded  = queue.Queue(maxsize=depth)
+        self.thread  = threading.Thread(target=self._run, name='prefetch', daemon=True)
+        self.thread.start()
+
+    def _load(self, item):
+        try:
+            return item, self.load(item), None
+        except Exception as e:
+            return item, None, e
+
+    def _run(self):
+        try:
+            for item in self.items:
+                if self._cancel.is_set():
+                    break
+                self.loaded.put(self._load(item))
+        finally:
+            self.loaded.put(_stop)
+
+    def __iter__(self):
+        if self.thread is None:
+            for item in self.items:
+                if self._cancel.is_set():
+                    break
+                yield self._load(item)
+            return
+
+        while True:
+            next_item = self.loaded.get()
+            if next_item is _stop:
+                break
+            yield next_item
+        self.thread.join()
+
+    def close(self):
+        '''
+        stop loading after the current item, i.e. when the consumer failed;
+        once it returns the background thread no longer touches items
+        '''
+        self._cancel.set()
+        if self.thread is None:
+            return
+        while self.thread.is_alive():
+            try:
+                self.loaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+class AsyncWriter(object):
+    '''
+    INPUT:
+          write     - function - write(*args) run on the writer thread, i.e.
+                                 MPI_create_dataset.write_granule
+          max_queue - int      - writes waiting at most; submit blocks while
+                                 the queue is full so memory stays bounded
+    Use as a context manager or call close(), which waits for every write.
+    '''
+
+    def __init__(self, write, max_queue=2):
+        self.write   = write
+        self.pending = queue.Queue(maxsize=max_queue)
+        self.thread  = threading.Thread(target=self._run, name='writer', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        while True:
+            job = self.pending.get()
+            if job is _stop:
+                break
+            args, on_done = job
+            try:
+                self.write(*args)
+                error = None
+            except Exception as e:
+                error = e
+            #on_done runs on the writer thread too, i.e. to record the
+            #granule in the manifest only once it is on disk
+            if on_done is not None:
+                try:
+                    on_done(error)
+                except Exception as e:
+                    print('writer callback failed: {!r}'.format(e), file=sys.stderr)
+
+    def submit(self, args, on_done=None):
+        '''
+        INPUT:
+              args    - tuple    - arguments of write
+              on_done - function - called with None or the exception of write
+        '''
+        if not self.thread.is_alive():
+            raise RuntimeError('writer thread is not running')
+        self.pending.put((args, on_done))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.pending.put(_stop)
+            self.thread.join()
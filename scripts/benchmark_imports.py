@@ -0,0 +1,97 @@
+'''
+author: Javier Villegas
+
+Import time of the modules every MPI rank loads at startup. Each module is
+imported in a fresh interpreter with python -X importtime, so nothing is
+cached between modules, and the run fails if a module pulls in one of the
+plotting/PyTables packages the ranks never use, or takes longer than the
+budget. A module that fails to import fails the run too, unless
+--skip-missing is given and what is missing is an optional dependency (i.e.
+pyhdf on a machine without HDF4).
+
+    python benchmark_imports.py [--skip-missing] [max_seconds] [module ...]
+'''
+import argparse
+import subprocess
+import sys
+
+#modules imported by MPI_create_dataset, calc_observables, calc_OLP and
+#group_data_by_OLP before any work is done
+rank_modules = ['read_MODIS_02', 'read_MODIS_03', 'read_MODIS_35',\
+                'read_MODIS_granule', 'regrid', 'regrid_cache', 'prescreen',\
+                'granule_catalog', 'processing_manifest', 'mpi_work_queue',\
+                'async_io', 'database_index', 'database_encoding',\
+                'product_spec', 'MPI_create_dataset', 'calc_observables',\
+                'spatial_variability', 'calc_OLP']
+
+#must never be imported on the rank startup path
+forbidden_modules = ['matplotlib', 'tables', 'pandas', 'astropy']
+
+def time_import(module, repeat=3):
+    '''
+    INPUT:
+          module - str - module to import
+          repeat - int - fresh interpreters to time; the fastest is kept
+    RETURN:
+          dict - {'module', 'seconds' (cumulative import time of module),
+                  'forbidden' (forbidden packages it imported), 'error'}
+    '''
+    check = 'import sys; import {}; print(",".join(name for name in {!r} '\
+            'if name in sys.modules))'.format(module, forbidden_modules)
+    result = {'module': module, 'seconds': None, 'forbidden': [], 'error': None}
+    for i in range(repeat):
+        run = subprocess.run([sys.executable, '-X', 'importtime', '-c', check],\
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,\
+                             universal_newlines=True)
+        if run.returncode != 0:
+            result['error'] = run.stderr.strip().splitlines()[-1]
+            return result
+
+        #"import time: self [us] | cumulative | imported package", the top
+        #level module is the last line naming it without indentation
+        seconds = None
+        for line in run.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].rstrip() == ' ' + module:
+                seconds = int(fields[1]) * 1e-6
+        if seconds is not None and (result['seconds'] is None or seconds < result['seconds']):
+            result['seconds'] = seconds
+        result['forbidden'] = [name for name in run.stdout.strip().split(',') if name]
+
+    return result
+
+def is_missing_dependency(result):
+    '''
+    RETURN:
+          bool - True if the module failed to import because a package it
+                 depends on (not the module itself) is not installed
+    '''
+    error = result['error'] or ''
+    return error.startswith('ModuleNotFoundError') and\
+           "'{}'".format(result['module']) not in error
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('max_seconds', type=float, nargs='?', default=2.)
+    parser.add_argument('modules', nargs='*', default=rank_modules)
+    parser.add_argument('--skip-missing', action='store_true',\
+                        help='do not fail on modules whose dependencies are not installed')
+    args = parser.parse_args()
+
+    failed = False
+    print('{:<22s} {:>10s}  {}'.format('module', 'import [s]', 'forbidden imports / error'))
+    for module in args.modules:
+        result = time_import(module)
+        if result['error'] is not None:
+            skipped = args.skip_missing and is_missing_dependency(result)
+            failed |= not skipped
+            print('{:<22s} {:>10s}  {}{}'.format(module, '-', result['error'],\
+                  ' (skipped)' if skipped else ''))
+            continue
+
+        slow    = result['seconds'] is not None and result['seconds'] > args.max_seconds
+        failed |= slow or bool(result['forbidden'])
+        print('{:<22s} {:>10.3f}  {}{}'.format(module, result['seconds'] or 0.,\
+              ', '.join(result['forbidden']), ' over budget' if slow else ''))
+
+    sys.exit(1 if failed else 0)
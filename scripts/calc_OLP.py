@@ -47,6 +47,30 @@ def get_sun_glint_mask(observable_level_parameter, solarZenith, sensorZenith, so
     return sun_glint_mask
 
 
+def get_scene_ID(land_water_mask, snow_ice_mask, sfc_ID, sun_glint_mask):
+    """
+    overlay water/sunglint/snow-ice onto sfc_ID, in place
+
+    [Section N/A]
+    Arguments:
+        land_water_mask {2D narray} -- land (1) water(0)
+        snow_ice_mask {2D narray} -- no snow/ice (1) snow/ice (0)
+        sfc_ID {2D narray} -- surface ID; overwritten and returned
+        sun_glint_mask {2D narray} -- no glint (1) sunglint (0)
+    Returns:
+        2D narray -- scene ID, surface types 0-11, water 12, sunglint over
+                     water 13, snow 14
+    """
+    #water = 12
+    #sunglint over water = 13
+    #snow = 14
+    sfc_ID[ land_water_mask == 0]    = 12
+    sfc_ID[(sun_glint_mask  == 0) & \
+           (land_water_mask == 0) ]  = 13
+    sfc_ID[ snow_ice_mask   == 0]    = 14
+
+    return sfc_ID
+
 def add_sceneID(observable_level_parameter, solarZenith, sensorZenith, solarAzimuth, sensorAzimuth,\
                        sun_glint_exclusion_angle):
 
@@ -73,15 +97,8 @@ def add_sceneID(observable_level_parameter, solarZenith, sensorZenith, solarAzim
         snow_ice_bins   = observable_level_parameter[:,:, 5]
 
         sfc_ID_bins = observable_level_parameter[:,:,6]
-        scene_type_identifier = sfc_ID_bins
-
-        #water = 12
-        #sunglint over water = 13
-        #snow = 14
-        scene_type_identifier[ land_water_bins == 0]    = 12
-        scene_type_identifier[(sun_glint_bins  == 0) & \
-                              (land_water_bins == 0) ]  = 13
-        scene_type_identifier[ snow_ice_bins   == 0]    = 14
+        scene_type_identifier = get_scene_ID(land_water_bins, snow_ice_bins,\
+                                             sfc_ID_bins, sun_glint_bins)
 
         OLP = np.zeros((1000,1000,6))
         OLP[:,:,:4] = observable_level_parameter[:,:,:4]#cosSZA, VZA, RAZ, TA
@@ -90,6 +107,38 @@ def add_sceneID(observable_level_parameter, solarZenith, sensorZenith, solarAzim
 
         return OLP
 
+def get_angle_bins(SZA, VZA, SAA, VAA, DOY):
+    """
+    bin the sun/view geometry and day of year
+
+    [Section 3.3.2.2]
+
+    Arguments:
+        SZA, VZA, SAA, VAA {2D narray} -- sun/view zenith/azimuth angles in degrees
+        DOY {integer} -- day of year in julian calendar
+
+    Returns:
+        2D narrays -- cos(SZA), VZA and RAZ bins, and the DOY bin (integer)
+    """
+    #define relative azimuth angle, RAZ, and cos(SZA)
+    RAZ = VAA - SAA
+    RAZ[RAZ<0] = RAZ[RAZ<0]*-1
+    RAZ[RAZ > 180.] = -1 * RAZ[RAZ > 180.] + 360. #symmtery about principle plane
+    cos_SZA = np.cos(np.deg2rad(SZA))
+
+    #define bins for each input
+    bin_cos_SZA = np.arange(0.1, 1.1 , 0.1)
+    bin_VZA     = np.arange(5. , 75. , 5.) #start at 5.0 to 0-index bin left of 5.0
+    bin_RAZ     = np.arange(15., 195., 15.)
+    bin_DOY     = np.arange(8. , 376., 8.0)
+
+    binned_cos_SZA = np.digitize(cos_SZA, bin_cos_SZA, right=True)
+    binned_VZA     = np.digitize(VZA    , bin_VZA    , right=True)
+    binned_RAZ     = np.digitize(RAZ    , bin_RAZ    , right=True)
+    binned_DOY     = np.digitize(DOY    , bin_DOY    , right=True)
+
+    return binned_cos_SZA, binned_VZA, binned_RAZ, binned_DOY
+
 def get_observable_level_parameter(SZA, VZA, SAA, VAA, Target_Area,\
           land_water_mask, snow_ice_mask, sfc_ID, DOY, sun_glint_mask, time_stamp):
 
@@ -119,23 +168,8 @@ def get_observable_level_parameter(SZA, VZA, SAA, VAA, Target_Area,\
     #This is used to determine if the test should be applied over a particular
     #surface type in the get_test_determination function
     shape = np.shape(SZA)
-    #define relative azimuth angle, RAZ, and cos(SZA)
-    RAZ = VAA - SAA
-    RAZ[RAZ<0] = RAZ[RAZ<0]*-1
-    RAZ[RAZ > 180.] = -1 * RAZ[RAZ > 180.] + 360. #symmtery about principle plane
-    cos_SZA = np.cos(np.deg2rad(SZA))
-
-    #bin each input, then dstack them. return this result
-    #define bins for each input
-    bin_cos_SZA = np.arange(0.1, 1.1 , 0.1)
-    bin_VZA     = np.arange(5. , 75. , 5.) #start at 5.0 to 0-index bin left of 5.0
-    bin_RAZ     = np.arange(15., 195., 15.)
-    bin_DOY     = np.arange(8. , 376., 8.0)
-
-    binned_cos_SZA = np.digitize(cos_SZA, bin_cos_SZA, right=True)
-    binned_VZA     = np.digitize(VZA    , bin_VZA    , right=True)
-    binned_RAZ     = np.digitize(RAZ    , bin_RAZ    , right=True)
-    binned_DOY     = np.digitize(DOY    , bin_DOY    , right=True)
+    binned_cos_SZA, binned_VZA, binned_RAZ, binned_DOY = \
+                                          get_angle_bins(SZA, VZA, SAA, VAA, DOY)
 
     #these datafields' raw values serve as the bins, so no modification needed:
     #Target_Area, land_water_mask, snow_ice_mask, sun_glint_mask, sfc_ID
@@ -160,79 +194,184 @@ def get_observable_level_parameter(SZA, VZA, SAA, VAA, Target_Area,\
     missing_idx = np.where(SZA==-999)
     observable_level_parameter[missing_idx[0], missing_idx[1], :] = -999
 
-    observable_level_parameter = observable_level_parameter.astype(dtype=np.int)
+    observable_level_parameter = observable_level_parameter.astype(dtype=int)
 
     return observable_level_parameter
 
+#packed OLP key: one uint32 per pixel instead of 6 int64 bins. Fields from
+#the most significant bit down, so keys sort like the group names
+#cosSZA_xx_VZA_xx_RAZ_xx_TA_xx_sceneID_xx_DOY_xx; bit 31 is never set by a
+#valid key, which leaves all ones free for fill
+OLP_key_fields = [('cosSZA' , 5),\
+                  ('VZA'    , 5),\
+                  ('RAZ'    , 5),\
+                  ('TA'     , 5),\
+                  ('sceneID', 5),\
+                  ('DOY'    , 6)]
+OLP_key_shifts = [26, 21, 16, 11, 6, 0]
+OLP_fill_key   = np.uint32(0xFFFFFFFF)
+
+def encode_OLP(OLP):
+    """
+    pack observable level parameter bins into one key per pixel
+
+    [Section N/A]
+    Arguments:
+        OLP {narray} -- (..., 6) integer bins in the order of OLP_key_fields,
+                        -999 where the pixel has no data
+
+    Returns:
+        narray -- uint32 OLP key, OLP_fill_key where any bin is -999; raises
+                  ValueError if a bin does not fit its field
+    """
+    OLP  = np.asarray(OLP)
+    fill = np.any(OLP == -999, axis=-1)
+    key  = np.zeros(OLP.shape[:-1], dtype=np.uint32)
+    for i, ((name, bits), shift) in enumerate(zip(OLP_key_fields, OLP_key_shifts)):
+        field = OLP[..., i]
+        if np.any(((field < 0) | (field >= 2**bits)) & ~fill):
+            raise ValueError('{} bin outside 0-{}'.format(name, 2**bits - 1))
+        key |= field.astype(np.uint32) << np.uint32(shift)
+    key[fill] = OLP_fill_key
+
+    return key
+
+def decode_OLP(OLP_key):
+    """
+    unpack OLP keys into their bins
+
+    [Section N/A]
+    Arguments:
+        OLP_key {narray} -- uint32 keys from encode_OLP/get_OLP_key
+
+    Returns:
+        narray -- (..., 6) int32 bins in the order of OLP_key_fields, -999
+                  at OLP_fill_key
+    """
+    OLP_key = np.asarray(OLP_key, dtype=np.uint32)
+    OLP = np.empty(OLP_key.shape + (len(OLP_key_fields),), dtype=np.int32)
+    for i, ((name, bits), shift) in enumerate(zip(OLP_key_fields, OLP_key_shifts)):
+        OLP[..., i] = (OLP_key >> np.uint32(shift)) & np.uint32(2**bits - 1)
+    OLP[OLP_key == OLP_fill_key] = -999
+
+    return OLP
+
+def get_OLP_key(SZA, VZA, SAA, VAA, Target_Area, land_water_mask, snow_ice_mask,\
+                sfc_ID, DOY, sun_glint_mask):
+    """
+    Objective:
+        same bins as get_observable_level_parameter, packed straight into
+        one uint32 key per pixel without stacking the 9 layers
+
+    [Section 3.3.2.2]
+
+    Arguments:
+        same as get_observable_level_parameter
+
+    Returns:
+        2D narray -- uint32 OLP key (see decode_OLP), OLP_fill_key where SZA
+                     is -999 or any bin does not fit its field (i.e. a
+                     masked surface ID)
+    """
+    binned_cos_SZA, binned_VZA, binned_RAZ, binned_DOY = \
+                                          get_angle_bins(SZA, VZA, SAA, VAA, DOY)
+    #the netCDF surface ID is a masked array; its fill is kept as -999
+    scene_ID = get_scene_ID(land_water_mask, snow_ice_mask,\
+                            np.ma.filled(sfc_ID, -999).astype(np.int64), sun_glint_mask)
+
+    fields = [binned_cos_SZA, binned_VZA, binned_RAZ, Target_Area, scene_ID, binned_DOY]
+    fill   = SZA == -999
+    key    = np.zeros(np.shape(SZA), dtype=np.uint32)
+    for field, (name, bits), shift in zip(fields, OLP_key_fields, OLP_key_shifts):
+        field = np.broadcast_to(field, key.shape)
+        fill |= (field < 0) | (field >= 2**bits)
+        key  |= field.astype(np.uint32) << np.uint32(shift)
+    key[fill] = OLP_fill_key
+
+    return key
+
+def read_OLP_key(hf_OLP, time_stamp):
+    """
+    Objective:
+        OLP key of one granule from the OLP database
+
+    Arguments:
+        hf_OLP {h5py file} -- OLP database, i.e. the master file
+        time_stamp {str} -- granule group
+
+    Returns:
+        2D narray -- uint32 OLP key; granules written before the key was
+                     stored have their observable_level_paramter encoded
+    """
+    group = hf_OLP[time_stamp]
+    if 'OLP_key' in group:
+        return group['OLP_key'][()]
+
+    return encode_OLP(group['observable_level_paramter'][()])
+
 if __name__ == '__main__':
 
     import h5py
     import mpi4py.MPI as MPI
-    import tables
     from netCDF4 import Dataset
     import os
-    tables.file._open_files.close_all()
+    from database_index import get_time_stamps, split_time_stamps,\
+                               get_shard_index, write_database_index
+    from database_encoding import read_decoded
 
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     size = comm.Get_size()
 
+    OLP_shard_path = '{}OLP_database_60_cores/LA_PTA_OLP_rank_{:0>3d}.hdf5'
+
     for r in range(size):
         if rank==r:
             #open database to read
             home_base = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/'
-            PTA_file_path = home_base + 'LA_database_60_cores/'
             #sfc_ID_path = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data'
-            database_files = os.listdir(PTA_file_path)
-            database_files = [PTA_file_path + filename for filename in database_files]
-            database_files = np.sort(database_files)
-            hf_database_path = database_files[r]
 
-            with h5py.File(hf_database_path, 'r') as hf_database:
+            with h5py.File(home_base + 'LA_PTA_database.hdf5', 'r') as hf_database:
                 #Dataset(sfc_ID_path + '/SurfaceID_LA_048.nc', 'r', format='NETCDF4') as sfc_ID_file:
 
-                len_pta       = len(PTA_file_path)
-                start, end    = hf_database_path[len_pta + 26:len_pta +31], hf_database_path[len_pta+36:len_pta+41]
-
                 #create/open hdf5 file to store observables
-                hf_OLP_path = '{}OLP_database_60_cores/LA_PTA_OLP_start_{}_end_{}_.hdf5'.format(home_base, start, end)
+                hf_OLP_path = OLP_shard_path.format(home_base, rank)
 
-                hf_database_keys = list(hf_database.keys())
+                #this rank's share of the granules in the database
+                hf_database_keys = split_time_stamps(get_time_stamps(hf_database), rank, size)
                 # DOY_end, DOY_start = 56, 49
-                # hf_database_keys = [x for x in hf_database_keys if int(x[4:7])>=DOY_start and int(x[4:7])<=DOY_end]
+                # hf_database_keys = get_time_stamps(hf_database, DOY_start, DOY_end)
                 observables = ['WI', 'NDVI', 'NDSI', 'visRef', 'nirRef', 'SVI', 'cirrus']
 
                 with h5py.File(hf_OLP_path, 'w') as hf_OLP:
 
                     for time_stamp in hf_database_keys:
 
-                        PTA_file_path = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data'
-                        hf_OLP_path   = '{}/LA_PTA_OLP_start_{}_end_{}_.hdf5'.format(PTA_file_path, start, end)
-
-                        SZA = hf_database[time_stamp+'/sunView_geometry/solarZenith'][()]
-                        VZA = hf_database[time_stamp+'/sunView_geometry/sensorZenith'][()]
-                        VAA = hf_database[time_stamp+'/sunView_geometry/sensorAzimuth'][()]
-                        SAA = hf_database[time_stamp+'/sunView_geometry/solarAzimuth'][()]
+                        SZA = read_decoded(hf_database, time_stamp+'/sunView_geometry/solarZenith')
+                        VZA = read_decoded(hf_database, time_stamp+'/sunView_geometry/sensorZenith')
+                        VAA = read_decoded(hf_database, time_stamp+'/sunView_geometry/sensorAzimuth')
+                        SAA = read_decoded(hf_database, time_stamp+'/sunView_geometry/solarAzimuth')
                         TA  = 0 #will change depending where database is stored
-                        LWM = hf_database[time_stamp+'/cloud_mask/Land_Water_Flag'][()]
-                        SIM = hf_database[time_stamp+'/cloud_mask/Snow_Ice_Background_Flag'][()]
+                        LWM = read_decoded(hf_database, time_stamp+'/cloud_mask/Land_Water_Flag')
+                        SIM = read_decoded(hf_database, time_stamp+'/cloud_mask/Snow_Ice_Background_Flag')
                         DOY = int(time_stamp[4:7])
                         DOY_bin = DOY - (DOY-1)%8 + 7
                         sfc_ID_path = home_base + 'LA_surface_types/surfaceID_LA_{:03d}.nc'.format(DOY_bin)
                         with Dataset(sfc_ID_path, 'r', format='NETCDF4') as sfc_ID_file:
                             sfc_ID_LA = sfc_ID_file.variables['surface_ID'][:]
 
-                        SGM = hf_database[time_stamp+'/cloud_mask/Sun_glint_Flag'][()]
+                        SGM = read_decoded(hf_database, time_stamp+'/cloud_mask/Sun_glint_Flag')
+
+                        OLP_key = get_OLP_key(SZA, VZA, SAA, VAA, TA, LWM, SIM,\
+                                              sfc_ID_LA, DOY, SGM)
 
-                        OLP = get_observable_level_parameter(SZA, VZA, SAA,\
-                              VAA, TA, LWM, SIM, sfc_ID_LA, DOY, SGM, time_stamp)
+                        group = hf_OLP.require_group(time_stamp)
+                        if 'OLP_key' in group:
+                            del group['OLP_key']
+                        group.create_dataset('OLP_key', data=OLP_key, compression='gzip')
 
-                        try:
-                            group = hf_OLP.create_group(time_stamp)
-                            group.create_dataset('observable_level_paramter', data=OLP, compression='gzip')
-                        except:
-                            try:
-                                group.create_dataset('observable_level_paramter', data=OLP, compression='gzip')
-                                hf_OLP[time_stamp+'/observable_level_paramter'][:] = OLP
-                            except:
-                                hf_OLP[time_stamp+'/observable_level_paramter'][:] = OLP
+    #one logical OLP database over the rank shards
+    comm.Barrier()
+    if rank == 0:
+        OLP_shards = [OLP_shard_path.format(home_base, r) for r in range(size)]
+        write_database_index(home_base + 'LA_PTA_OLP.hdf5', get_shard_index(OLP_shards))
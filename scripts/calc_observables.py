@@ -1,5 +1,5 @@
 import numpy as np
-from svi_calculation import svi_calculation
+from spatial_variability import get_SVI
 
 def get_R(radiance, SZA, d, E_std_0b):
     """
@@ -31,6 +31,58 @@ def get_R(radiance, SZA, d, E_std_0b):
     R = radiance
     return R
 
+def get_R_stack(radiance, SZA, d, E_std_0b, RDQI=None, Max_RDQI=None, out=None):
+    """
+    convert the radiances of every band to BRF in one pass
+
+    [Sections 3.2.1.3 and 3.3.1.2]
+    Same result as mark_bad_radiance (if RDQI is given) then get_R on each
+    band, in float32. cos(SZA) is computed once for all bands and the masked
+    ufuncs (where=) only convert valid pixels in place, so there are no index
+    tuples or full size temporaries per band.
+
+    Arguments:
+        radiance {3D narray} -- (bands, rows, cols) MAIA radiance,
+                                i.e. MAIA bands 6,9,4,5,12,13
+        SZA {2D narray} -- (rows, cols); solar zenith angles in degrees
+        d {float} -- earth sun distance in Astonomical Units(AU)
+        E_std_0b {1D narray} -- band weight solar irradiance at 1 AU of
+                                each band of radiance
+        RDQI {3D narray} -- same shape as radiance; radiance quality flag;
+                            not checked if None
+        Max_RDQI {integer} -- from configuration file;
+                              denotes minimum usable quality flag
+        out {3D narray} -- float32 array to write BRF into, may be radiance
+                           itself; a new array if None
+
+    Returns:
+        3D narray -- float32 BRF; same shape as radiance
+    """
+    if out is None:
+        out = np.empty(np.shape(radiance), dtype=np.float32)
+    if out is not radiance:
+        np.copyto(out, radiance, casting='unsafe')
+
+    #mark bad radiance, same order as mark_bad_radiance
+    if RDQI is not None:
+        np.copyto(out, -998, where=(RDQI > Max_RDQI) & (RDQI < 3))
+        np.copyto(out, -998, where=(out < 0) & (out > -998))
+        np.copyto(out, -999, where=RDQI == 3)
+
+    #now filter out where cosSZA is too small with fill value
+    #cos(SZA) once per granule, so it is done in float64 like get_R
+    cosSZA = np.cos(np.deg2rad(SZA))
+    np.copyto(out, -998, where=cosSZA <= 0.01)
+    cosSZA = cosSZA.astype(np.float32)
+
+    #condition to not step on fill values when converting to BRF(R)
+    valid_rad = out >= 0.0
+    scale     = (np.pi * np.square(d) / np.asarray(E_std_0b, dtype=np.float64))
+    np.divide(out, cosSZA, out=out, where=valid_rad)
+    np.multiply(out, scale.astype(np.float32).reshape(-1, 1, 1), out=out, where=valid_rad)
+
+    return out
+
 #calculate sun-glint flag*******************************************************
 #section 3.3.2.3
 def get_sun_glint_mask(solarZenith, sensorZenith, solarAzimuth, sensorAzimuth,\
@@ -205,7 +257,8 @@ def get_spatial_variability_index(R_band_6):#, numrows, numcols):
 
     [Section 3.3.2.1.2]
     SVI for a pixel is calculated as the standard deviation of aggregated 1-km R_0.64
-    within a 3X3 matrix centered at the pixel.
+    within a 3X3 matrix centered at the pixel. Any granule shape, see
+    spatial_variability.get_SVI.
 
     Arguments:
         R_band_6 {2D narray} -- BRF narray for band 6
@@ -220,8 +273,7 @@ def get_spatial_variability_index(R_band_6):#, numrows, numcols):
     R_band_6_[R_band_6_ == -998] = -999
     bad_value = -999
     min_valid_pixels = 9
-    spatial_variability_index = \
-                            svi_calculation(R_band_6_, bad_value, min_valid_pixels)
+    spatial_variability_index = get_SVI(R_band_6_, bad_value, min_valid_pixels)
 
     #data quality house keeping
     spatial_variability_index[R_band_6 == -998] = -998
@@ -245,88 +297,258 @@ def get_cirrus_Ref(R_band_13):
     """
     return R_band_13
 
+#observables engine*************************************************************
+class BufferPool(object):
+    """
+    preallocated arrays reused from granule to granule
+
+    Arrays are keyed by name, shape and dtype, so a granule of the same shape
+    as the last one gets the same memory back instead of new allocations.
+    Whatever get() returned is overwritten when the next granule asks for it.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.float32):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        if key not in self.buffers:
+            self.buffers[key] = np.empty(shape, dtype=dtype)
+
+        return self.buffers[key]
+
+def fill_invalid(observable, R_bands):
+    """
+    data quality house keeping to retain fill values
+
+    Arguments:
+        observable {2D narray} -- set to -999 where any of R_bands is -999,
+                                  -998 where any other band is negative
+        R_bands {tuple} -- BRF narrays the observable is calculated from
+    """
+    invalid = R_bands[0] < 0
+    missing = R_bands[0] == -999
+    for R_band in R_bands[1:]:
+        invalid |= R_band < 0
+        missing |= R_band == -999
+
+    np.putmask(observable, invalid, -998)
+    np.putmask(observable, missing, -999)
+
+def get_observables(R, out=None, buffer_pool=None):
+    """
+    calculate all seven observables into one array
+
+    [Section 3.3.2.1.2]
+    Same values as get_whiteness_index, get_NDVI, get_NDSI,
+    get_visible_reflectance, get_NIR_reflectance,
+    get_spatial_variability_index and get_cirrus_Ref, in float32. Every
+    pixel is calculated in place (out=) and the fill values are put back
+    afterwards, which is faster than masking each ufunc, and the visible
+    average is divided out once; the only temporaries are two scratch planes
+    and the fill masks.
+
+    Arguments:
+        R {3D narray} -- (6, rows, cols) BRF of MAIA bands 6,9,4,5,12,13,
+                         i.e. from get_R_stack
+        out {3D narray} -- (7, rows, cols) float32 array to write to; taken
+                           from buffer_pool if None
+        buffer_pool {BufferPool} -- output and scratch arrays reused across
+                                    granules; new arrays if None
+
+    Returns:
+        3D narray -- (7, rows, cols) float32 WI, NDVI, NDSI, visible
+                     reflectance, NIR reflectance, SVI, cirrus reflectance
+    """
+    R_band_6, R_band_9, R_band_4, R_band_5, R_band_12, R_band_13 = R
+    shape = np.shape(R_band_6)
+
+    if buffer_pool is None:
+        buffer_pool = BufferPool()
+    if out is None:
+        out = buffer_pool.get('observables', (7,) + shape)
+    visible_average, scratch = buffer_pool.get('observables_scratch', (2,) + shape)
+    whiteness_index, NDVI, NDSI = out[0], out[1], out[2]
+
+    #fill pixels give meaningless values until fill_invalid overwrites them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #WI = sum |R - visible average| / visible average over bands 6, 5, 4
+        np.add(R_band_6, R_band_5, out=visible_average)
+        np.add(visible_average, R_band_4, out=visible_average)
+        np.divide(visible_average, 3, out=visible_average)
+        np.subtract(R_band_6, visible_average, out=whiteness_index)
+        np.abs(whiteness_index, out=whiteness_index)
+        for R_band in (R_band_5, R_band_4):
+            np.subtract(R_band, visible_average, out=scratch)
+            np.abs(scratch, out=scratch)
+            np.add(whiteness_index, scratch, out=whiteness_index)
+        np.divide(whiteness_index, visible_average, out=whiteness_index)
+        fill_invalid(whiteness_index, (R_band_6, R_band_5, R_band_4))
+
+        #normalized differences
+        for observable, R_band_a, R_band_b in ((NDVI, R_band_9, R_band_6),\
+                                               (NDSI, R_band_5, R_band_12)):
+            np.subtract(R_band_a, R_band_b, out=observable)
+            np.add(R_band_a, R_band_b, out=scratch)
+            np.divide(observable, scratch, out=observable)
+            fill_invalid(observable, (R_band_a, R_band_b))
+
+    #reflectances are the BRFs themselves
+    np.copyto(out[3], R_band_6)
+    np.copyto(out[4], R_band_9)
+    np.copyto(out[5], get_spatial_variability_index(R_band_6))
+    np.copyto(out[6], R_band_13)
+
+    return out
+
+#observables database: one (7, rows, cols) float32 dataset per granule,
+#<time stamp>/observables, in this order along the first axis
+observable_names    = ['WI', 'NDVI', 'NDSI', 'visRef', 'nirRef', 'SVI', 'cirrus']
+observables_dataset = 'observables'
+
+#one observable of a 100x100 pixel tile (40 KB) per chunk, so reading one
+#observable decompresses none of the others; larger chunks gzip slower
+observables_chunks  = (1, 100, 100)
+
+def write_observables(hf_observables, time_stamp, data, compression='gzip'):
+    """
+    write the observables of one granule
+
+    Arguments:
+        hf_observables {h5py file} -- observables database (rank shard)
+        time_stamp {string} -- granule group, created if missing
+        data {3D narray} -- (7, rows, cols) from get_observables; written with
+                            write_direct, without a copy when float32 and C
+                            contiguous
+        compression {string} -- h5py compression filter
+
+    Returns:
+        h5py dataset -- <time stamp>/observables; a dataset of another shape,
+                        or the seven datasets of the old layout, are replaced
+    """
+    data  = np.ascontiguousarray(data, dtype=np.float32)
+    group = hf_observables.require_group(time_stamp)
+    for name in observable_names:
+        if name in group:
+            del group[name]
+
+    if observables_dataset in group and group[observables_dataset].shape != data.shape:
+        del group[observables_dataset]
+    if observables_dataset not in group:
+        chunks = tuple(min(chunk, dim) for chunk, dim in zip(observables_chunks, data.shape))
+        dataset = group.create_dataset(observables_dataset, shape=data.shape,\
+                                       dtype=np.float32, chunks=chunks,\
+                                       compression=compression)
+        dataset.attrs['observables'] = observable_names
+
+    dataset = group[observables_dataset]
+    dataset.write_direct(data)
+
+    return dataset
+
+def read_observables(hf_observables, time_stamp, observables=None, out=None):
+    """
+    read the observables of one granule
+
+    Arguments:
+        hf_observables {h5py file} -- observables database, i.e. the master file
+        time_stamp {string} -- granule group
+        observables {list} -- names from observable_names to read, in the
+                              order wanted; all seven if None
+        out {3D narray} -- (len(observables), rows, cols) float32 to read
+                           into with read_direct; new array if None
+
+    Returns:
+        3D narray -- out. Groups of the old layout, one dataset per
+                     observable, are read the same way.
+    """
+    group = hf_observables[time_stamp]
+    names = observable_names if observables is None else list(observables)
+
+    if observables_dataset in group:
+        dataset = group[observables_dataset]
+        shape   = dataset.shape[1:]
+    else:
+        shape   = group[names[0]].shape
+    if out is None:
+        out = np.empty((len(names),) + shape, dtype=np.float32)
+
+    if observables_dataset not in group:
+        for i, name in enumerate(names):
+            group[name].read_direct(out, dest_sel=np.s_[i])
+        return out
+
+    #consecutive observables, i.e. all seven, are one read
+    idx = [observable_names.index(name) for name in names]
+    if idx == list(range(idx[0], idx[0] + len(idx))):
+        dataset.read_direct(out, np.s_[idx[0]:idx[0] + len(idx)])
+    else:
+        for i, j in enumerate(idx):
+            dataset.read_direct(out, np.s_[j], np.s_[i])
+
+    return out
+
 if __name__ == '__main__':
 
     import h5py
     import mpi4py.MPI as MPI
-    import tables
     import os
     import numpy as np
-    tables.file._open_files.close_all()
+    from database_index import get_time_stamps, split_time_stamps,\
+                               get_shard_index, write_database_index
+    from database_encoding import read_decoded
 
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     size = comm.Get_size()
 
+    observables_shard_path = '{}/LA_PTA_observables_rank_{:0>3d}.hdf5'
+
     for r in range(size):
         if rank==r:
 
             #open database to read
-            PTA_file_path = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/LA_database_60_cores/'
-            database_files = os.listdir(PTA_file_path)
-            database_files = [PTA_file_path + filename for filename in database_files]
-            database_files = np.sort(database_files)
-            if r < len(database_files):
-                hf_database_path = database_files[r]
-                # start, end = hf_database_path[26:31], hf_database_path[36:41]
-                # print(start, end)
-                with h5py.File(hf_database_path, 'r') as hf_database:
-
-                    hf_database_keys = list(hf_database.keys())
-                    observables = ['WI', 'NDVI', 'NDSI', 'visRef', 'nirRef', 'SVI', 'cirrus']
-
-                    #create/open hdf5 file to store observables
-                    PTA_file_path_obs   = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/observables_database_60_cores'
-                    lenpta = len(PTA_file_path)
-                    start, end = hf_database_path[lenpta + 26:lenpta +31], hf_database_path[lenpta+36:lenpta+41]
-                    #print(start, end)
-                    hf_observables_path = '{}/LA_PTA_observables_start_{}_end_{}_.hdf5'.format(PTA_file_path_obs, start, end)
-
-                    with h5py.File(hf_observables_path, 'w') as hf_observables:
-                        for time_stamp in hf_database_keys:
-
-                            SZA     = hf_database[time_stamp + '/sunView_geometry/solarZenith'][()]
-
-                            rad_band_4  = hf_database[time_stamp + '/radiance/band_3' ][()]
-                            rad_band_5  = hf_database[time_stamp + '/radiance/band_4' ][()]
-                            rad_band_6  = hf_database[time_stamp + '/radiance/band_1' ][()]
-                            rad_band_9  = hf_database[time_stamp + '/radiance/band_2' ][()]
-                            rad_band_12 = hf_database[time_stamp + '/radiance/band_6' ][()]
-                            rad_band_13 = hf_database[time_stamp + '/radiance/band_26'][()]
-
-                            #in order MAIA  bands 6,9,4,5,12,13
-                            #in order MODIS bands 1,2,3,4,6 ,26 
-                            E_std_0b = hf_database[time_stamp + '/band_weighted_solar_irradiance'][()]
-                            d        = hf_database[time_stamp + '/earth_sun_distance'][()]                            
-
-                            R_band_4  = get_R(rad_band_4, SZA, d, E_std_0b[2])
-                            R_band_5  = get_R(rad_band_5, SZA, d, E_std_0b[3])
-                            R_band_6  = get_R(rad_band_6, SZA, d, E_std_0b[0])
-                            R_band_9  = get_R(rad_band_9, SZA, d, E_std_0b[1])
-                            R_band_12 = get_R(rad_band_12, SZA, d, E_std_0b[4])
-                            R_band_13 = get_R(rad_band_13, SZA, d, E_std_0b[5])
-
-                            sun_glint_mask            = hf_database[time_stamp + '/cloud_mask/Sun_glint_Flag'][()]
-
-                            whiteness_index           = get_whiteness_index(R_band_6, R_band_5, R_band_4)
-                            NDVI                      = get_NDVI(R_band_6, R_band_9)
-                            NDSI                      = get_NDSI(R_band_5, R_band_12)
-                            visible_reflectance       = get_visible_reflectance(R_band_6)
-                            NIR_reflectance           = get_NIR_reflectance(R_band_9)
-                            spatial_variability_index = get_spatial_variability_index(R_band_6)#, numrows, numcol)
-                            cirrus_Ref                = get_cirrus_Ref(R_band_13)
-
-                            data = np.dstack((whiteness_index, NDVI, NDSI,\
-                                              visible_reflectance, NIR_reflectance,\
-                                              spatial_variability_index, cirrus_Ref))
-
-                            for i in range(7):
-                                try:
-                                    group = hf_observables.create_group(time_stamp)
-                                    group.create_dataset(observables[i], data=data[:,:,i], compression='gzip')
-                                except:
-                                    try:
-                                        group.create_dataset(observables[i], data=data[:,:,i], compression='gzip')
-                                    except:
-                                        hf_observables[time_stamp+'/'+observables[i]][:] = data[:,:,i]
+            home = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/'
+            with h5py.File(home + 'LA_PTA_database.hdf5', 'r') as hf_database:
+
+                #this rank's share of the granules in the database
+                hf_database_keys = split_time_stamps(get_time_stamps(hf_database), rank, size)
+
+                #radiance/BRF and observables arrays reused by every granule
+                buffer_pool = BufferPool()
+
+                #create/open hdf5 file to store observables
+                PTA_file_path_obs   = home + 'observables_database_60_cores'
+                hf_observables_path = observables_shard_path.format(PTA_file_path_obs, rank)
+
+                with h5py.File(hf_observables_path, 'w') as hf_observables:
+                    for time_stamp in hf_database_keys:
+
+                        SZA     = read_decoded(hf_database, time_stamp + '/sunView_geometry/solarZenith')
+
+                        #in order MAIA  bands 6,9,4,5,12,13
+                        #in order MODIS bands 1,2,3,4,6 ,26
+                        #the order of band_weighted_solar_irradiance
+                        radiance = buffer_pool.get('radiance', (6,) + SZA.shape)
+                        for i, band in enumerate([1, 2, 3, 4, 6, 26]):
+                            radiance[i] = read_decoded(hf_database, time_stamp + '/radiance/band_{}'.format(band))
+
+                        E_std_0b = read_decoded(hf_database, time_stamp + '/band_weighted_solar_irradiance')
+                        d        = read_decoded(hf_database, time_stamp + '/earth_sun_distance')
+
+                        #all six bands converted in place, cos(SZA) once
+                        R = get_R_stack(radiance, SZA, d, E_std_0b, out=radiance)
+                        R_band_6, R_band_9, R_band_4, R_band_5, R_band_12, R_band_13 = R
+
+                        sun_glint_mask            = read_decoded(hf_database, time_stamp + '/cloud_mask/Sun_glint_Flag')
+
+                        #all seven observables into the reused (7, rows, cols) buffer
+                        #and straight from it into one dataset
+                        data = get_observables(R, buffer_pool=buffer_pool)
+                        write_observables(hf_observables, time_stamp, data)
 
+    #one logical observables database over the rank shards
+    comm.Barrier()
+    if rank == 0:
+        observables_shards = [observables_shard_path.format(PTA_file_path_obs, r) for r in range(size)]
+        write_database_index(home + 'LA_PTA_observables.hdf5', get_shard_index(observables_shards))
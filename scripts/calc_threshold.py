@@ -1,6 +1,7 @@
 import numpy as np
 import h5py
 from scipy.stats import cumfreq
+from calc_OLP import decode_OLP
 
 def calc_thresh(group_file):
     '''
@@ -34,9 +35,13 @@ def calc_thresh(group_file):
 
         for count, bin_ID in enumerate(hf_keys):
             #location in array to store threshold (cos(SZA), VZA, RAZ, Scene_ID)
-            bin_idx = [int(bin_ID[7:9]), int(bin_ID[14:16]), int(bin_ID[21:23]), int(bin_ID[38:40])]
+            if 'OLP_key' in hf_group[bin_ID].attrs:
+                OLP     = decode_OLP(hf_group[bin_ID].attrs['OLP_key'])
+                bin_idx = [OLP[0], OLP[1], OLP[2], OLP[4]]
+            else:
+                bin_idx = [int(bin_ID[7:9]), int(bin_ID[14:16]), int(bin_ID[21:23]), int(bin_ID[38:40])]
 
-            cloud_mask = hf_group[bin_ID][:,0].astype(dtype=np.int)
+            cloud_mask = hf_group[bin_ID][:,0].astype(dtype=int)
             obs        = hf_group[bin_ID][:,1:]
             #print(cloud_mask)
             clear_idx = np.where(cloud_mask != 0)
@@ -74,9 +79,7 @@ def calc_thresh(group_file):
 if __name__ == '__main__':
 
     import h5py
-    import tables
     import os
-    tables.file._open_files.close_all()
 
     #define paths for the database
     home = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/'
@@ -1,13 +1,17 @@
 import pandas as pd
 import os.path
 from os import path
+from granule_validation import validate_file
 
 def check_file_integrity(url, filename, real_file_size, fieldnames, save_path,\
-                         directory):
+                         directory, level='header'):
     '''
     Objective:
         Check that file downloaded and has correct size and datafields are not
-        corrupt.
+        corrupt, without reading whole SDS arrays (see granule_validation for
+        level).
+    Returns:
+        1 if the file is perfect, 0 if it is corrupt or the wrong size
     '''
 
     #make file to save output to
@@ -15,30 +19,25 @@ def check_file_integrity(url, filename, real_file_size, fieldnames, save_path,\
     if path.exists(output_file_path):
         df = pd.read_csv(output_file_path)
     else:
-        df         = pd.DataFrame(output_file_path)
-        #add column to csv to say if it is corrupt
-        df['one_perfect_zero_corrupt']
+        df = pd.DataFrame(columns=['file_name', 'one_perfect_zero_corrupt', 'error'])
 
     #grab some MOD_02/03/35 file based on function arguments
     filename   = save_path + directory + filename
     statinfo   = os.stat(filename)
     downloaded_file_size  = statinfo.st_size
 
-    if url[23:25]=='02':
-        if downloaded_file_size == real_file_size :
-            df['file_name']
-
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
+    if downloaded_file_size == real_file_size:
+        error = validate_file(filename, directory.strip('/'), level)
+    else:
+        error = 'size {} expected {}'.format(downloaded_file_size, real_file_size)
 
-    elif url[23:25]=='03':
-        if downloaded_file_size == real_file_size:
-            pass
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
+    #add row to csv to say if it is corrupt
+    perfect = int(error is None)
+    df = df[df['file_name'] != filename]
+    df = pd.concat([df, pd.DataFrame({'file_name': [filename],\
+                                      'one_perfect_zero_corrupt': [perfect],\
+                                      'error': [error]})], ignore_index=True)
+    os.makedirs(path.dirname(output_file_path), exist_ok=True)
+    df.to_csv(output_file_path, index=False)
 
-    else:
-        if downloaded_file_size == real_file_size:
-            pass
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
+    return perfect
@@ -468,33 +468,28 @@ def build_data_base(filename_MOD_02, filename_MOD_03, filename_MOD_35, hf_path,
 
 if __name__ == '__main__':
 
+    #disabled: build_data_base above still uses names it never defines; the
+    #database is built by MPI_create_dataset.py
+    # from granule_catalog import GranuleCatalog
     # import pandas as pd
     # import tables
     # tables.file._open_files.close_all()
     # #choose PTA from keeling
     # PTA_file_path   = '/data/keeling/a/vllgsbr2/c/MAIA_Threshold_Dev/LA_PTA_MODIS_Data'
     #
-    # #grab files names for PTA
-    # filename_MOD_02 = np.array(os.listdir(PTA_file_path + '/MOD_02'))
-    # filename_MOD_03 = np.array(os.listdir(PTA_file_path + '/MOD_03'))
-    # filename_MOD_35 = np.array(os.listdir(PTA_file_path + '/MOD_35'))
+    # #MOD02/03/35 triplets matched on time stamp (YYYYDDD.HHMM) by the
+    # #granule catalog (see granule_catalog.py to build it)
+    # with GranuleCatalog(PTA_file_path + '/granule_catalog.sqlite') as catalog:
+    #     granules = catalog.query()
     #
-    # #sort files by time so we can access corresponding files without
-    # #searching in for loop
-    # filename_MOD_02 = np.sort(filename_MOD_02)
-    # filename_MOD_03 = np.sort(filename_MOD_03)
-    # filename_MOD_35 = np.sort(filename_MOD_35)
+    # filename_MOD_02 = [granule['MOD_02'] for granule in granules]
+    # filename_MOD_03 = [granule['MOD_03'] for granule in granules]
+    # filename_MOD_35 = [granule['MOD_35'] for granule in granules]
     #
-    # #grab time stamp (YYYYDDD.HHMM) to name each group after the granule
-    # #it comes from
-    # filename_MOD_02_timeStamp = [x[10:22] for x in filename_MOD_02]
-    # filename_MOD_03_timeStamp = [x[7:19]  for x in filename_MOD_03]
-    # filename_MOD_35_timeStamp = [x[10:22] for x in filename_MOD_35]
-    #
-    # #add full path to file
-    # filename_MOD_02 = [PTA_file_path + '/MOD_02/' + x for x in filename_MOD_02]
-    # filename_MOD_03 = [PTA_file_path + '/MOD_03/' + x for x in filename_MOD_03]
-    # filename_MOD_35 = [PTA_file_path + '/MOD_35/' + x for x in filename_MOD_35]
+    # #time stamp names each group after the granule it comes from
+    # filename_MOD_02_timeStamp = [granule['time_stamp'] for granule in granules]
+    # filename_MOD_03_timeStamp = filename_MOD_02_timeStamp
+    # filename_MOD_35_timeStamp = filename_MOD_02_timeStamp
     #
     # #create/open file
     # file_num = sys.argv[3]
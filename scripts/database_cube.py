@@ -0,0 +1,199 @@
+'''
+author: Javier Villegas
+
+Time stacked "cube" layout of the granule database. Instead of one group
+per time stamp holding ~20 small datasets, the cube file has one dataset
+per variable shaped (n_granules, 1000, 1000), named like the per granule
+path (i.e. radiance/band_1, cloud_mask/Sun_glint_Flag), plus a time_stamps
+index. Per granule values (earth_sun_distance, band_weighted_solar_irradiance)
+are stacked the same way along the first axis, and the observables database
+converts to one (n_granules, 7, 1000, 1000) observables dataset.
+
+The chunk shape decides which access is cheap:
+    (1, 250, 250)  - whole granules, i.e. calc_observables/calc_OLP
+    (64, 50, 50)   - pixel time series, i.e. grouping by pixel over time
+both work with either, at the cost of reading more chunks than needed.
+
+convert with
+    python database_cube.py database.hdf5 cube.hdf5 [time_series]
+'''
+import numpy as np
+import h5py
+from database_encoding import decode_values
+
+#granule to granule access by default
+granule_chunks     = (1, 250, 250)
+time_series_chunks = (64, 50, 50)
+
+def get_variable_paths(hf_granule):
+    '''
+    INPUT:
+          hf_granule - h5py group - one granule (time stamp) of the database
+    RETURN:
+          dict - dataset path relative to the granule -> (shape, dtype,
+                 attributes)
+    '''
+    variables = {}
+    def add_dataset(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            variables[name] = (obj.shape, obj.dtype, dict(obj.attrs))
+    hf_granule.visititems(add_dataset)
+
+    return variables
+
+def get_fill_value(dtype, attributes):
+    '''
+    RETURN:
+          _FillValue of the database_encoding attributes, or the old database
+          fill value (-999) for signed/float types, the largest value for
+          unsigned types (255 for uint8, like the encoded flags), 0 otherwise
+    '''
+    if '_FillValue' in attributes:
+        return dtype.type(attributes['_FillValue'])
+    if np.issubdtype(dtype, np.floating) or np.issubdtype(dtype, np.signedinteger):
+        return dtype.type(-999)
+    if np.issubdtype(dtype, np.unsignedinteger):
+        return dtype.type(np.iinfo(dtype).max)
+
+    return dtype.type(0)
+
+def convert_to_cube(hf_database, cube_path, time_stamps, chunks=granule_chunks,\
+                    compression='gzip'):
+    '''
+    INPUT:
+          hf_database - h5py file  - per granule database, i.e. the master file
+                                     of database_index
+          cube_path   - str        - cube hdf5 file to write
+          time_stamps - list of str - granules to stack, in order
+          chunks      - tuple      - chunk shape of the (n, rows, cols) datasets
+          compression - str        - h5py compression filter
+    RETURN:
+          writes the cube. Variables are copied one at a time in blocks of
+          chunks[0] granules so every chunk is compressed once. Granules
+          missing a variable get its fill value; attributes are copied so
+          database_encoding.decode works on cube slices too.
+    '''
+    n_granules = len(time_stamps)
+
+    #union of the variables of every granule
+    variables = {}
+    for time_stamp in time_stamps:
+        for name, variable in get_variable_paths(hf_database[time_stamp]).items():
+            variables.setdefault(name, variable)
+
+    block = chunks[0]
+    with h5py.File(cube_path, 'w') as hf_cube:
+        hf_cube.create_dataset('time_stamps', data=np.array(time_stamps, dtype='S'))
+
+        for name, (shape, dtype, attributes) in sorted(variables.items()):
+            cube_shape = (n_granules,) + tuple(shape)
+            fill_value = get_fill_value(dtype, attributes)
+            if len(shape) >= 2:
+                #leading per granule axes, i.e. the 7 of the observables
+                #database, get one plane per chunk
+                cube_chunks = (min(chunks[0], n_granules),) + (1,) * (len(shape) - 2) +\
+                              (min(chunks[1], shape[-2]), min(chunks[2], shape[-1]))
+                cube = hf_cube.create_dataset(name, shape=cube_shape, dtype=dtype,\
+                                              chunks=cube_chunks, compression=compression,\
+                                              fillvalue=fill_value)
+            else:
+                cube = hf_cube.create_dataset(name, shape=cube_shape, dtype=dtype,\
+                                              fillvalue=fill_value)
+            #scale_factor/_FillValue so database_encoding.decode works on the cube
+            for attribute, value in attributes.items():
+                cube.attrs[attribute] = value
+
+            for start in range(0, n_granules, block):
+                end  = min(start + block, n_granules)
+                slab = np.full((end - start,) + tuple(shape), fill_value, dtype=dtype)
+                for i, time_stamp in enumerate(time_stamps[start:end]):
+                    path = '{}/{}'.format(time_stamp, name)
+                    if path in hf_database:
+                        hf_database[path].read_direct(slab, dest_sel=np.s_[i])
+                cube[start:end] = slab
+
+class DatabaseCube(object):
+    '''
+    INPUT:
+          cube_path   - str   - cube hdf5 file from convert_to_cube
+          cache_bytes - int   - hdf5 chunk cache per dataset; large enough for
+                                a row of chunks keeps pixel time series reads
+                                from decompressing the same chunk twice
+    Use as a context manager or call close().
+    '''
+
+    def __init__(self, cube_path, cache_bytes=256*1024**2):
+        self.hf_cube     = h5py.File(cube_path, 'r', rdcc_nbytes=cache_bytes,\
+                                     rdcc_nslots=100003)
+        self.time_stamps = [x.decode() for x in self.hf_cube['time_stamps'][()]]
+        self.time_index  = {time_stamp: i for i, time_stamp in enumerate(self.time_stamps)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.hf_cube.close()
+
+    def read(self, variable, selection, decode=False):
+        '''
+        RETURN:
+              self.hf_cube[variable][selection], decoded by
+              database_encoding.decode_values if decode is True
+        '''
+        data = self.hf_cube[variable][selection]
+        if decode:
+            return decode_values(data, self.hf_cube[variable].attrs)
+
+        return data
+
+    def get_granule(self, variable, time_stamp, decode=False):
+        '''
+        RETURN:
+              variable of one granule, i.e. get_granule('radiance/band_1', '2017246.1855')
+        '''
+        return self.read(variable, self.time_index[time_stamp], decode)
+
+    def get_granules(self, variable, time_stamps, decode=False):
+        '''
+        RETURN:
+              narray - variable of several granules stacked on the first axis
+        '''
+        idx = np.array([self.time_index[time_stamp] for time_stamp in time_stamps])
+        #h5py wants strictly increasing indices; a granule asked for more
+        #than once is read once
+        unique_idx, inverse = np.unique(idx, return_inverse=True)
+        unique_data = self.read(variable, unique_idx, decode)
+
+        return unique_data[inverse]
+
+    def get_pixel_series(self, variable, row, col, decode=False):
+        '''
+        RETURN:
+              1D narray - variable at one pixel for every granule, in time order
+        '''
+        return self.read(variable, np.s_[:, row, col], decode)
+
+    def get_window_series(self, variable, rows, cols, decode=False):
+        '''
+        INPUT:
+              rows, cols - slice - window of the grid
+        RETURN:
+              3D narray - (n_granules, window rows, window cols)
+        '''
+        return self.read(variable, np.s_[:, rows, cols], decode)
+
+if __name__ == '__main__':
+    import sys
+    from database_index import get_time_stamps
+
+    database_path, cube_path = sys.argv[1], sys.argv[2]
+    if len(sys.argv) > 3 and sys.argv[3] == 'time_series':
+        chunks = time_series_chunks
+    else:
+        chunks = granule_chunks
+
+    with h5py.File(database_path, 'r') as hf_database:
+        convert_to_cube(hf_database, cube_path, get_time_stamps(hf_database), chunks)
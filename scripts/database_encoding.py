@@ -0,0 +1,108 @@
+'''
+author: Javier Villegas
+
+Compact on-disk encoding of the granule database, with CF style attributes.
+    cloud mask flags/tests, MOD03_LandSeaMask - uint8, _FillValue 255
+    sunView_geometry                          - int16 MOD03 counts,
+                                                scale_factor, _FillValue -32767
+    radiance, reflectance, geolocation        - float32, _FillValue -999
+    valid_mask                                - np.packbits of the pixels
+                                                that have a swath neighbor
+Readers call read_decoded to get the values downstream code expects: scaled
+to physical units and -999 wherever the pixel is fill. Datasets written
+before this encoding (float64 with -999 fill, no _FillValue) are returned
+as they are.
+'''
+import numpy as np
+
+flag_fill_value     = 255
+geometry_fill_value = -32767
+float_fill_value    = -999.
+
+#fill value of the decoded arrays; what the rest of the code checks for
+decoded_fill_value  = -999
+
+def encode(data, fill_val_idx, dtype, fill_value):
+    '''
+    INPUT:
+          data         - narray - values on the MAIA grid
+          fill_val_idx - tuple  - np.where of the pixels without a swath neighbor
+          dtype        - numpy dtype to store
+          fill_value   - value to store at fill_val_idx
+    RETURN:
+          narray of dtype with fill_value at fill_val_idx
+    '''
+    encoded = np.asarray(data).astype(dtype)
+    encoded[fill_val_idx] = fill_value
+
+    return encoded
+
+def get_attributes(dtype, fill_value, scale_factor=None, units=None):
+    '''
+    RETURN:
+          dict - CF attributes of an encoded dataset; _FillValue has the
+                 dtype of the dataset as CF requires
+    '''
+    attributes = {'_FillValue': np.dtype(dtype).type(fill_value)}
+    if scale_factor is not None:
+        attributes['scale_factor'] = scale_factor
+        attributes['add_offset']   = 0.
+    if units is not None:
+        attributes['units'] = units
+
+    return attributes
+
+def decode_values(data, attributes):
+    '''
+    INPUT:
+          data       - narray - stored values, i.e. a slice of an encoded dataset
+          attributes - dict   - attributes of the dataset
+    RETURN:
+          narray - scaled fields as float64, flags as int16, floats as stored;
+                   decoded_fill_value wherever the stored value is _FillValue
+    '''
+    if '_FillValue' not in attributes:
+        return data
+
+    fill = data == attributes['_FillValue']
+    if 'scale_factor' in attributes:
+        data = data * np.float64(attributes['scale_factor']) + \
+               np.float64(attributes.get('add_offset', 0.))
+    elif not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.int16)
+    else:
+        return data
+
+    data[fill] = decoded_fill_value
+
+    return data
+
+def decode(dataset):
+    '''
+    INPUT:
+          dataset - h5py dataset - encoded field
+    RETURN:
+          decode_values of the whole dataset
+    '''
+    return decode_values(dataset[()], dataset.attrs)
+
+def read_decoded(hf, path):
+    '''
+    RETURN:
+          decode(hf[path]), i.e. read_decoded(hf_database, time_stamp + '/sunView_geometry/solarZenith')
+    '''
+    return decode(hf[path])
+
+def pack_valid_mask(fill_mask):
+    '''
+    RETURN:
+          uint8 narray - one bit per pixel, set where the pixel is valid
+    '''
+    return np.packbits(~np.asarray(fill_mask, dtype=bool), axis=-1)
+
+def unpack_valid_mask(packed_valid_mask, shape):
+    '''
+    RETURN:
+          bool narray of shape - True where the pixel is valid
+    '''
+    return np.unpackbits(packed_valid_mask, axis=-1, count=shape[-1]).astype(bool)
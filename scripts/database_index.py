@@ -0,0 +1,104 @@
+'''
+author: Javier Villegas
+
+One logical database over the hdf5 shards written by the MPI ranks. A
+master file holds an hdf5 external link per granule group (time stamp
+YYYYDDD.HHMM) pointing at the shard that holds it, and an index of time
+stamp -> shard. Downstream stages open the master file and read any
+granule by time stamp, i.e. hf['2017246.1855/radiance/band_1'], without
+listing directories or parsing start/end out of shard file names.
+
+Links are stored relative to the master file, so the database directory
+can be moved as a whole.
+'''
+import numpy as np
+import h5py
+import os
+
+def get_shard_index(shard_paths):
+    '''
+    INPUT:
+          shard_paths - list of str - hdf5 files with one group per time stamp
+    RETURN:
+          dict - time stamp -> shard path; a time stamp found in more than one
+                 shard is taken from the last of shard_paths
+    '''
+    shard_index = {}
+    for shard_path in shard_paths:
+        with h5py.File(shard_path, 'r') as hf_shard:
+            for time_stamp in hf_shard.keys():
+                shard_index[time_stamp] = shard_path
+
+    return shard_index
+
+def get_manifest_shard_index(manifest_records):
+    '''
+    INPUT:
+          manifest_records - dict - from processing_manifest.load_manifest
+    RETURN:
+          dict - time stamp -> shard of every granule last recorded as done
+    '''
+    return {time_stamp: record['output_file'] for time_stamp, record in\
+            manifest_records.items() if record['status'] == 'done'}
+
+def write_database_index(master_path, shard_index):
+    '''
+    INPUT:
+          master_path - str  - master hdf5 file to (re)write
+          shard_index - dict - time stamp -> shard path
+    RETURN:
+          writes the master file; written to a temporary file first so
+          readers never open a partial index
+    '''
+    master_dir  = os.path.dirname(os.path.abspath(master_path))
+    time_stamps = sorted(shard_index)
+    shards      = sorted(set(shard_index.values()))
+    shard_links = [os.path.relpath(os.path.abspath(shard), master_dir) for shard in shards]
+    shard_ids   = {shard: i for i, shard in enumerate(shards)}
+
+    temp_path = '{}.{}.tmp'.format(master_path, os.getpid())
+    with h5py.File(temp_path, 'w') as hf_master:
+        for time_stamp in time_stamps:
+            shard_link = shard_links[shard_ids[shard_index[time_stamp]]]
+            hf_master[time_stamp] = h5py.ExternalLink(shard_link, '/' + time_stamp)
+
+        index = hf_master.create_group('index')
+        index.create_dataset('time_stamps', data=np.array(time_stamps, dtype='S'))
+        index.create_dataset('shard_id', data=np.array([shard_ids[shard_index[time_stamp]]\
+                             for time_stamp in time_stamps], dtype=np.int32))
+        index.create_dataset('shards', data=np.array(shard_links, dtype='S'))
+    os.replace(temp_path, master_path)
+
+def get_time_stamps(hf_master, doy_start=None, doy_end=None):
+    '''
+    INPUT:
+          hf_master - h5py file - open master file
+          doy_start - int - first day of year to keep (inclusive)
+          doy_end   - int - last day of year to keep (inclusive)
+    RETURN:
+          list of str - time stamps in the database, in time order
+    '''
+    time_stamps = [time_stamp.decode() for time_stamp in hf_master['index/time_stamps'][()]]
+    if doy_start is not None:
+        time_stamps = [x for x in time_stamps if int(x[4:7]) >= doy_start]
+    if doy_end is not None:
+        time_stamps = [x for x in time_stamps if int(x[4:7]) <= doy_end]
+
+    return time_stamps
+
+def get_shard_path(hf_master, time_stamp):
+    '''
+    RETURN:
+          str - path of the shard holding time_stamp
+    '''
+    link = hf_master.get(time_stamp, getlink=True)
+    master_dir = os.path.dirname(os.path.abspath(hf_master.filename))
+
+    return os.path.normpath(os.path.join(master_dir, link.filename))
+
+def split_time_stamps(time_stamps, rank, size):
+    '''
+    RETURN:
+          list of str - contiguous share of time_stamps for rank out of size
+    '''
+    return [str(x) for x in np.array_split(np.array(time_stamps, dtype=object), size)[rank]]
@@ -3,63 +3,17 @@ Download MODIS 02,03,35 products from LAADS DAAC csv file
 and check the integrity of the file
 '''
 import pandas as pd
-import urllib.request
-import h5py
 import os
 import sys
-from read_MODIS_02 import get_data
+from laads_download import download_files
+from granule_validation import validate_file, levels
 #sys.argv[0] is always the script filepath
 
-def check_file_integrity(url, filename, real_file_size, fieldnames, save_path,\
-                         directory, output_file):
+def get_granule_path(url):
     '''
     Objective:
-        Check that file downloaded and has correct size and datafields are not
-        corrupt.
+        product directory and file name of a LAADS url
     '''
-
-    filename   = save_path + directory + filename
-    statinfo   = os.stat(filename)
-    downloaded_file_size  = statinfo.st_size
-
-    if url[23:25]=='02':
-        if downloaded_file_size == real_file_size :
-            try:
-                get_data(filename, fieldnames[2], 2)
-                get_data(filename, fieldnames[3], 2)
-                get_data(filename, fieldnames[4], 2)
-            except:
-                output_file.writelines(filename+' is corrupt'+'\n')
-
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
-
-    elif url[23:25]=='03':
-        if downloaded_file_size == real_file_size:
-            try:
-                get_data(filename, fieldnames[5], 2)
-                get_data(filename, fieldnames[6], 2)
-                get_data(filename, fieldnames[7], 2)
-                get_data(filename, fieldnames[8], 2)
-                get_data(filename, fieldnames[9], 2)
-                get_data(filename, fieldnames[10], 2)
-            except:
-                output_file.writelines(filename+' is corrupt'+'\n')
-
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
-
-    else:
-        if downloaded_file_size == real_file_size:
-            try:
-                get_data(filename, fieldnames[0], 2)
-                get_data(filename, fieldnames[1], 2)
-            except:
-                output_file.writelines(filename+' is corrupt'+'\n')
-        else:
-            output_file.writelines(filename+' failed to download properly'+'\n')
-
-def download_granule(url, url_base, save_path, output_file, download_check=True, filenum=None):
     #check product to put into corresponding directory
     if url[23:25]=='03':
         n = 35
@@ -74,56 +28,99 @@ def download_granule(url, url_base, save_path, output_file, download_check=True,
     #give file its full name without url path
     filename = '{}'.format(url[n:])
 
-    #arg1: Download the file and  arg2: save it locally
-    if download_check:
-        if not os.path.isfile(save_path + directory + filename):
-            try:
-                urllib.request.urlretrieve(url_base+url, save_path + directory + filename)
-                output_file.writelines('file --- {} ---  {} --- downloaded\n '.format(filenum+1, filename))
-            except:
-                output_file.writelines('unable to download: '+filename+'\n')
-        else:
-            output_file.writelines('file --- {} ---  {} --- exists\n '.format(filenum+1, filename))
-
     return filename, directory
 
+def write_download_result(output_file, result, filenum=None):
+    filename = os.path.basename(result['filename'])
+    if result['status'] == 'failed':
+        output_file.writelines('unable to download: {} ({})\n'.format(filename, result['error']))
+    else:
+        output_file.writelines('file --- {} ---  {} --- {}\n '.format(filenum, filename,\
+                                                                    result['status']))
+
+def check_file_integrity(result, level, output_file):
+    '''
+    Objective:
+        Check that the datafields of a downloaded file are not corrupt with
+        granule_validation.validate_file; size, md5 and the HDF4 header were
+        already checked by download_files. Level 'header' reads no data,
+        'sampled' a few rows, 'full' everything.
+    RETURN:
+        str - None if the file is valid, otherwise why it is not
+    '''
+    filename = result['filename']
+    product  = os.path.basename(os.path.dirname(filename))
+    error    = validate_file(filename, product, level)
+    if error is not None:
+        output_file.writelines(filename+' is corrupt ('+error+')'+'\n')
+
+    return error
+
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='download MOD021KM/MOD03/MOD35_L2 '\
+                                     'files of a LAADS query csv')
+    #if range_or_list is 1, then we recieved a range
+    #if it is 0, we recieved a list of specific files to download
+    parser.add_argument('range_or_list', help='1 for a range of rows, 0 for the '\
+                        'rows listed in corrupt_files.txt')
+    parser.add_argument('f_start', nargs='?', type=int)
+    parser.add_argument('f_end', nargs='?', type=int)
+    parser.add_argument('--workers', type=int, default=4,\
+                        help='files downloading at the same time')
+    parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--url-base', default='https://ladsweb.modaps.eosdis.nasa.gov',\
+                        help='i.e. http://localhost:8000 to test against a local server')
+    parser.add_argument('--save-path', default='../LA_PTA_MODIS_Data/')
+    parser.add_argument('--level', choices=levels + ('none',), default='header',\
+                        help='granule_validation level each downloaded file is '\
+                             'checked at, none to skip')
+    args = parser.parse_args()
 
     filepath          = '../LAADS_query.2019-10-15T18_07.csv' #sys.argv[1]
     filenames_archive = pd.read_csv(filepath,header=0)
-    url_base          = 'https://ladsweb.modaps.eosdis.nasa.gov'
-    save_path         = '../LA_PTA_MODIS_Data/'
+    url_base          = args.url_base
+    save_path         = args.save_path
     file_name_column = 'fileUrls from query MOD021KM--61 MOD03--61 MOD35_L2'\
                        '--61 2002-01-01..2019-10-15 x-124.4y39.8 x-112.8y30.7[5]'
     #print(filenames_archive.keys())
 
-    #if range_or_list is 1, then we recieved a range
-    #if it is 0, we recieved a list of specific files to download
-    range_or_list = sys.argv[1]
-
-    if range_or_list == '1':
+    if args.range_or_list == '1':
         #open a txt file to write output to
-        output_file = open("get_PTA_stats_"+sys.argv[1]+"_"+sys.argv[2]+".txt","w")
-        f_start, f_end = int(sys.argv[2]), int(sys.argv[3])
-        filenames = filenames_archive[file_name_column][f_start:f_end]
-        file_sizes = filenames_archive['size'][f_start:f_end]
+        output_file = open("get_PTA_stats_"+args.range_or_list+"_"+str(args.f_start)+".txt","w")
+        rows = slice(args.f_start, args.f_end)
     else:
         output_file = open("get_PTA_stats_corrupt_files.txt","w")
         bad_files  = pd.read_csv('corrupt_files.txt', header=None)
-        bad_file_idx = bad_files.loc[:,0]
-
-        filenames  = filenames_archive[file_name_column][bad_file_idx]
-        file_sizes = filenames_archive['size'][bad_file_idx]
-
-    fieldnames = ['Cloud_Mask', 'Quality_Assurance',\
-                  'EV_1KM_RefSB', 'EV_250_Aggr1km_RefSB', 'EV_500_Aggr1km_RefSB',\
-                  'SolarZenith', 'SensorZenith', 'SolarAzimuth','SensorAzimuth', \
-                  'Latitude', 'Longitude']
-
-    #loop to check pre downloaded files and to download files and check all their integrity
-    for idx, (url, file_size) in enumerate(zip(filenames, file_sizes)):
-        filename, directory  = download_granule(url, url_base, save_path, output_file, True, idx)
-        check_file_integrity(url, filename, file_size, fieldnames, save_path, directory, output_file)
-        print(filename,'.', end="")
+        rows = bad_files.loc[:,0]
+
+    urls       = list(filenames_archive[file_name_column][rows])
+    file_sizes = list(filenames_archive['size'][rows])
+    #md5 is only checked if the query has it
+    if 'md5sum' in filenames_archive:
+        #a blank cell is read as NaN
+        md5s = [md5 if isinstance(md5, str) else None for md5 in\
+                filenames_archive['md5sum'][rows]]
+    else:
+        md5s = [None] * len(urls)
+
+    downloads = []
+    for url, file_size, md5 in zip(urls, file_sizes, md5s):
+        filename, directory = get_granule_path(url)
+        os.makedirs(save_path + directory, exist_ok=True)
+        downloads.append((url_base + url, save_path + directory + filename, int(file_size), md5))
+
+    #size, md5 and HDF4 header are checked while each file streams in, the
+    #datafields once it is downloaded
+    for filenum, result in enumerate(download_files(downloads, max_workers=args.workers,\
+                                                    retries=args.retries)):
+        write_download_result(output_file, result, filenum+1)
+        #pyhdf is not thread safe, files are validated here and not on the
+        #download threads
+        if result['status'] != 'failed' and args.level != 'none':
+            check_file_integrity(result, args.level, output_file)
+        print(os.path.basename(result['filename']),'.', end="")
+        sys.stdout.flush()
     print('')
     output_file.close()
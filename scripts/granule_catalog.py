@@ -0,0 +1,284 @@
+'''
+author: Javier Villegas
+
+Persistent catalog of the MOD021KM/MOD03/MOD35_L2 granules downloaded for a
+PTA. The three product directories are scanned once and joined on the
+granule time stamp (YYYYDDD.HHMM) parsed from each file name, so a triplet
+is only ever made of files of the same granule. Each row keeps the paths,
+file sizes, year, day of year and, once a granule has been prescreened, its
+day/night flag and PTA coverage. Stages query the catalog by year and DOY
+window instead of listing directories of tens of thousands of files.
+
+Once granule_validation has checked a granule, each product has
+valid_MOD_xx (1 or 0) and the row the level it was checked at; a product
+downloaded again (new size) is unchecked again.
+
+build/update the catalog with
+    python granule_catalog.py PTA_file_path [MAIA_grid_file]
+giving MAIA_grid_file also prescreens every granule not prescreened yet.
+'''
+import os
+import re
+import sqlite3
+
+#product directory under the PTA path and the short name its files start with
+products = {'MOD_02': 'MOD021KM',\
+            'MOD_03': 'MOD03',\
+            'MOD_35': 'MOD35_L2'}
+
+#granule_validation results per product, the level checked and the errors
+validation_columns = [('valid_MOD_02'    , 'INTEGER'),\
+                      ('valid_MOD_03'    , 'INTEGER'),\
+                      ('valid_MOD_35'    , 'INTEGER'),\
+                      ('validation_level', 'TEXT'),\
+                      ('validation_error', 'TEXT')]
+
+#i.e. MOD021KM.A2017246.1855.061.2017258202757.hdf -> 2017246.1855
+time_stamp_regex = re.compile(r'^(MOD021KM|MOD03|MOD35_L2)\.A(\d{4})(\d{3})\.(\d{4})\.')
+
+def get_time_stamp(filename):
+    '''
+    INPUT:
+          filename - str - MODIS file name (no directory)
+    RETURN:
+          (short name, 'YYYYDDD.HHMM', year, DOY), or None if filename is not
+          a MODIS granule
+    '''
+    match = time_stamp_regex.match(filename)
+    if match is None:
+        return None
+    short_name, year, doy, hhmm = match.groups()
+
+    return short_name, '{}{}.{}'.format(year, doy, hhmm), int(year), int(doy)
+
+class GranuleCatalog(object):
+    '''
+    INPUT:
+          catalog_path - str - sqlite file; created if it does not exist
+    Use as a context manager or call close().
+    '''
+
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        #waits for another writer (i.e. granule_validation) instead of failing
+        self.connection = sqlite3.connect(catalog_path, timeout=60.)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS granules (
+                                         time_stamp  TEXT PRIMARY KEY,
+                                         year        INTEGER,
+                                         doy         INTEGER,
+                                         MOD_02      TEXT,
+                                         MOD_03      TEXT,
+                                         MOD_35      TEXT,
+                                         size_MOD_02 INTEGER,
+                                         size_MOD_03 INTEGER,
+                                         size_MOD_35 INTEGER,
+                                         day_night   TEXT,
+                                         coverage    REAL)''')
+            #catalogs built before validation was recorded get the columns added
+            columns = [column['name'] for column in\
+                       self.connection.execute('PRAGMA table_info(granules)')]
+            for column, column_type in validation_columns:
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE granules ADD COLUMN {} {}'.format(\
+                                            column, column_type))
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS granules_year_doy
+                                       ON granules (year, doy)''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def scan(self, PTA_file_path):
+        '''
+        Objective:
+            add/refresh every granule under PTA_file_path/MOD_02, MOD_03 and
+            MOD_35; prescreen results already in the catalog are kept
+        RETURN:
+            int - number of granules (time stamps) found
+        '''
+        granules = {}
+        short_names = {short_name: product for product, short_name in products.items()}
+        for product in products:
+            directory = os.path.join(PTA_file_path, product)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    parsed = get_time_stamp(entry.name)
+                    if parsed is None or not entry.is_file():
+                        continue
+                    short_name, time_stamp, year, doy = parsed
+                    if short_names[short_name] != product:
+                        continue
+                    granule = granules.setdefault(time_stamp, {'time_stamp': time_stamp,\
+                                  'year': year, 'doy': doy,\
+                                  'MOD_02': None, 'MOD_03': None, 'MOD_35': None,\
+                                  'size_MOD_02': None, 'size_MOD_03': None,\
+                                  'size_MOD_35': None})
+                    granule[product] = entry.path
+                    granule['size_' + product] = entry.stat().st_size
+
+        with self.connection:
+            self.connection.executemany('''INSERT INTO granules (time_stamp, year, doy,
+                                               MOD_02, MOD_03, MOD_35,
+                                               size_MOD_02, size_MOD_03, size_MOD_35)
+                                           VALUES (:time_stamp, :year, :doy,
+                                               :MOD_02, :MOD_03, :MOD_35,
+                                               :size_MOD_02, :size_MOD_03, :size_MOD_35)
+                                           ON CONFLICT (time_stamp) DO UPDATE SET
+                                               valid_MOD_02=CASE WHEN size_MOD_02 IS
+                                                   excluded.size_MOD_02 THEN valid_MOD_02 END,
+                                               valid_MOD_03=CASE WHEN size_MOD_03 IS
+                                                   excluded.size_MOD_03 THEN valid_MOD_03 END,
+                                               valid_MOD_35=CASE WHEN size_MOD_35 IS
+                                                   excluded.size_MOD_35 THEN valid_MOD_35 END,
+                                               validation_level=CASE WHEN
+                                                   size_MOD_02 IS excluded.size_MOD_02 AND
+                                                   size_MOD_03 IS excluded.size_MOD_03 AND
+                                                   size_MOD_35 IS excluded.size_MOD_35
+                                                   THEN validation_level END,
+                                               validation_error=CASE WHEN
+                                                   size_MOD_02 IS excluded.size_MOD_02 AND
+                                                   size_MOD_03 IS excluded.size_MOD_03 AND
+                                                   size_MOD_35 IS excluded.size_MOD_35
+                                                   THEN validation_error END,
+                                               MOD_02=excluded.MOD_02,
+                                               MOD_03=excluded.MOD_03,
+                                               MOD_35=excluded.MOD_35,
+                                               size_MOD_02=excluded.size_MOD_02,
+                                               size_MOD_03=excluded.size_MOD_03,
+                                               size_MOD_35=excluded.size_MOD_35''',\
+                                        list(granules.values()))
+
+        return len(granules)
+
+    def count(self):
+        '''
+        RETURN:
+              int - number of granules in the catalog, complete or not
+        '''
+        return self.connection.execute('SELECT COUNT(*) FROM granules').fetchone()[0]
+
+    def update_prescreen(self, time_stamp, day_night, coverage):
+        '''
+        record the prescreen.Prescreen.check result of a granule
+        '''
+        with self.connection:
+            self.connection.execute('''UPDATE granules SET day_night=?, coverage=?
+                                       WHERE time_stamp=?''',\
+                                    (day_night, coverage, time_stamp))
+
+    def update_prescreens(self, results):
+        '''
+        INPUT:
+              results - list of (time_stamp, day_night, coverage)
+        record many prescreen results in one transaction
+        '''
+        with self.connection:
+            self.connection.executemany('''UPDATE granules SET day_night=?, coverage=?
+                                           WHERE time_stamp=?''',\
+                                        [(day_night, coverage, time_stamp) for\
+                                         time_stamp, day_night, coverage in results])
+
+    def update_validation(self, time_stamp, level, errors):
+        '''
+        INPUT:
+              level  - str  - granule_validation level the granule was checked at
+              errors - dict - product -> error, None if the file is valid
+        '''
+        valid = {product: None if product not in errors else int(errors[product] is None)\
+                 for product in products}
+        error = '; '.join('{}: {}'.format(product, errors[product]) for product\
+                          in sorted(errors) if errors[product] is not None)
+        with self.connection:
+            self.connection.execute('''UPDATE granules SET valid_MOD_02=?, valid_MOD_03=?,
+                                           valid_MOD_35=?, validation_level=?,
+                                           validation_error=?
+                                       WHERE time_stamp=?''',\
+                                    (valid['MOD_02'], valid['MOD_03'], valid['MOD_35'],\
+                                     level, error or None, time_stamp))
+
+    def query(self, years=None, doy_start=None, doy_end=None, complete=True,\
+              min_coverage=None, day_night=None, exclude_invalid=False):
+        '''
+        INPUT:
+              years        - list of int - years to keep; all if None
+              doy_start    - int   - first day of year to keep (inclusive)
+              doy_end      - int   - last day of year to keep (inclusive)
+              complete     - bool  - only granules with all of MOD02/03/35
+              min_coverage - float - only prescreened granules covering at
+                                     least this fraction of the PTA
+              day_night    - list of str - i.e. ['Day', 'Both']
+              exclude_invalid - bool - leave out granules with a file found
+                                       invalid by granule_validation; not yet
+                                       validated granules are kept
+        RETURN:
+              list of sqlite3.Row (index by column name) in time stamp order
+        '''
+        conditions, arguments = [], []
+        if years is not None:
+            years = list(years)
+            conditions.append('year IN ({})'.format(','.join('?' * len(years))))
+            arguments += years
+        if doy_start is not None:
+            conditions.append('doy >= ?')
+            arguments.append(doy_start)
+        if doy_end is not None:
+            conditions.append('doy <= ?')
+            arguments.append(doy_end)
+        if complete:
+            conditions.append('MOD_02 IS NOT NULL AND MOD_03 IS NOT NULL AND MOD_35 IS NOT NULL')
+        if min_coverage is not None:
+            conditions.append('coverage >= ?')
+            arguments.append(min_coverage)
+        if day_night is not None:
+            day_night = list(day_night)
+            conditions.append('day_night IN ({})'.format(','.join('?' * len(day_night))))
+            arguments += day_night
+        if exclude_invalid:
+            conditions.append('0 NOT IN (IFNULL(valid_MOD_02, 1), IFNULL(valid_MOD_03, 1),'\
+                              ' IFNULL(valid_MOD_35, 1))')
+
+        statement = 'SELECT * FROM granules'
+        if conditions:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        statement += ' ORDER BY time_stamp'
+
+        return self.connection.execute(statement, arguments).fetchall()
+
+    def get_time_stamps(self, **kwargs):
+        '''
+        RETURN:
+              list of str - time stamps of query(**kwargs)
+        '''
+        return [granule['time_stamp'] for granule in self.query(**kwargs)]
+
+if __name__ == '__main__':
+    import sys
+
+    PTA_file_path = sys.argv[1]
+    catalog_path  = os.path.join(PTA_file_path, 'granule_catalog.sqlite')
+
+    with GranuleCatalog(catalog_path) as catalog:
+        print('{} granules in {}'.format(catalog.scan(PTA_file_path), catalog_path))
+
+        if len(sys.argv) > 2:
+            import h5py
+            import numpy as np
+            from prescreen import Prescreen
+
+            with h5py.File(sys.argv[2], 'r') as file_MAIA:
+                target_lat = file_MAIA['lat'][()].astype(np.float64)
+                target_lon = file_MAIA['lon'][()].astype(np.float64)
+            prescreen = Prescreen(target_lat, target_lon)
+
+            for granule in catalog.query():
+                if granule['coverage'] is None:
+                    screen = prescreen.check(granule['MOD_03'])
+                    catalog.update_prescreen(granule['time_stamp'],\
+                                             screen['day_night'], screen['coverage'])
@@ -0,0 +1,201 @@
+'''
+author: Javier Villegas
+
+Integrity check of downloaded MOD021KM/MOD03/MOD35_L2 files, at three levels
+    header  - the file is HDF4, SD opens and every SDS the database reads is
+              there with the expected rank, band/byte dimension and type; no
+              data is read
+    sampled - header, then a few rows of every expected SDS are read, which
+              decompresses a handful of chunks instead of the whole array
+    full    - header, then every expected SDS is read whole
+Granules are checked in a process pool (HDF4 is not thread safe) and the
+results are written to the granule catalog, so corrupt files are found once
+and skipped by every later stage.
+
+validate the catalog of a PTA with
+    python granule_validation.py PTA_file_path [header|sampled|full] [processes]
+'''
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pyhdf.SD import SD, SDC
+from laads_download import probe_hdf4
+
+levels = ('header', 'sampled', 'full')
+
+#SDS the database reads: (type, dims); None is the swath size, which varies
+#from granule to granule but has to agree between the fields of a file
+expected_sds = {'MOD_02': {'EV_250_Aggr1km_RefSB': (SDC.UINT16, (2, None, None)),\
+                           'EV_500_Aggr1km_RefSB': (SDC.UINT16, (5, None, None)),\
+                           'EV_1KM_RefSB'        : (SDC.UINT16, (15, None, None))},\
+                'MOD_03': {'Latitude'            : (SDC.FLOAT32, (None, None)),\
+                           'Longitude'           : (SDC.FLOAT32, (None, None)),\
+                           'SolarZenith'         : (SDC.INT16, (None, None)),\
+                           'SensorZenith'        : (SDC.INT16, (None, None)),\
+                           'SolarAzimuth'        : (SDC.INT16, (None, None)),\
+                           'SensorAzimuth'       : (SDC.INT16, (None, None)),\
+                           'Land/SeaMask'        : (SDC.UINT8, (None, None))},\
+                'MOD_35': {'Cloud_Mask'          : (SDC.INT8, (6, None, None)),\
+                           'Quality_Assurance'   : (SDC.INT8, (None, None, 10))}}
+
+def check_header(hdf_file, product):
+    '''
+    INPUT:
+          hdf_file - pyhdf SD - open file
+          product  - str      - 'MOD_02', 'MOD_03' or 'MOD_35'
+    RETURN:
+          dict - fieldname -> dims of every expected SDS; raises ValueError
+                 naming the first SDS that is missing or not as expected
+    '''
+    datasets   = hdf_file.datasets()
+    swath_dims = None
+    field_dims = {}
+    for fieldname, (sds_type, expected_dims) in expected_sds[product].items():
+        if fieldname not in datasets:
+            raise ValueError('{} missing'.format(fieldname))
+        dims, field_type = datasets[fieldname][1], datasets[fieldname][2]
+        if field_type != sds_type:
+            raise ValueError('{} has type {} expected {}'.format(fieldname,\
+                             field_type, sds_type))
+        if len(dims) != len(expected_dims) or any(expected is not None and\
+           dim != expected for dim, expected in zip(dims, expected_dims)):
+            raise ValueError('{} has dims {}'.format(fieldname, dims))
+
+        #swath rows/cols, the same for every field of the file
+        free_dims = tuple(dim for dim, expected in zip(dims, expected_dims)\
+                          if expected is None)
+        if swath_dims is None:
+            swath_dims = free_dims
+        elif free_dims != swath_dims:
+            raise ValueError('{} has swath {} expected {}'.format(fieldname,\
+                             free_dims, swath_dims))
+        field_dims[fieldname] = tuple(dims)
+
+    return field_dims
+
+def read_sampled_rows(field, dims, expected_dims, n_rows=3):
+    '''
+    read n_rows rows (first, last and evenly between) of a field
+    '''
+    row_axis = list(expected_dims).index(None)
+    for row in np.unique(np.linspace(0, dims[row_axis] - 1, n_rows).astype(int)):
+        selection = [slice(None)] * len(dims)
+        selection[row_axis] = slice(row, row + 1)
+        field[tuple(selection)]
+
+def validate_file(filename, product, level='header', n_rows=3):
+    '''
+    INPUT:
+          filename - str - MODIS hdf file
+          product  - str - 'MOD_02', 'MOD_03' or 'MOD_35'
+          level    - str - 'header', 'sampled' or 'full'
+          n_rows   - int - rows read per SDS at level 'sampled'
+    RETURN:
+          str - None if the file is valid, otherwise why it is not
+    '''
+    if level not in levels:
+        raise ValueError('level must be one of {}'.format(levels))
+    if not probe_hdf4(filename):
+        return 'not an HDF4 file'
+
+    try:
+        hdf_file = SD(filename)
+    except Exception as e:
+        return 'SD does not open: {!r}'.format(e)
+
+    try:
+        field_dims = check_header(hdf_file, product)
+        if level != 'header':
+            for fieldname, dims in field_dims.items():
+                field = hdf_file.select(fieldname)
+                try:
+                    if level == 'sampled':
+                        read_sampled_rows(field, dims, expected_sds[product][fieldname][1],\
+                                          n_rows)
+                    else:
+                        field.get()
+                finally:
+                    field.endaccess()
+    except Exception as e:
+        return str(e) if isinstance(e, ValueError) else repr(e)
+    finally:
+        hdf_file.end()
+
+    return None
+
+def validate_granule(granule, level='header'):
+    '''
+    INPUT:
+          granule - dict - time_stamp and MOD_02/03/35 paths, i.e. a catalog row
+          level   - str  - see validate_file
+    RETURN:
+          dict - time_stamp, level, and per product the error (None if valid);
+                 products without a file are left out
+    '''
+    result = {'time_stamp': granule['time_stamp'], 'level': level, 'errors': {}}
+    for product in expected_sds:
+        if granule[product] is not None:
+            result['errors'][product] = validate_file(granule[product], product, level)
+
+    return result
+
+def is_validated(granule, level):
+    '''
+    RETURN:
+          bool - True if the catalog row was validated at level or deeper
+    '''
+    if granule['validation_level'] is None:
+        return False
+
+    return levels.index(granule['validation_level']) >= levels.index(level)
+
+def _validate_granule(args):
+    return validate_granule(*args)
+
+def validate_catalog(catalog, level='header', processes=None, revalidate=False,\
+                     **query):
+    '''
+    INPUT:
+          catalog    - granule_catalog.GranuleCatalog
+          level      - str  - see validate_file
+          processes  - int  - worker processes; os.cpu_count() if None
+          revalidate - bool - also check granules already validated at level
+          query      - passed on to catalog.query, i.e. years=[2017]
+    RETURN:
+          list of dict - validate_granule of every invalid granule; every
+                         result is recorded with catalog.update_validation
+    '''
+    query.setdefault('complete', False)
+    granules = [dict(granule) for granule in catalog.query(**query)]
+    if not revalidate:
+        granules = [granule for granule in granules\
+                    if not is_validated(granule, level)]
+
+    invalid = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = pool.map(_validate_granule, [(granule, level) for granule in granules],\
+                           chunksize=16)
+        for result in results:
+            catalog.update_validation(result['time_stamp'], result['level'],\
+                                      result['errors'])
+            if any(error is not None for error in result['errors'].values()):
+                invalid.append(result)
+
+    return invalid
+
+if __name__ == '__main__':
+    import sys
+    from granule_catalog import GranuleCatalog
+
+    PTA_file_path = sys.argv[1]
+    level         = sys.argv[2] if len(sys.argv) > 2 else 'header'
+    processes     = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    with GranuleCatalog(os.path.join(PTA_file_path, 'granule_catalog.sqlite')) as catalog:
+        invalid = validate_catalog(catalog, level, processes)
+
+    for result in invalid:
+        for product, error in sorted(result['errors'].items()):
+            if error is not None:
+                print('{} {} {}'.format(result['time_stamp'], product, error))
+    print('{} invalid granules at level {}'.format(len(invalid), level))
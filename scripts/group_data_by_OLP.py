@@ -1,10 +1,15 @@
-def group_data(OLP, obs, CM, hf_group):
+import numpy as np
+from calc_OLP import OLP_fill_key, decode_OLP
+
+def group_data(OLP_key, obs, CM, hf_group):
     """
     Objective:
         Group data by observable_level_paramter (OLP), such that all data in same
-        group has a matching OLP. The data point is stored in the group with its
-        observables, cloud mask, time stamp, and lat/lon. Will process one MAIA
-        grid at a time. No return, will just be written to file in this function.
+        group has a matching OLP key (calc_OLP.get_OLP_key). The data point is
+        stored in the group with its observables, cloud mask, time stamp, and
+        lat/lon. Will process one MAIA grid at a time. No return, will just be
+        written to file in this function.
+        obs is (7, rows, cols), as calc_observables.read_observables returns.
     Return:
         void
     """
@@ -27,72 +32,65 @@ def group_data(OLP, obs, CM, hf_group):
     #plt.show()
     #OLP = OLP.astype(dtype=np.int)
     #flatten arrays
-    #new_OLP = new_OLP.reshape(1000**2, 6)
-    OLP = OLP.reshape(1000**2, 6)
-    obs = obs.reshape(1000**2, 7)
-    CM  = CM.reshape(1000**2)
+    OLP_key = OLP_key.reshape(-1)
+    #(7, rows, cols) as stored in the observables database -> (pixels, 7)
+    obs = obs.reshape(7, -1).T
+    CM  = CM.reshape(-1)
 
     #remove empty data points
     #where cos(SZA) is negative (which is not possible)
-    full_idx = np.where(OLP[:,0] !=-999) # obs -> (1, 1e6-x)
+    full_idx = np.where(OLP_key != OLP_fill_key)
 
-    OLP = OLP[full_idx[0], :]
-    obs = obs[full_idx[0], :]
-    CM  = CM[full_idx[0]]
+    #data point: cloud mask then the 7 observables
+    OLP_key    = OLP_key[full_idx]
+    data       = np.empty((OLP_key.shape[0], 8))
+    data[:,0]  = CM[full_idx]
+    data[:,1:] = obs[full_idx[0], :]
 
     home = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/group_DOY_05_60_cores/'
-    thresh_dict = {}
+
+    #one group per distinct OLP key; the stable sort keeps the data points of
+    #a group in pixel order
+    keys, group_idx, counts = np.unique(OLP_key, return_inverse=True, return_counts=True)
+    data   = data[np.argsort(group_idx, kind='stable')]
+    groups = np.split(data, np.cumsum(counts)[:-1])
 
     #track number of groups seen to compare to groups actually processed
     num_groups = 0
 
     #now for any OLP combo, make a group and save the data points into it
-    for i in range(CM.shape[0]):
+    for OLP_key, OLP, val in zip(keys, decode_OLP(keys), groups):
         #0 cosSZA
         #1 VZA
         #2 RAZ
         #3 TA
         #4 Scene_ID
         #5 DOY
-        temp_OLP = OLP[i,:]
-        group = 'cosSZA_{:02d}_VZA_{:02d}_RAZ_{:02d}_TA_{:02d}_sceneID_{:02d}_DOY_{:02d}'\
-                .format(temp_OLP[0], temp_OLP[1], temp_OLP[2],\
-                        1, temp_OLP[4], temp_OLP[5])
-
-        # filename = '{}grouped_data_{}.hdf5'.format(home, group)
-
-        data = np.array([CM[i]   ,\
-                         obs[i,0],\
-                         obs[i,1],\
-                         obs[i,2],\
-                         obs[i,3],\
-                         obs[i,4],\
-                         obs[i,5],\
-                         obs[i,6] ])
-
-        #add key with empty list, then populate it.
-        thresh_dict.setdefault(group, [])
-        thresh_dict[group].append(data)
-
-    for key, val in thresh_dict.items():
+        key = 'cosSZA_{:02d}_VZA_{:02d}_RAZ_{:02d}_TA_{:02d}_sceneID_{:02d}_DOY_{:02d}'\
+              .format(OLP[0], OLP[1], OLP[2], 1, OLP[4], OLP[5])
+
         try:
-            hf_group.create_dataset(key, data=np.array(val), maxshape=(None,8))
+            hf_group.create_dataset(key, data=val, maxshape=(None,8))
             num_groups += 1
         except:
-                  
+
             group_shape = hf_group[key].shape[0]
-            hf_group[key].resize(group_shape + np.array(val).shape[0], axis=0)
-            hf_group[key][group_shape:, :] = np.array(val)
+            hf_group[key].resize(group_shape + val.shape[0], axis=0)
+            hf_group[key][group_shape:, :] = val
+        #calc_threshold indexes the thresholds by the key, not the name
+        hf_group[key].attrs['OLP_key'] = OLP_key
 
         print(key[10:16])
+
 if __name__ == '__main__':
 
-    import numpy as np
     import h5py
     import mpi4py.MPI as MPI
-    import tables
     import os
-    tables.file._open_files.close_all()
+    from database_index import get_time_stamps, split_time_stamps
+    from database_encoding import read_decoded
+    from calc_observables import read_observables
+    from calc_OLP import read_OLP_key
 
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
@@ -100,35 +98,16 @@ if __name__ == '__main__':
 
     for r in range(size):
         if rank==r:
-            #file_select = np.repeat(np.arange(60), 2)
-            file_select = r#file_select[r]
-            #if r%2!=0:
-            #    file_select = r-1
-            #else:
-            #    file_select = r
-
             home = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/'
 
-            #define paths for the three databases
-            PTA_file_path = home + 'LA_database_60_cores/'
-            database_files = os.listdir(PTA_file_path)
-            database_files = [PTA_file_path + filename for filename in database_files]
-            database_files = np.sort(database_files)
-            hf_database_path = database_files[file_select]
-
-            PTA_file_path = home + 'observables_database_60_cores/'
-            database_files = os.listdir(PTA_file_path)
-            database_files = [PTA_file_path + filename for filename in database_files]
-            database_files = np.sort(database_files)
-            hf_observables_path = database_files[file_select]
-
-            PTA_file_path = home + 'OLP_database_60_cores/'
-            database_files = os.listdir(PTA_file_path)
-            database_files = [PTA_file_path + filename for filename in database_files]
-            database_files = np.sort(database_files)
-            hf_OLP_path    = database_files[file_select]
+            #master files of the three databases; any granule is read by
+            #time stamp whichever rank shard holds it
+            hf_database_path    = home + 'LA_PTA_database.hdf5'
+            hf_observables_path = home + 'LA_PTA_observables.hdf5'
+            hf_OLP_path         = home + 'LA_PTA_OLP.hdf5'
 
-            observables = ['WI', 'NDVI', 'NDSI', 'visRef', 'nirRef', 'SVI', 'cirrus']
+            #all seven observables of a granule in one read, into one buffer
+            obs_data = np.empty((7, 1000, 1000), dtype=np.float32)
 
             #get data for input into grouping function
             with h5py.File(hf_observables_path       , 'r') as hf_observables,\
@@ -136,16 +115,11 @@ if __name__ == '__main__':
                  h5py.File(hf_OLP_path               , 'r') as hf_OLP        ,\
                  open(home + 'grouped_file_count_{}.csv'.format(rank), 'w') as output:
 
-                hf_database_keys = list(hf_database.keys())
                 #grab only DOY bin 6 since I dont have sfc ID yet for other days
-                hf_database_keys = [x for x in hf_database_keys if int(x[4:7])>=49 and int(x[4:7])<=56]
+                hf_database_keys = get_time_stamps(hf_database, doy_start=49, doy_end=56)
 
-                #split the work in half per file
-                #half = len(hf_database_keys)//2
-                #if r%2==0:
-                #    hf_database_keys = hf_database_keys[:half]
-                #else:
-                #    hf_database_keys = hf_database_keys[half:]
+                #this rank's share of the granules
+                hf_database_keys = split_time_stamps(hf_database_keys, rank, size)
 
                 #open file to write groups to
                 hf_group_path = home + 'group_DOY_05_60_cores/grouped_data_{}.hdf5'.format(rank)
@@ -153,27 +127,21 @@ if __name__ == '__main__':
                     with h5py.File(hf_group_path, 'w')  as hf_group:
                         for time_stamp in hf_database_keys:
 
-                            CM  = hf_database[time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag'][()]
-                            OLP = hf_OLP[time_stamp + '/observable_level_paramter'][()]
+                            CM  = read_decoded(hf_database, time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag')
+                            OLP_key = read_OLP_key(hf_OLP, time_stamp)
 
-                            obs_data = np.empty((1000,1000,7), dtype=np.float)
-                            for i, obs in enumerate(observables):
-                                data_path = '{}/{}'.format(time_stamp, obs)
-                                obs_data[:,:,i] = hf_observables[data_path][()]
-                            group_data(OLP, obs_data, CM, hf_group)
+                            read_observables(hf_observables, time_stamp, out=obs_data)
+                            group_data(OLP_key, obs_data, CM, hf_group)
 
                             output.write('{}{}'.format(time_stamp, '\n'))
                 except: #else:
                     with h5py.File(hf_group_path, 'r+')  as hf_group:
                         for time_stamp in hf_database_keys:
 
-                            CM  = hf_database[time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag'][()]
-                            OLP = hf_OLP[time_stamp + '/observable_level_paramter'][()]
+                            CM  = read_decoded(hf_database, time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag')
+                            OLP_key = read_OLP_key(hf_OLP, time_stamp)
 
-                            obs_data = np.empty((1000,1000,7), dtype=np.float)
-                            for i, obs in enumerate(observables):
-                                data_path = '{}/{}'.format(time_stamp, obs)
-                                obs_data[:,:,i] = hf_observables[data_path][()]
-                            group_data(OLP, obs_data, CM, hf_group)
+                            read_observables(hf_observables, time_stamp, out=obs_data)
+                            group_data(OLP_key, obs_data, CM, hf_group)
 
                             output.write('{}{}'.format(time_stamp, '\n'))
@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import h5py
 from rgb_enhancment import get_enhanced_RGB #just takes RGB
+from database_encoding import read_decoded
 
 def get_R(radiance, SZA, d, E_std_0b):
     """
@@ -66,14 +67,15 @@ for i in range(1,9):
         #print(time)
         #read in data
 
+        #decoded to physical units with -999 fill, then float for the nan fill
         #radiance
-        b1_rad = np.array(database[time + '/radiance/band_1'][()]).astype(np.float64) #red
-        b3_rad = np.array(database[time + '/radiance/band_3'][()]).astype(np.float64) #blue
-        b4_rad = np.array(database[time + '/radiance/band_4'][()]).astype(np.float64) #green
+        b1_rad = read_decoded(database, time + '/radiance/band_1').astype(np.float64) #red
+        b3_rad = read_decoded(database, time + '/radiance/band_3').astype(np.float64) #blue
+        b4_rad = read_decoded(database, time + '/radiance/band_4').astype(np.float64) #green
 
-        b2_rad  = np.array(database[time + '/radiance/band_2'][()]).astype(np.float64)  #NIR/NDVI
-        b12_rad = np.array(database[time + '/radiance/band_12'][()]).astype(np.float64) #NDSI
-        b26_rad = np.array(database[time + '/radiance/band_26'][()]).astype(np.float64) #water vapor
+        b2_rad  = read_decoded(database, time + '/radiance/band_2').astype(np.float64)  #NIR/NDVI
+        b12_rad = read_decoded(database, time + '/radiance/band_12').astype(np.float64) #NDSI
+        b26_rad = read_decoded(database, time + '/radiance/band_26').astype(np.float64) #water vapor
 
         b1_rad[b1_rad==-999] = np.nan
         b3_rad[b3_rad==-999] = np.nan
@@ -82,10 +84,10 @@ for i in range(1,9):
         b12_rad[b12_rad==-999] = np.nan
         b26_rad[b26_rad==-999] = np.nan
 
-        cloud_mask = np.array(database[time + '/cloud_mask/Unobstructed_FOV_Quality_Flag'][()]).astype(np.float64)
-        sun_glint  = np.array(database[time + '/cloud_mask/Sun_glint_Flag'][()]).astype(np.float64)
-        Snow_Ice   = np.array(database[time + '/cloud_mask/Snow_Ice_Background_Flag'][()]).astype(np.float64)
-        Land_Water = np.array(database[time + '/cloud_mask/Land_Water_Flag'][()]).astype(np.float64)
+        cloud_mask = read_decoded(database, time + '/cloud_mask/Unobstructed_FOV_Quality_Flag').astype(np.float64)
+        sun_glint  = read_decoded(database, time + '/cloud_mask/Sun_glint_Flag').astype(np.float64)
+        Snow_Ice   = read_decoded(database, time + '/cloud_mask/Snow_Ice_Background_Flag').astype(np.float64)
+        Land_Water = read_decoded(database, time + '/cloud_mask/Land_Water_Flag').astype(np.float64)
 
         #just set not confiedent cloud to clear
         cloud_mask[cloud_mask != 0] = 1
@@ -96,11 +98,11 @@ for i in range(1,9):
         Land_Water[Land_Water==-999] = np.nan
 
         #cloud mask tests
-        Cloud_Flag_Spatial_Variability = np.array(database[time + '/cloud_mask_tests/Cloud_Flag_Spatial_Variability'][()]).astype(np.float64)
-        Cloud_Flag_Visible_Ratio       = np.array(database[time + '/cloud_mask_tests/Cloud_Flag_Visible_Ratio'][()]).astype(np.float64)
-        Cloud_Flag_Visible_Reflectance = np.array(database[time + '/cloud_mask_tests/Cloud_Flag_Visible_Reflectance'][()]).astype(np.float64)
-        High_Cloud_Flag_1380nm         = np.array(database[time + '/cloud_mask_tests/High_Cloud_Flag_1380nm'][()]).astype(np.float64)
-        Near_IR_Reflectance            = np.array(database[time + '/cloud_mask_tests/Near_IR_Reflectance'][()]).astype(np.float64)
+        Cloud_Flag_Spatial_Variability = read_decoded(database, time + '/cloud_mask_tests/Cloud_Flag_Spatial_Variability').astype(np.float64)
+        Cloud_Flag_Visible_Ratio       = read_decoded(database, time + '/cloud_mask_tests/Cloud_Flag_Visible_Ratio').astype(np.float64)
+        Cloud_Flag_Visible_Reflectance = read_decoded(database, time + '/cloud_mask_tests/Cloud_Flag_Visible_Reflectance').astype(np.float64)
+        High_Cloud_Flag_1380nm         = read_decoded(database, time + '/cloud_mask_tests/High_Cloud_Flag_1380nm').astype(np.float64)
+        Near_IR_Reflectance            = read_decoded(database, time + '/cloud_mask_tests/Near_IR_Reflectance').astype(np.float64)
 
         Cloud_Flag_Spatial_Variability[Cloud_Flag_Spatial_Variability==-999] = np.nan
         Cloud_Flag_Visible_Ratio[Cloud_Flag_Visible_Ratio==-999] = np.nan
@@ -109,17 +111,17 @@ for i in range(1,9):
         Near_IR_Reflectance[Near_IR_Reflectance==-999] = np.nan
 
         #geolocation
-        lat = np.array(database[time + '/geolocation/lat'][()]).astype(np.float64)
-        lon = np.array(database[time + '/geolocation/lon'][()]).astype(np.float64)
+        lat = read_decoded(database, time + '/geolocation/lat').astype(np.float64)
+        lon = read_decoded(database, time + '/geolocation/lon').astype(np.float64)
 
         lat[lat==-999] = np.nan
         lon[lon==-999] = np.nan
 
         #sunview geometry
-        SZA = np.array(database[time + '/sunView_geometry/solarZenith'][()]).astype(np.float64)
-        VZA = np.array(database[time + '/sunView_geometry/sensorZenith'][()]).astype(np.float64)
-        VAA = np.array(database[time + '/sunView_geometry/sensorAzimuth'][()]).astype(np.float64)
-        SAA = np.array(database[time + '/sunView_geometry/solarAzimuth'][()]).astype(np.float64)
+        SZA = read_decoded(database, time + '/sunView_geometry/solarZenith').astype(np.float64)
+        VZA = read_decoded(database, time + '/sunView_geometry/sensorZenith').astype(np.float64)
+        VAA = read_decoded(database, time + '/sunView_geometry/sensorAzimuth').astype(np.float64)
+        SAA = read_decoded(database, time + '/sunView_geometry/solarAzimuth').astype(np.float64)
 
         SZA[SZA==-999] = np.nan
         VZA[VZA==-999] = np.nan
@@ -0,0 +1,191 @@
+'''
+author: Javier Villegas
+
+Concurrent, resumable download of MODIS files from LAADS DAAC. Each file is
+streamed to <file>.part, resumed with an http Range request after a dropped
+connection, retried with exponential backoff, and only renamed into place
+once its size, md5 (when known) and HDF4 header check out. The size and md5
+are computed on the bytes as they arrive, so the file is never read again
+to verify it.
+
+url_base is any http server with the LAADS paths. laads_test_server.py
+serves a directory of files with Range support, and its __main__ checks
+resume, md5 mismatch, non-HDF4 files and 4xx errors against download_file.
+'''
+import hashlib
+import http.client
+import os
+import random
+import socket
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+#first bytes of every HDF4 file
+hdf4_magic = b'\x0e\x03\x13\x01'
+
+#http statuses worth retrying; other 4xx mean the request itself is wrong
+retry_status = (408, 429, 500, 502, 503, 504)
+
+chunk_size = 1024**2
+
+def is_hdf4_header(head):
+    '''
+    INPUT:
+          head - bytes - first bytes of a file
+    RETURN:
+          bool - True if head starts with the HDF4 magic number
+    '''
+    return head[:len(hdf4_magic)] == hdf4_magic
+
+def probe_hdf4(filename):
+    '''
+    RETURN:
+          bool - True if filename starts with the HDF4 magic number; reads
+                 4 bytes instead of decompressing any SDS
+    '''
+    try:
+        with open(filename, 'rb') as hdf_file:
+            return is_hdf4_header(hdf_file.read(len(hdf4_magic)))
+    except OSError:
+        return False
+
+def get_md5(filename):
+    '''
+    RETURN:
+          hashlib md5 of the bytes already in filename, to resume hashing
+    '''
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as part:
+        for block in iter(lambda: part.read(chunk_size), b''):
+            md5.update(block)
+
+    return md5
+
+class DownloadError(Exception):
+    '''
+    download failed; retryable is False if trying again cannot help
+    '''
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def _stream(url, part_path, expected_size, timeout, headers):
+    '''
+    append the rest of url to part_path
+    RETURN:
+          hashlib md5 of the whole part file
+    '''
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if expected_size is not None and offset > expected_size:
+        os.remove(part_path)
+        offset = 0
+
+    request_headers = dict(headers or {})
+    if offset > 0:
+        request_headers['Range'] = 'bytes={}-'.format(offset)
+    request = urllib.request.Request(url, headers=request_headers)
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        #416: nothing left past offset, i.e. the part file is complete
+        if e.code == 416 and offset > 0:
+            return get_md5(part_path)
+        raise DownloadError('HTTP {} for {}'.format(e.code, url),\
+                            retryable=e.code in retry_status)
+
+    with response:
+        if offset > 0 and response.status == 206:
+            #resume the checksum from the bytes already on disk
+            md5, mode = get_md5(part_path), 'ab'
+        else:
+            #server ignored the range, start over
+            md5, mode = hashlib.md5(), 'wb'
+        with open(part_path, mode) as part:
+            for block in iter(lambda: response.read(chunk_size), b''):
+                md5.update(block)
+                part.write(block)
+
+    return md5
+
+def download_file(url, filename, expected_size=None, expected_md5=None, retries=5,\
+                  backoff=2., timeout=60, headers=None):
+    '''
+    INPUT:
+          url           - str   - full url of the file
+          filename      - str   - where to save it
+          expected_size - int   - bytes, from the LAADS query; not checked if None
+          expected_md5  - str   - hex md5, from the LAADS query; not checked if None
+          retries       - int   - attempts after the first one
+          backoff       - float - seconds before the first retry, doubled
+                                  after each attempt (with jitter)
+          timeout       - float - seconds without data before a retry
+          headers       - dict  - extra http headers, i.e. an Authorization token
+    RETURN:
+          dict - {'filename', 'status' ('exists', 'downloaded' or 'failed'),
+                  'attempts', 'error'}
+    '''
+    result = {'filename': filename, 'status': None, 'attempts': 0, 'error': None}
+
+    #a complete file is never downloaded again
+    if os.path.isfile(filename) and (expected_size is None or \
+       os.path.getsize(filename) == expected_size) and probe_hdf4(filename):
+        result['status'] = 'exists'
+        return result
+
+    part_path = filename + '.part'
+    for attempt in range(retries + 1):
+        result['attempts'] = attempt + 1
+        try:
+            md5  = _stream(url, part_path, expected_size, timeout, headers)
+            size = os.path.getsize(part_path)
+            #a file that is whole but wrong is started over on the next attempt
+            if expected_size is not None and size != expected_size:
+                if size > expected_size:
+                    os.remove(part_path)
+                raise DownloadError('size {} expected {}'.format(size, expected_size))
+            if expected_md5 is not None and md5.hexdigest() != expected_md5.lower():
+                os.remove(part_path)
+                raise DownloadError('md5 {} expected {}'.format(md5.hexdigest(), expected_md5))
+            if not probe_hdf4(part_path):
+                os.remove(part_path)
+                raise DownloadError('not an HDF4 file')
+
+            os.replace(part_path, filename)
+            result['status'], result['error'] = 'downloaded', None
+            return result
+
+        except (DownloadError, urllib.error.URLError, http.client.HTTPException,\
+                socket.timeout, ConnectionError) as e:
+            result['error'] = str(e)
+            if isinstance(e, DownloadError) and not e.retryable:
+                break
+            if attempt < retries:
+                time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.))
+        except OSError as e:
+            #local file error, i.e. disk full or no such directory; trying
+            #again cannot help, and the other downloads go on
+            result['error'] = repr(e)
+            break
+
+    result['status'] = 'failed'
+    return result
+
+def download_files(downloads, max_workers=4, **kwargs):
+    '''
+    INPUT:
+          downloads   - list  - (url, filename, expected_size, expected_md5)
+          max_workers - int   - files downloading at the same time; LAADS
+                                throttles clients that open too many
+          kwargs      - passed on to download_file
+    RETURN:
+          generator - result of download_file for each file, as they finish
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(download_file, url, filename, expected_size,\
+                               expected_md5, **kwargs) for url, filename,\
+                               expected_size, expected_md5 in downloads]
+        for future in as_completed(futures):
+            yield future.result()
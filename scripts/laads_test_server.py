@@ -0,0 +1,163 @@
+'''
+author: Javier Villegas
+
+Local stand-in for LAADS DAAC to test laads_download without the network.
+Files under a directory are served at their relative path with http Range
+support (206 with Content-Range, 416 past the end of the file, 404 for a
+missing file). A file can also be set to drop the connection part way
+through its first response, to exercise resume.
+
+serve a directory of MOD021KM/MOD03/MOD35_L2 files with
+    python laads_test_server.py directory [port]
+or check download_file against fixtures (resume, md5 mismatch, non-HDF4,
+404, complete .part file, disk error) with
+    python laads_test_server.py
+'''
+import http.server
+import os
+import shutil
+import threading
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    GET of the files under server.directory; server.drop_after maps a url
+    path to the bytes sent before its first response is cut short
+    '''
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = os.path.join(self.server.directory, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        self.server.requests.append((self.path, self.headers.get('Range')))
+
+        size  = os.path.getsize(path)
+        start = 0
+        if self.headers.get('Range', '').startswith('bytes='):
+            start = int(self.headers['Range'][len('bytes='):].split('-')[0])
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+
+        with open(path, 'rb') as served:
+            served.seek(start)
+            body = served.read()
+        drop_after = self.server.drop_after.pop(self.path, None)
+        try:
+            if drop_after is not None:
+                #Content-Length promised the whole file, the client sees a
+                #dropped connection
+                self.wfile.write(body[:drop_after])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+        except ConnectionError:
+            #client gave up on the file, i.e. it could not write it
+            self.close_connection = True
+
+def serve(directory, port=0):
+    '''
+    INPUT:
+          directory - str - files to serve
+          port      - int - 0 for any free port
+    RETURN:
+          server - ThreadingHTTPServer answering on a daemon thread; url base
+                   is 'http://127.0.0.1:{}'.format(server.server_port), stop
+                   it with server.shutdown()
+    '''
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), RangeRequestHandler)
+    server.directory  = directory
+    server.drop_after = {}
+    server.requests   = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+if __name__ == '__main__':
+    import hashlib
+    import sys
+    import tempfile
+    from laads_download import download_file, hdf4_magic
+
+    if len(sys.argv) > 1:
+        server = serve(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+        print('serving {} at http://127.0.0.1:{}'.format(sys.argv[1], server.server_port))
+        threading.Event().wait()
+
+    fixtures = tempfile.mkdtemp()
+    output   = tempfile.mkdtemp()
+    body     = hdf4_magic + os.urandom(3 * 1024**2)
+    md5      = hashlib.md5(body).hexdigest()
+    with open(os.path.join(fixtures, 'granule.hdf'), 'wb') as fixture:
+        fixture.write(body)
+    with open(os.path.join(fixtures, 'not_hdf4.hdf'), 'wb') as fixture:
+        fixture.write(b'<html>' + body[6:])
+
+    server   = serve(fixtures)
+    url_base = 'http://127.0.0.1:{}/'.format(server.server_port)
+    options  = {'retries': 2, 'backoff': 0.01, 'timeout': 10}
+
+    def check(name, fixture, expected_status, expected_attempts=None, filename=None,\
+              **kwargs):
+        filename = filename or os.path.join(output, name + '.hdf')
+        result   = download_file(url_base + fixture, filename, **dict(options, **kwargs))
+        passed   = result['status'] == expected_status and (expected_attempts is None\
+                   or result['attempts'] == expected_attempts)
+        print('{:<24s} {:<10s} attempts {} {} {}'.format(name, result['status'],\
+              result['attempts'], 'ok' if passed else 'FAILED', result['error'] or ''))
+        return passed
+
+    passed = []
+
+    #dropped after 1 MB, the second attempt asks for the rest with a Range
+    server.drop_after['/granule.hdf'] = 1024**2
+    del server.requests[:]
+    passed.append(check('resume', 'granule.hdf', 'downloaded', 2,\
+                        expected_size=len(body), expected_md5=md5))
+    passed.append(server.requests[-1][1] == 'bytes={}-'.format(1024**2))
+    with open(os.path.join(output, 'resume.hdf'), 'rb') as downloaded:
+        passed.append(downloaded.read() == body)
+
+    #already whole on disk
+    passed.append(check('exists', 'granule.hdf', 'exists', 0,\
+                        filename=os.path.join(output, 'resume.hdf'),\
+                        expected_size=len(body)))
+
+    #whole .part left by an earlier run, the server answers 416
+    shutil.copy(os.path.join(fixtures, 'granule.hdf'),\
+                os.path.join(output, 'complete_part.hdf.part'))
+    passed.append(check('complete .part (416)', 'granule.hdf', 'downloaded', 1,\
+                        filename=os.path.join(output, 'complete_part.hdf'),\
+                        expected_size=len(body), expected_md5=md5))
+
+    #retried, then failed; no partial file left behind
+    passed.append(check('md5 mismatch', 'granule.hdf', 'failed', 3,\
+                        expected_size=len(body), expected_md5='0' * 32))
+    passed.append(not os.path.exists(os.path.join(output, 'md5 mismatch.hdf.part')))
+
+    passed.append(check('not HDF4', 'not_hdf4.hdf', 'failed', 3))
+
+    #not retried
+    passed.append(check('404', 'missing.hdf', 'failed', 1))
+
+    #local file error comes back as a result instead of raising
+    passed.append(check('no such directory', 'granule.hdf', 'failed', 1,\
+                        filename=os.path.join(output, 'missing_dir', 'granule.hdf')))
+
+    server.shutdown()
+    shutil.rmtree(fixtures)
+    shutil.rmtree(output)
+
+    sys.exit(0 if all(passed) else 1)
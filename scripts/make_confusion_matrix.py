@@ -102,10 +102,8 @@ if __name__ == '__main__':
 
     import h5py
     import mpi4py.MPI as MPI
-    import tables
     import os
     import numpy as np
-    tables.file._open_files.close_all()
 
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
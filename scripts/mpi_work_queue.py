@@ -0,0 +1,146 @@
+'''
+author: Javier Villegas
+
+Dynamic master/worker scheduling over MPI. Rank 0 only dispatches: it hands
+one task at a time, heaviest first, to whichever worker asks next, so a rank
+that draws long granules does not hold up the whole job. Workers send how
+long they have been busy once they are stopped, which gives the
+utilization of each rank at the end of the job.
+
+A worker may ask for its next task before it is done with the current one
+(get_tasks consumed ahead, i.e. by async_io.Prefetcher), so only the
+thread iterating get_tasks may talk to rank 0 until work sends its report,
+and MPI must be initialized with at least MPI.THREAD_SERIALIZED when that
+is not the main thread.
+
+A worker that fails sends its report without being stopped; dispatch takes
+that as the worker leaving, so the job ends instead of waiting for it.
+'''
+import time
+import numpy as np
+
+#worker -> dispatcher: ready for work
+#dispatcher -> worker: a task, or stop
+#worker -> dispatcher: its stats, once stopped
+work_tag   = 1
+stop_tag   = 2
+report_tag = 3
+
+def dispatch(comm, tasks, weights=None):
+    '''
+    INPUT:
+          comm    - mpi4py communicator; must have at least 2 ranks
+          tasks   - list - picklable tasks, i.e. granule dicts
+          weights - list of float - expected cost of each task, i.e. input
+                                    file size; handed out largest first
+    RETURN:
+          dict - worker rank -> {'n_tasks', 'busy', 'wall'} (seconds), and
+                 'error' for a worker that failed
+    '''
+    from mpi4py import MPI
+
+    if weights is None:
+        order = np.arange(len(tasks))
+    else:
+        order = np.argsort(-np.asarray(weights, dtype=np.float64), kind='stable')
+
+    status    = MPI.Status()
+    n_workers = comm.Get_size() - 1
+    next_task = 0
+    stopped   = set()
+    stats     = {}
+    while len(stopped) < n_workers:
+        message = comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+        worker  = status.Get_source()
+
+        #a report before the worker was stopped means it failed and left
+        if status.Get_tag() == report_tag:
+            stats[worker] = message
+            stopped.add(worker)
+        elif next_task < len(order):
+            comm.send(tasks[order[next_task]], dest=worker, tag=work_tag)
+            next_task += 1
+        else:
+            comm.send(None, dest=worker, tag=stop_tag)
+            stopped.add(worker)
+
+    while len(stats) < n_workers:
+        report = comm.recv(source=MPI.ANY_SOURCE, tag=report_tag, status=status)
+        stats[status.Get_source()] = report
+
+    return stats
+
+def get_tasks(comm):
+    '''
+    INPUT:
+          comm - mpi4py communicator
+    RETURN:
+          generator - tasks from dispatch; the next task is only asked for
+                      when the generator is advanced
+    '''
+    from mpi4py import MPI
+
+    status = MPI.Status()
+    while True:
+        comm.send(None, dest=0, tag=work_tag)
+        task = comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+        if status.Get_tag() == stop_tag:
+            return
+        yield task
+
+def work(comm, process_task, tasks=None):
+    '''
+    INPUT:
+          comm         - mpi4py communicator
+          process_task - function - called with each task from dispatch
+          tasks        - iterable - get_tasks(comm) if None; pass a wrapper of
+                                    it to fetch tasks ahead, i.e. a
+                                    Prefetcher over get_tasks(comm)
+    RETURN:
+          dict - {'n_tasks', 'busy', 'wall'} of this worker, also sent to
+                 dispatch once tasks is exhausted; sent with 'error' too if
+                 process_task raised, before the exception is re-raised
+    '''
+    if tasks is None:
+        tasks = get_tasks(comm)
+
+    t_start = time.time()
+    report  = {'n_tasks': 0, 'busy': 0., 'wall': 0.}
+    try:
+        for task in tasks:
+            t0 = time.time()
+            process_task(task)
+            report['busy']    += time.time() - t0
+            report['n_tasks'] += 1
+    except BaseException as e:
+        report['error'] = repr(e)
+        #no other thread may be asking rank 0 for tasks while the report goes
+        if hasattr(tasks, 'close'):
+            tasks.close()
+        raise
+    finally:
+        report['wall'] = time.time() - t_start
+        comm.send(report, dest=0, tag=report_tag)
+
+    return report
+
+def format_utilization(stats):
+    '''
+    RETURN:
+          str - one line per worker rank and a total, for the job log
+    '''
+    lines = ['rank  tasks    busy [s]    wall [s]  utilization']
+    for worker in sorted(stats):
+        report = stats[worker]
+        lines.append('{:>4d} {:>6d} {:>11.1f} {:>11.1f} {:>11.1%}{}'.format(worker,\
+                     report['n_tasks'], report['busy'], report['wall'],\
+                     report['busy'] / max(report['wall'], 1e-9),\
+                     '  failed: ' + report['error'] if 'error' in report else ''))
+
+    busy = sum(report['busy'] for report in stats.values())
+    wall = sum(report['wall'] for report in stats.values())
+    lines.append('total {:>5d} {:>11.1f} {:>11.1f} {:>11.1%}'.format(\
+                 sum(report['n_tasks'] for report in stats.values()), busy, wall,\
+                 busy / max(wall, 1e-9)))
+
+    return '\n'.join(lines)
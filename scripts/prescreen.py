@@ -0,0 +1,181 @@
+'''
+author: Javier Villegas
+
+Cheap test of whether a granule is worth processing. Only a coarse subsample
+of the MOD03 lat/lon and the core metadata day/night flag are read; the
+fraction of a subsample of the MAIA target grid inside the swath outline
+is the coverage of the granule. Granules that are night
+passes or cover less than min_coverage are skipped before any radiance or
+cloud mask I/O happens.
+
+lat/lon polygons are tested in degrees, which is fine for a target area
+that does not straddle the poles or the antimeridian (i.e. the LA PTA).
+'''
+import numpy as np
+import re
+from pyhdf.SD import SD
+from regrid import get_valid_geolocation
+
+def points_in_polygon(x, y, polygon_x, polygon_y):
+    '''
+    Objective:
+        even-odd ray casting, vectorized over the points
+    Arguments:
+        x, y {narrays} -- points to test, any shape
+        polygon_x, polygon_y {1D narrays} -- polygon vertices in order
+    Returns:
+        {bool narray} -- True for points inside the polygon, shape of x
+    '''
+    inside = np.zeros(np.shape(x), dtype=bool)
+    x_j, y_j = polygon_x[-1], polygon_y[-1]
+    for x_i, y_i in zip(polygon_x, polygon_y):
+        crosses = (y_i > y) != (y_j > y)
+        if y_i != y_j:
+            x_cross = (x_j - x_i) * (y - y_i) / (y_j - y_i) + x_i
+            inside ^= crosses & (x < x_cross)
+        x_j, y_j = x_i, y_i
+
+    return inside
+
+def get_outline(lat, lon):
+    '''
+    Arguments:
+        lat, lon {2D narrays} -- swath or grid geolocation
+    Returns:
+        outline_lat, outline_lon {1D narrays} -- edge pixels walked around the
+            grid in order; fill values are dropped
+    '''
+    def walk(grid):
+        return np.concatenate((grid[0, :], grid[1:, -1], grid[-1, -2::-1],\
+                               grid[-2:0:-1, 0]))
+
+    outline_lat, outline_lon = walk(lat), walk(lon)
+    valid = get_valid_geolocation(outline_lat, outline_lon)
+
+    return outline_lat[valid], outline_lon[valid]
+
+def get_day_night_flag(hdf_file):
+    '''
+    Arguments:
+        hdf_file {pyhdf SD} -- open MOD03 (or MOD02/35) file
+    Returns:
+        {str} -- 'Day', 'Night', 'Both' from CoreMetadata.0, or None if the
+                 flag is not there
+    '''
+    try:
+        core_metadata = hdf_file.attributes()['CoreMetadata.0']
+    except KeyError:
+        return None
+
+    flag = re.search(r'OBJECT\s*=\s*DAYNIGHTFLAG.*?VALUE\s*=\s*"(\w+)"',\
+                     core_metadata, re.DOTALL)
+    if flag is None:
+        return None
+
+    return flag.group(1)
+
+def get_swath_subsample(hdf_file, stride):
+    '''
+    Returns:
+        lat, lon {2D narrays} -- every stride-th MOD03 pixel in both directions;
+            only these are read from disk
+    '''
+    lat = hdf_file.select('Latitude')[::stride, ::stride].astype(np.float64)
+    lon = hdf_file.select('Longitude')[::stride, ::stride].astype(np.float64)
+
+    return lat, lon
+
+class Prescreen(object):
+    '''
+    Objective:
+        decide per granule if it overlaps the target grid enough to process
+    Arguments:
+        target_lat, target_lon {2D narrays} -- lat/lon of the MAIA grid
+        min_coverage {float} -- fraction of the target grid the swath must
+                                cover for the granule to be processed
+        stride {int} -- MOD03 (and target grid) subsample step in pixels
+        day_only {bool} -- skip night passes
+    '''
+
+    def __init__(self, target_lat, target_lon, min_coverage=0.05, stride=10,\
+                 day_only=True):
+        self.min_coverage = min_coverage
+        self.stride       = stride
+        self.day_only     = day_only
+        self.skipped      = 0
+
+        #subsample of the target pixels for the coverage fraction
+        self.target_lat = target_lat[::stride, ::stride].ravel()
+        self.target_lon = target_lon[::stride, ::stride].ravel()
+        valid = get_valid_geolocation(self.target_lat, self.target_lon)
+        self.target_lat, self.target_lon = self.target_lat[valid], self.target_lon[valid]
+
+    def get_coverage(self, swath_lat, swath_lon):
+        '''
+        Arguments:
+            swath_lat, swath_lon {2D narrays} -- subsampled swath geolocation
+        Returns:
+            {float} -- fraction of the target grid inside the swath outline
+        '''
+        outline_lat, outline_lon = get_outline(swath_lat, swath_lon)
+        if outline_lat.size < 3:
+            return 0.
+
+        target_in_swath = points_in_polygon(self.target_lon, self.target_lat,\
+                                            outline_lon, outline_lat)
+
+        return float(target_in_swath.mean())
+
+    def check(self, filename_MOD_03):
+        '''
+        Arguments:
+            filename_MOD_03 {str} -- MOD03 filepath
+        Returns:
+            {dict} -- 'process'   bool  - granule passes the prescreen
+                      'coverage'  float - fraction of target grid covered
+                      'day_night' str   - 'Day', 'Night' or 'Both'; None
+                                          if neither the metadata flag nor
+                                          a valid SolarZenith is there
+        '''
+        hdf_file = SD(filename_MOD_03)
+        try:
+            swath_lat, swath_lon = get_swath_subsample(hdf_file, self.stride)
+
+            day_night = get_day_night_flag(hdf_file)
+            if day_night is None:
+                #no metadata flag; day if the sun is up anywhere in the swath
+                solarZenith = hdf_file.select('SolarZenith')
+                scale_factor = solarZenith.attributes()['scale_factor']
+                SZA = solarZenith[::self.stride, ::self.stride] * scale_factor
+                #fill values (-32767 counts) are negative, not a sun overhead
+                SZA = SZA[SZA >= 0]
+                if SZA.size == 0:
+                    day_night = None
+                elif np.all(SZA < 85.):
+                    day_night = 'Day'
+                elif np.any(SZA < 85.):
+                    day_night = 'Both'
+                else:
+                    day_night = 'Night'
+        finally:
+            hdf_file.end()
+
+        coverage = self.get_coverage(swath_lat, swath_lon)
+
+        return {'process'  : self.passes(coverage, day_night),\
+                'coverage' : coverage,\
+                'day_night': day_night}
+
+    def passes(self, coverage, day_night):
+        '''
+        Returns:
+            {bool} -- True if a granule with this coverage/day night flag (i.e.
+                      recorded earlier in the granule catalog) is processed
+        '''
+        process = coverage >= self.min_coverage
+        if self.day_only and day_night == 'Night':
+            process = False
+        if not process:
+            self.skipped += 1
+
+        return process
@@ -0,0 +1,132 @@
+'''
+author: Javier Villegas
+
+Per granule record of database ingest. Every rank appends one json line per
+granule to its own manifest file (no locking between ranks) with the
+granule time stamp, status ('done', 'failed' or 'skipped'), the hdf5 file it
+was written to, a checksum of its input files, the error if it failed and
+the prescreen result if the granule was prescreened.
+The last record of a granule is its current state, so a resumed run only
+schedules granules that are missing, failed, whose input files changed
+since they were ingested, or that were skipped under other prescreen
+settings.
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+
+#statuses that do not need to be redone while the inputs are unchanged
+final_statuses = ('done', 'skipped')
+
+def get_input_checksum(filenames):
+    '''
+    INPUT:
+          filenames - list of str - input files of a granule, i.e. MOD02/03/35
+    RETURN:
+          str - sha1 of the name, size and modification time of each file;
+                cheap to compute for every granule on each resume, and it
+                changes when a file is downloaded again
+    '''
+    checksum = hashlib.sha1()
+    for filename in filenames:
+        statinfo = os.stat(filename)
+        checksum.update('{}:{}:{}\n'.format(os.path.basename(filename),\
+                        statinfo.st_size, statinfo.st_mtime_ns).encode())
+
+    return checksum.hexdigest()
+
+def load_manifest(manifest_dir):
+    '''
+    INPUT:
+          manifest_dir - str - directory with the manifest_rank_*.jsonl files
+    RETURN:
+          dict - time stamp -> latest record of that granule
+    '''
+    records = {}
+    if not os.path.isdir(manifest_dir):
+        return records
+
+    for manifest_file in sorted(os.listdir(manifest_dir)):
+        if not manifest_file.endswith('.jsonl'):
+            continue
+        with open(os.path.join(manifest_dir, manifest_file), 'r') as manifest:
+            for line in manifest:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    #line cut short by a node failure
+                    continue
+                previous = records.get(record['time_stamp'])
+                if previous is None or record['time'] >= previous['time']:
+                    records[record['time_stamp']] = record
+
+    return records
+
+def needs_processing(record, checksum, prescreen_settings=None):
+    '''
+    INPUT:
+          prescreen_settings - dict - Prescreen arguments of this run; a
+                                      granule skipped under other settings
+                                      (or unrecorded ones) is prescreened again
+    RETURN:
+          bool - True if the granule has no record, did not finish, its
+                 inputs changed since the record was written, or it was
+                 skipped under other prescreen settings
+    '''
+    if record is None:
+        return True
+    if record['status'] == 'skipped' and prescreen_settings is not None and\
+       record.get('prescreen_settings') != prescreen_settings:
+        return True
+
+    return record['status'] not in final_statuses or record['checksum'] != checksum
+
+class ProcessingManifest(object):
+    '''
+    INPUT:
+          manifest_dir - str - shared directory of the manifest files
+          rank         - int - MPI rank; each rank appends to its own file
+    '''
+
+    def __init__(self, manifest_dir, rank):
+        os.makedirs(manifest_dir, exist_ok=True)
+        self.manifest_path = os.path.join(manifest_dir,\
+                                          'manifest_rank_{:0>3d}.jsonl'.format(rank))
+        self.manifest = open(self.manifest_path, 'a')
+        #records come from the ingest and the writer thread of a rank
+        self.lock     = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.manifest.close()
+
+    def record(self, time_stamp, status, output_file, checksum, error=None, prescreen=None,\
+               prescreen_settings=None):
+        '''
+        append the state of one granule; flushed to disk right away so a node
+        failure loses at most the granule in progress. prescreen is the
+        (day_night, coverage) of a granule prescreened by this run, kept for
+        rank 0 to write to the granule catalog; prescreen_settings are the
+        Prescreen arguments a 'skipped' granule was judged with
+        '''
+        record = {'time_stamp' : time_stamp,\
+                  'status'     : status,\
+                  'output_file': output_file,\
+                  'checksum'   : checksum,\
+                  'error'      : error,\
+                  'time'       : time.time()}
+        if prescreen is not None:
+            record['day_night'], record['coverage'] = prescreen
+        if prescreen_settings is not None:
+            record['prescreen_settings'] = prescreen_settings
+        with self.lock:
+            self.manifest.write(json.dumps(record) + '\n')
+            self.manifest.flush()
+            os.fsync(self.manifest.fileno())
@@ -0,0 +1,139 @@
+'''
+author: Javier Villegas
+
+Declarative description of what goes into the granule database. A product
+spec lists the MODIS bands and fields to save; plan_reads turns it into the
+HDF4 reads and decodes build_data_base has to do, so fields that are not
+requested are never read. Switching database variants is a change to the
+spec (a json file) instead of commenting code in and out.
+'''
+import json
+
+#what the LA PTA database has been built with
+#in order MAIA  bands 6,9,4,5,12,13
+#in order MODIS bands 1,2,3,4,6 ,26
+default_product_spec = {'radiance'         : [1, 2, 3, 4, 6, 26],\
+                        'reflectance'      : [],\
+                        'geometry'         : ['solarAzimuth', 'sensorAzimuth',\
+                                              'solarZenith', 'sensorZenith'],\
+                        'geolocation'      : ['lat', 'lon'],\
+                        'cloud_mask'       : ['Cloud_Mask_Flag', 'Day_Night_Flag',\
+                                              'Sun_glint_Flag', 'Snow_Ice_Background_Flag',\
+                                              'Land_Water_Flag', 'Unobstructed_FOV_Quality_Flag'],\
+                        'cloud_mask_tests' : [],\
+                        'MOD03_LandSeaMask': True}
+
+#MOD021KM reflective solar fields (aggregated to 1km) and their bands
+band_fieldnames = {'EV_250_Aggr1km_RefSB': ['1', '2'],\
+                   'EV_500_Aggr1km_RefSB': ['3', '4', '5', '6', '7'],\
+                   'EV_1KM_RefSB'        : ['8', '9', '10', '11', '12', '13lo',\
+                                            '13hi', '14lo', '14hi', '15', '16',\
+                                            '17', '18', '19', '26']}
+
+#MOD03 field of each geometry name
+geometry_fieldnames = {'solarZenith'  : 'SolarZenith',\
+                       'sensorZenith' : 'SensorZenith',\
+                       'solarAzimuth' : 'SolarAzimuth',\
+                       'sensorAzimuth': 'SensorAzimuth'}
+
+#index of each name in read_MODIS_35.decode_byte_1_shift/decode_tests_shift
+cloud_mask_names       = ['Cloud_Mask_Flag', 'Unobstructed_FOV_Quality_Flag',\
+                          'Day_Night_Flag', 'Sun_glint_Flag',\
+                          'Snow_Ice_Background_Flag', 'Land_Water_Flag']
+cloud_mask_tests_names = ['High_Cloud_Flag_1380nm', 'Cloud_Flag_Visible_Reflectance',\
+                          'Cloud_Flag_Visible_Ratio', 'Near_IR_Reflectance',\
+                          'Cloud_Flag_Spatial_Variability']
+
+geolocation_names = ['lat', 'lon']
+
+def get_band_fieldname(band):
+    '''
+    INPUT:
+          band - int/str - MODIS reflective solar band number, i.e. 26 or '13lo'
+    RETURN:
+          str - MOD021KM field holding the band
+    '''
+    for fieldname, bands in band_fieldnames.items():
+        if str(band) in bands:
+            return fieldname
+
+    raise ValueError('MODIS band {} is not a reflective solar band'.format(band))
+
+def check_product_spec(product_spec):
+    '''
+    INPUT:
+          product_spec - dict - see default_product_spec
+    RETURN:
+          the spec with every key present; raises ValueError on unknown keys,
+          bands or field names
+    '''
+    unknown_keys = set(product_spec) - set(default_product_spec)
+    if unknown_keys:
+        raise ValueError('unknown product spec keys {}'.format(sorted(unknown_keys)))
+
+    checked_spec = {'radiance'         : [],\
+                    'reflectance'      : [],\
+                    'geometry'         : [],\
+                    'geolocation'      : [],\
+                    'cloud_mask'       : [],\
+                    'cloud_mask_tests' : [],\
+                    'MOD03_LandSeaMask': False}
+    checked_spec.update(product_spec)
+
+    for band in checked_spec['radiance'] + checked_spec['reflectance']:
+        get_band_fieldname(band)
+
+    valid_names = {'geometry'        : geometry_fieldnames,\
+                   'geolocation'     : geolocation_names,\
+                   'cloud_mask'      : cloud_mask_names,\
+                   'cloud_mask_tests': cloud_mask_tests_names}
+    for key, names in valid_names.items():
+        unknown_names = [name for name in checked_spec[key] if name not in names]
+        if unknown_names:
+            raise ValueError('unknown {} names {}'.format(key, unknown_names))
+
+    return checked_spec
+
+def load_product_spec(spec_path):
+    '''
+    INPUT:
+          spec_path - str - json file with any of the keys of default_product_spec;
+                            keys left out are not produced
+    RETURN:
+          checked product spec dict
+    '''
+    with open(spec_path, 'r') as spec_file:
+        product_spec = json.load(spec_file)
+
+    return check_product_spec(product_spec)
+
+def plan_reads(product_spec):
+    '''
+    INPUT:
+          product_spec - dict - see default_product_spec
+    RETURN:
+          dict - the reads/decodes needed to produce the spec
+                 'MOD_02'           : {fieldname: [bands]} for radiance and
+                                      reflectance together, in spec order
+                 'radiance'         : bool - any radiance requested
+                 'reflectance'      : bool - any reflectance requested
+                 'MOD_03'           : [geometry names]
+                 'LandSeaMask'      : bool
+                 'cloud_mask'       : bool - decode Cloud_Mask byte 1
+                 'cloud_mask_tests' : bool - decode bytes 3-4 and read QA
+    '''
+    product_spec = check_product_spec(product_spec)
+
+    MOD_02 = {}
+    for band in product_spec['radiance'] + product_spec['reflectance']:
+        bands = MOD_02.setdefault(get_band_fieldname(band), [])
+        if str(band) not in bands:
+            bands.append(str(band))
+
+    return {'MOD_02'          : MOD_02,\
+            'radiance'        : len(product_spec['radiance']) > 0,\
+            'reflectance'     : len(product_spec['reflectance']) > 0,\
+            'MOD_03'          : list(product_spec['geometry']),\
+            'LandSeaMask'     : bool(product_spec['MOD03_LandSeaMask']),\
+            'cloud_mask'      : len(product_spec['cloud_mask']) > 0,\
+            'cloud_mask_tests': len(product_spec['cloud_mask_tests']) > 0}
@@ -1,15 +1,21 @@
 '''
 author: Javier Villegas
 
-plotting module to visualize modis 02 product
-as radiance or reflectance
+reader module for the modis 02 product
+as radiance or reflectance; plt_RGB is in rgb_enhancment so the readers
+never import matplotlib
 '''
 import numpy as np
 from pyhdf.SD import SD
 #import h5py
 #import pprint
-import matplotlib.pyplot as plt
-#plt.switch_backend('agg')
+
+#MODIS bands used by the MCM, by MOD021KM field
+#in order MAIA  bands 6,9,4,5,12,13
+#in order MODIS bands 1,2,3,4,6 ,26
+MCM_bands = {'EV_250_Aggr1km_RefSB': [1, 2],\
+             'EV_500_Aggr1km_RefSB': [3, 4, 6],\
+             'EV_1KM_RefSB'        : [26]}
 
 def get_earth_sun_dist(filename_MOD_02):
     file_ = SD(filename_MOD_02)
@@ -63,6 +69,85 @@ def get_scale_and_offset(data_field, rad_or_ref):
 
     return scale_factor, offset
 
+def get_band_index(data_field, bands):
+    '''
+    INPUT
+          data_field: get_data(filename, fieldname, SD_field_rawData=1)
+          bands:      list of int/str - MODIS band numbers, i.e. [3, 4, 6]
+    RETURN
+          list of int - index of each band along the first axis of the field,
+                        found from the field's band_names attribute
+    '''
+    band_names = data_field.attributes()['band_names'].split(',')
+
+    return [band_names.index(str(band)) for band in bands]
+
+def read_bands(data_field, band_idx):
+    '''
+    INPUT
+          data_field: get_data(filename, fieldname, SD_field_rawData=1)
+          band_idx:   list of int - index of the bands to read, see get_band_index
+    RETURN
+          numpy int array - raw counts of only the requested bands, shape=
+                            (len(band_idx), horizontal, vertical). Each band is
+                            read with a hyperslab so the other planes are never
+                            pulled from disk.
+    '''
+    dims     = data_field.info()[2]
+    data_raw = None
+    for i, idx in enumerate(band_idx):
+        band = data_field[idx]
+        if data_raw is None:
+            data_raw = np.empty((len(band_idx), dims[1], dims[2]), dtype=band.dtype)
+        data_raw[i] = band
+
+    return data_raw
+
+def calibrate_bands(data_raw, scale, offset, out=None):
+    '''
+    INPUT
+          data_raw: numpy int array   - raw counts, shape=(number of bands,
+                                        horizontal, vertical) or 2D for 1 band
+          scale:    numpy float array - scale factor for each band
+          offset:   numpy float array - offset for each band
+          out:      numpy float array - optional preallocated output
+    RETURN
+          numpy float32 array - (raw - offset) * scale for every band at once,
+                                same shape as data_raw
+    '''
+    scale  = np.asarray(scale , dtype=np.float32).reshape(-1, 1, 1)
+    offset = np.asarray(offset, dtype=np.float32).reshape(-1, 1, 1)
+    if np.ndim(data_raw) == 2:
+        scale, offset = scale[0], offset[0]
+    if out is None:
+        out = np.empty(np.shape(data_raw), dtype=np.float32)
+
+    #broadcast the per band scale/offset over the whole band in place
+    np.subtract(data_raw, offset, out=out)
+    np.multiply(out, scale, out=out)
+
+    return out
+
+def calibrate_bands_fill(data_raw, scale, offset, fill_val=-999, out=None):
+    '''
+    same as calibrate_bands, but saturated/invalid counts (>32767, see
+    make_MCM_input.MOD021KM_read) are set to fill_val instead of calibrated
+    '''
+    scale  = np.asarray(scale , dtype=np.float32).reshape(-1, 1, 1)
+    offset = np.asarray(offset, dtype=np.float32).reshape(-1, 1, 1)
+    if np.ndim(data_raw) == 2:
+        scale, offset = scale[0], offset[0]
+    if out is None:
+        out = np.empty(np.shape(data_raw), dtype=np.float32)
+
+    #start from fill values and only calibrate the valid counts
+    out.fill(fill_val)
+    valid = data_raw <= 32767
+    np.subtract(data_raw, offset, out=out, where=valid)
+    np.multiply(out, scale, out=out, where=valid)
+
+    return out
+
 def get_radiance_or_reflectance(data_raw, data_field, rad_or_ref, scale_factor=True):
     '''
     INPUT
@@ -71,89 +156,91 @@ def get_radiance_or_reflectance(data_raw, data_field, rad_or_ref, scale_factor=T
           rad_or_ref: boolean - True if radiance, False if reflectance
           scale_factor: boolean - return this as well if True
     RETURN
-          radiance: numpy float array - shape=(number of bands, horizontal, vertical)
-    '''
-    #get dimensions of raw data
-    num_bands = np.ma.size(data_raw, axis=0)
-    num_horizontal = np.ma.size(data_raw, axis=1)
-    num_vertical = np.ma.size(data_raw, axis=2)
-
-    #reshape raw data to perform scale and offset correction
-    data_raw_temp = np.reshape(data_raw,(num_bands, num_horizontal * num_vertical))
-    scale_factor, offset = get_scale_and_offset(data_field, rad_or_ref)
-
-    #correct raw data to get radiance/reflectance values
-    #correct first band manually
-    data_corrected_total = (data_raw_temp[0,:] - offset[0]) * scale_factor[0]
-    #for loop to put all the bands together
-    for i in range(1,num_bands):
-        #corrected band
-        data_corrected = (data_raw_temp[i,:] - offset[i]) * scale_factor[i]
-        #aggregate bands
-        data_corrected_total = np.concatenate((data_corrected_total, data_corrected), axis=0)
-
-    #get original shape and return radiance/reflectance
+          radiance: numpy float32 array - shape=(number of bands, horizontal, vertical)
+    '''
+    #correct raw data to get radiance/reflectance values for all bands at once
+    scale, offset  = get_scale_and_offset(data_field, rad_or_ref)
+    data_corrected = calibrate_bands(data_raw, scale, offset)
+
+    #return radiance/reflectance
     if not scale_factor:
-        return data_corrected_total.reshape((num_bands, num_horizontal, num_vertical))
+        return data_corrected
     else:
         scale_factor_rad, offset = get_scale_and_offset(data_field, True)
         scale_factor_ref, offset = get_scale_and_offset(data_field, False)
-        return data_corrected_total.reshape((num_bands, num_horizontal, num_vertical)),\
-               scale_factor_rad, scale_factor_ref
+        return data_corrected, scale_factor_rad, scale_factor_ref
 
-def prepare_data(filename, fieldname, rad_or_ref):
+def get_E_std_0(data_field):
     '''
     INPUT
-          filename:  string - hdf file filepath
-          fieldname: string - name of desired dataset
+          data_field: get_data(filename, fieldname, SD_field_rawData=1)
     RETURN
-          return radiance or reflectance at all bands
+          numpy float array - band weighted solar irradiance at 1 AU for every
+                              band of the field, pi * radiance scale /
+                              reflectance scale
     '''
-    data_raw, hdf_file1   = get_data(filename, fieldname, 2, True)
-    data_field, hdf_file2 = get_data(filename, fieldname, 1, True)
-    rad_ref, scale_factor_rad, scale_factor_ref = get_radiance_or_reflectance(data_raw, data_field, rad_or_ref)
+    scale_factor_rad, offset = get_scale_and_offset(data_field, True)
+    scale_factor_ref, offset = get_scale_and_offset(data_field, False)
 
-    hdf_file1.end()
-    hdf_file2.end()
+    return np.pi * np.array(scale_factor_rad) / np.array(scale_factor_ref)
 
-    return rad_ref, scale_factor_rad, scale_factor_ref
-
-def plt_RGB(filename, fieldnames_list, rad_or_ref, plot=True):
+def get_radiance_and_reflectance(data_raw, data_field, rad=True, ref=True):
     '''
     INPUT
-          filename:        - string     , filepath to file
-          fieldnames_list: - string list, contains 500m res and 250m reshape
-                                          such that bands 1,4,3 for RGB
-                                          i.e. 'EV_500_Aggr1km_RefSB'
+          data_raw:   get_data(filename, fieldname, SD_field_rawData=2)
+          data_field: get_data(filename, fieldname, SD_field_rawData=1)
+          rad:        boolean - calibrate to radiance if True
+          ref:        boolean - calibrate to reflectance if True
     RETURN
-          plots RGB picture of MODIS 02 product data
+          radiance, reflectance: numpy float arrays - shape=(number of bands,
+                                 horizontal, vertical); None if not requested.
+                                 Both come from the same raw counts so the
+                                 field is only read and decoded once.
     '''
+    radiance, reflectance = None, None
+    if rad:
+        radiance    = get_radiance_or_reflectance(data_raw, data_field, True, scale_factor=False)
+    if ref:
+        reflectance = get_radiance_or_reflectance(data_raw, data_field, False, scale_factor=False)
 
+    return radiance, reflectance
+
+def prepare_data_rad_ref(filename, fieldname, rad=True, ref=True):
+    '''
+    INPUT
+          filename:  string  - hdf file filepath
+          fieldname: string  - name of desired dataset
+          rad:       boolean - return radiance if True
+          ref:       boolean - return reflectance if True
+    RETURN
+          radiance, reflectance (None if not requested) and band weighted
+          solar irradiance at all bands, from one read of the raw counts
+    '''
+    data_field, hdf_file  = get_data(filename, fieldname, 1, True)
+    data_raw              = data_field.get()
+    radiance, reflectance = get_radiance_and_reflectance(data_raw, data_field, rad, ref)
+    E_std_0               = get_E_std_0(data_field)
 
-    #make channels for RGB photo (index 01234 -> band 34567)
-    image_blue  = prepare_data(filename, fieldnames_list[0],rad_or_ref)[0,:,:] #band 3 from 500 meter res
-    image_green = prepare_data(filename, fieldnames_list[0],rad_or_ref)[1,:,:] #band 4 from 500 meter res
-    image_red   = prepare_data(filename, fieldnames_list[1],rad_or_ref)[0,:,:] #band 1 from 250 meter res
+    hdf_file.end()
 
-    #force reflectance values to max out at 1.0/ normalize radiance
-    if not rad_or_ref:
-        np.place(image_red, image_red>1.0, 1.0) #2d image array, condition, value
-        np.place(image_blue, image_blue>1.0, 1.0)
-        np.place(image_green, image_green>1.0, 1.0)
-        image_RGB = np.dstack([image_red, image_green, image_blue])
+    return radiance, reflectance, E_std_0
 
-    else:
-        #use astropy to normalize radiance values to usable pixel brightness
-        from astropy.visualization import make_lupton_rgb
-        image_RGB = make_lupton_rgb(image_red, image_green, image_blue, stretch=0.5)
+def prepare_data(filename, fieldname, rad_or_ref):
+    '''
+    INPUT
+          filename:  string - hdf file filepath
+          fieldname: string - name of desired dataset
+    RETURN
+          return radiance or reflectance at all bands
+    '''
+    #open the file once and read the raw data from the same field
+    data_field, hdf_file = get_data(filename, fieldname, 1, True)
+    data_raw             = data_field.get()
+    rad_ref, scale_factor_rad, scale_factor_ref = get_radiance_or_reflectance(data_raw, data_field, rad_or_ref)
 
+    hdf_file.end()
 
-    #plot or return image
-    if plot:
-        plt.imshow(image_RGB)
-        plt.show()
-    else:
-        return image_RGB
+    return rad_ref, scale_factor_rad, scale_factor_ref
 
 if __name__ == '__main__':
     pass
@@ -161,6 +248,7 @@ if __name__ == '__main__':
     # filename   = '/u/sciteam/villegas/MAIA_Threshold_Development/test_data/MOD021KM.A2017118.1715.061.2017314055816.hdf'
     # fieldnames_list  = ['EV_500_Aggr1km_RefSB', 'EV_250_Aggr1km_RefSB']
     # rad_or_ref = True #True for radiance, False for reflectance
+    # from rgb_enhancment import plt_RGB
     # plt_RGB(filename, fieldnames_list, rad_or_ref)
     # print(get_data(filename, fieldnames_list[0], 2))
 
@@ -9,7 +9,8 @@ MOD03: geolocation data
 - Function to crop area out of modis file from lat lon
 '''
 
-from read_MODIS_02 import * #includes matplotlib and numpy
+import numpy as np
+from read_MODIS_02 import get_data
 
 fieldnames_list  = ['SolarZenith', 'SensorZenith', 'SolarAzimuth',\
                     'SensorAzimuth', 'Latitude', 'Longitude']
@@ -20,73 +21,39 @@ sensor_zenith = {}
 solar_azimuth = {}
 sensor_azimuth = {}
 
-def get_solarZenith(filename):
+def get_scaled_data(filename, fieldname, angle):
+    '''
+    INPUT
+          filename:  string     - MOD03 filepath
+          fieldname: string     - name of desired dataset
+          angle:     dictionary - one of the angle dictionaries above
+    RETURN
+          field corrected by its scale factor; the file is opened once to get
+          both the scale factor and the raw data
+    '''
     #obtain field information to grab scales/offsets
     SD_field_rawData = 1 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[0], SD_field_rawData, True)
-    solar_zenith['scale_factor']   = data.attributes()['scale_factor']
-
-    hdf_file.end()
+    data, hdf_file = get_data(filename, fieldname, SD_field_rawData, True)
+    angle['scale_factor'] = data.attributes()['scale_factor']
 
     #correct values by scales/offsets
-    SD_field_rawData = 2 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[0], SD_field_rawData, True)
-    solar_zenith['corrected_raw_data']   = data * solar_zenith['scale_factor']
-
-    hdf_file.end()
-
-    return solar_zenith['corrected_raw_data']
-
-def get_sensorZenith(filename):
-    #obtain field information to grab scales/offsets
-    SD_field_rawData = 1 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[1], SD_field_rawData, True)
-    sensor_zenith['scale_factor']  = data.attributes()['scale_factor']
+    angle['corrected_raw_data'] = data.get() * angle['scale_factor']
 
     hdf_file.end()
 
-    #correct values by scales/offsets
-    SD_field_rawData = 2 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[1], SD_field_rawData, True)
-    sensor_zenith['corrected_raw_data']  = data * sensor_zenith['scale_factor']
+    return angle['corrected_raw_data']
 
-    hdf_file.end()
+def get_solarZenith(filename):
+    return get_scaled_data(filename, fieldnames_list[0], solar_zenith)
 
-    return sensor_zenith['corrected_raw_data']
+def get_sensorZenith(filename):
+    return get_scaled_data(filename, fieldnames_list[1], sensor_zenith)
 
 def get_solarAzimuth(filename):
-    #obtain field information to grab scales/offsets
-    SD_field_rawData = 1 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[2], SD_field_rawData, True)
-    solar_azimuth['scale_factor']  = data.attributes()['scale_factor']
-
-    hdf_file.end()
-
-    #correct values by scales/offsets
-    SD_field_rawData = 2 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[2], SD_field_rawData, True)
-    solar_azimuth['corrected_raw_data']  = data * solar_azimuth['scale_factor']
-
-    hdf_file.end()
-
-    return solar_azimuth['corrected_raw_data']
+    return get_scaled_data(filename, fieldnames_list[2], solar_azimuth)
 
 def get_sensorAzimuth(filename):
-    #obtain field information to grab scales/offsets
-    SD_field_rawData = 1 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[3], SD_field_rawData, True)
-    sensor_azimuth['scale_factor'] = data.attributes()['scale_factor']
-
-    hdf_file.end()
-
-    #correct values by scales/offsets
-    SD_field_rawData = 2 #0 SD, 1 field & 2 returns raw data
-    data, hdf_file = get_data(filename, fieldnames_list[3], SD_field_rawData, True)
-    sensor_azimuth['corrected_raw_data'] = data * sensor_azimuth['scale_factor']
-
-    hdf_file.end()
-
-    return sensor_azimuth['corrected_raw_data']
+    return get_scaled_data(filename, fieldnames_list[3], sensor_azimuth)
 
 def get_relativeAzimuth(filename):
     relative_azimuth = get_sensorAzimuth(filename) - get_solarAzimuth(filename)
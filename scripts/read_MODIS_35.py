@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 from pyhdf.SD import SD
 from read_MODIS_02 import get_data
 import h5py
@@ -87,6 +86,91 @@ def get_bits(data_SD, N, cMask_or_QualityAssur=True):
 
     return data_bits
 
+def get_byte(data_SD, N, cMask_or_QualityAssur=True):
+    '''
+    INPUT:
+          data_SD               - 3D numpy array  - cloud mask SD from HDF
+          N                     - int             - byte to work on
+          cMask_or_QualityAssur - boolean         - True for mask, False for QA
+    RETURNS:
+          numpy uint8 array of the Nth byte, shape 2030x1354
+    '''
+    #MOD35 stores the bytes as signed ints; reinterpret them as unsigned
+    if cMask_or_QualityAssur:
+        return np.asarray(data_SD[N, :, :]).astype(np.uint8)
+
+    return np.asarray(data_SD[:, :, N]).astype(np.uint8)
+
+def decode_byte_1_shift(data_SD):
+    '''
+    INPUT:
+          data_SD - numpy array (6, 2030, 1354) - SD from HDF of cloud mask
+    RETURN:
+          same 6 fields as decode_byte_1(get_bits(data_SD, 0)), extracted with
+          shifts and masks straight into uint8 arrays (2030, 1354)
+          Cloud_Mask_Flag,
+          Unobstructed_FOV_Quality_Flag,
+          Day_Night_Flag,
+          Sun_glint_Flag,
+          Snow_Ice_Background_Flag,
+          Land_Water_Flag
+    '''
+    byte_1 = get_byte(data_SD, 0)
+
+    Cloud_Mask_Flag               =  byte_1       & 1
+    #cloudy, uncertain clear, probably clear, confident clear
+    Unobstructed_FOV_Quality_Flag = (byte_1 >> 1) & 3
+    Day_Night_Flag                = (byte_1 >> 3) & 1
+    Sun_glint_Flag                = (byte_1 >> 4) & 1
+    Snow_Ice_Background_Flag      = (byte_1 >> 5) & 1
+    #water, coastal, desert, land
+    Land_Water_Flag               = (byte_1 >> 6) & 3
+
+    return Cloud_Mask_Flag,\
+           Unobstructed_FOV_Quality_Flag,\
+           Day_Night_Flag,\
+           Sun_glint_Flag,\
+           Snow_Ice_Background_Flag,\
+           Land_Water_Flag
+
+def decode_tests_shift(data_SD, data_SD_Quality_Assurance):
+    '''
+    INPUT:
+          data_SD                   - numpy array (6,2030,1354)  - SD from HDF
+                                                                   of cloud mask
+          data_SD_Quality_Assurance - numpy array (2030,1354,10) - HDF SD of QA
+    RETURN:
+          same 5 cloud mask tests as decode_tests, as uint8 arrays (2030, 1354)
+          with 9 where the QA says the test was not applied; bytes 3 & 4 of
+          the mask and of the QA are decoded with shifts and masks
+          High_Cloud_Flag_1380nm,
+          Cloud_Flag_Visible_Reflectance,
+          Cloud_Flag_Visible_Ratio,
+          Near_IR_Reflectance,
+          Cloud_Flag_Spatial_Variability
+    '''
+    byte_3    = get_byte(data_SD, 2)
+    byte_4    = get_byte(data_SD, 3)
+    QA_byte_3 = get_byte(data_SD_Quality_Assurance, 2, cMask_or_QualityAssur=False)
+    QA_byte_4 = get_byte(data_SD_Quality_Assurance, 3, cMask_or_QualityAssur=False)
+
+    #(cloud mask byte, QA byte, bit) of each test; the QA bit that says
+    #whether the test was applied is at the same position
+    test_bits = [(byte_3, QA_byte_3, 7),\
+                 (byte_3, QA_byte_3, 3),\
+                 (byte_3, QA_byte_3, 2),\
+                 (byte_3, QA_byte_3, 1),\
+                 (byte_4, QA_byte_4, 6)]
+
+    tests = []
+    for byte, QA_byte, bit in test_bits:
+        test = (byte >> bit) & 1
+        # find indicies where test is not applied; set to 9
+        test[((QA_byte >> bit) & 1) == 0] = 9
+        tests.append(test)
+
+    return tuple(tests)
+
 def save_mod35(data, save_path):
     hf = h5py.File(save_path, 'w')
     hf.create_dataset('MOD_35_decoded', data=data)
@@ -195,12 +279,15 @@ def decode_Quality_Assurance(data_SD_Quality_Assurance):
            QA_Near_IR_Reflectance,\
            QA_Cloud_Flag_Spatial_Variability
 
-def decode_tests(data_SD, filename_MOD_35):
+def decode_tests(data_SD, filename_MOD_35, data_SD_Quality_Assurance=None):
     '''
     INPUT:
           data_SD         - numpy array (6,2030,1354) - SD from HDF of cloud
                                                         mask
           filename_MOD_35 - str                       - path to mod 35 file
+          data_SD_Quality_Assurance - numpy array (2030,1354,10) - QA already
+                                      read, i.e. from Granule; if None it is
+                                      read from filename_MOD_35
     RETURN:
           5 cloud mask tests that are quality assured - numpy arrays
                                                         (2030, 1354)
@@ -214,7 +301,8 @@ def decode_tests(data_SD, filename_MOD_35):
     data_bits_3_ = get_bits(data_SD, 2)
     data_bits_4_ = get_bits(data_SD, 3)
 
-    data_SD_Quality_Assurance = get_data(filename_MOD_35, 'Quality_Assurance',2)
+    if data_SD_Quality_Assurance is None:
+        data_SD_Quality_Assurance = get_data(filename_MOD_35, 'Quality_Assurance',2)
     #for bytes 3&4
     data_bits_QA = decode_Quality_Assurance(data_SD_Quality_Assurance)
 
@@ -256,6 +344,7 @@ if __name__ == '__main__':
 
     #############################################
     #plot
+    import matplotlib.pyplot as plt
     import matplotlib.colors as matCol
     from matplotlib.colors import ListedColormap
     cmap=plt.cm.PiYG
@@ -0,0 +1,334 @@
+'''
+author: Javier Villegas
+
+reader object for one MODIS granule (MOD021KM, MOD03 & MOD35_L2 triplet).
+Each hdf file is opened once; the SD handles, field handles and attributes
+(scales, offsets, Earth-Sun distance) are cached so every field that
+build_data_base needs is served without reopening the file.
+
+HDF4 is not thread safe, so a granule is read on one thread only. load()
+reads everything a read plan needs into memory and closes the files; the
+loaded granule can then be handed to another thread, which only touches
+the in memory copies.
+'''
+import numpy as np
+from pyhdf.SD import SD
+from product_spec import geometry_fieldnames
+from read_MODIS_02 import get_radiance_or_reflectance, calibrate_bands,\
+                          calibrate_bands_fill, read_bands
+
+class Granule(object):
+    '''
+    INPUT
+          filename_MOD_02: string - MOD021KM filepath
+          filename_MOD_03: string - MOD03 filepath
+          filename_MOD_35: string - MOD35_L2 filepath
+    any of the three may be None if that product is not needed. Use as a
+    context manager or call close() to release the hdf files.
+    '''
+
+    def __init__(self, filename_MOD_02=None, filename_MOD_03=None,\
+                 filename_MOD_35=None):
+        self.filenames = {'MOD_02': filename_MOD_02,\
+                          'MOD_03': filename_MOD_03,\
+                          'MOD_35': filename_MOD_35}
+        #open SD per product, field handles and attributes per (product, field)
+        self._hdf_files  = {}
+        self._fields     = {}
+        self._attributes = {}
+        #in memory fields of a loaded granule, per (product, field) and
+        #per (field, bands) for MOD02 band planes
+        self._data       = {}
+        self._bands      = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        end access to every field and close every hdf file opened
+        '''
+        for field in self._fields.values():
+            field.endaccess()
+        for hdf_file in self._hdf_files.values():
+            hdf_file.end()
+        self._fields     = {}
+        self._hdf_files  = {}
+
+    def load(self, read_plan):
+        '''
+        INPUT
+              read_plan: dict - from product_spec.plan_reads
+        RETURN
+              self, with every field and attribute build_data_base reads for
+              read_plan in memory and the hdf files closed
+        '''
+        for fieldname in ('Latitude', 'Longitude'):
+            self._data['MOD_03', fieldname] = self.get_raw_data('MOD_03', fieldname)
+
+        for fieldname, bands in read_plan['MOD_02'].items():
+            self._bands[fieldname, tuple(bands)] = self.get_raw_bands(fieldname, bands)
+            self.get_attributes('MOD_02', fieldname)
+        if read_plan['MOD_02']:
+            self.get_earth_sun_dist()
+
+        MOD_03_fields = [geometry_fieldnames[sun_key] for sun_key in read_plan['MOD_03']]
+        if read_plan['LandSeaMask']:
+            MOD_03_fields.append('Land/SeaMask')
+        for fieldname in MOD_03_fields:
+            self._data['MOD_03', fieldname] = self.get_raw_data('MOD_03', fieldname)
+            self.get_attributes('MOD_03', fieldname)
+
+        MOD_35_fields = []
+        if read_plan['cloud_mask'] or read_plan['cloud_mask_tests']:
+            MOD_35_fields.append('Cloud_Mask')
+        if read_plan['cloud_mask_tests']:
+            MOD_35_fields.append('Quality_Assurance')
+        for fieldname in MOD_35_fields:
+            self._data['MOD_35', fieldname] = self.get_raw_data('MOD_35', fieldname)
+
+        self.close()
+
+        return self
+
+    def get_SD(self, product):
+        '''
+        INPUT
+              product: string - 'MOD_02', 'MOD_03' or 'MOD_35'
+        RETURN
+              pyhdf SD of the product; opened on first use only
+        '''
+        if product not in self._hdf_files:
+            filename = self.filenames[product]
+            if filename is None:
+                raise ValueError('no {} file given for this granule'.format(product))
+            self._hdf_files[product] = SD(filename)
+
+        return self._hdf_files[product]
+
+    def get_field(self, product, fieldname):
+        '''
+        RETURN
+              pyhdf SDS of fieldname, selected on first use only
+        '''
+        key = (product, fieldname)
+        if key not in self._fields:
+            self._fields[key] = self.get_SD(product).select(fieldname)
+
+        return self._fields[key]
+
+    def get_attributes(self, product, fieldname):
+        '''
+        RETURN
+              dictionary of the field attributes, read on first use only
+        '''
+        key = (product, fieldname)
+        if key not in self._attributes:
+            self._attributes[key] = self.get_field(product, fieldname).attributes()
+
+        return self._attributes[key]
+
+    def get_raw_data(self, product, fieldname):
+        '''
+        RETURN
+              numpy array of the raw (unscaled) field
+        '''
+        key = (product, fieldname)
+        if key in self._data:
+            return self._data[key]
+
+        return self.get_field(product, fieldname).get()
+
+    #MOD02**********************************************************************
+    def get_band_index(self, fieldname, bands):
+        '''
+        INPUT
+              fieldname: string          - name of MOD02 dataset
+              bands:     list of int/str - MODIS band numbers, i.e. [3, 4, 6]
+        RETURN
+              list of int - index of each band along the first axis of the field
+        '''
+        band_names = self.get_attributes('MOD_02', fieldname)['band_names'].split(',')
+
+        return [band_names.index(str(band)) for band in bands]
+
+    def get_raw_bands(self, fieldname, bands=None):
+        '''
+        RETURN
+              raw counts of fieldname; only the planes of the requested MODIS
+              bands are read from disk if bands is not None
+        '''
+        if bands is None:
+            return self.get_raw_data('MOD_02', fieldname)
+        key = (fieldname, tuple(bands))
+        if key in self._bands:
+            return self._bands[key]
+
+        return read_bands(self.get_field('MOD_02', fieldname),\
+                          self.get_band_index(fieldname, bands))
+
+    def get_earth_sun_dist(self):
+        key = ('MOD_02', None)
+        if key not in self._attributes:
+            self._attributes[key] = self.get_SD('MOD_02').attributes()
+
+        return self._attributes[key]['Earth-Sun Distance']
+
+    def get_scale_and_offset(self, fieldname, rad_or_ref, bands=None):
+        '''
+        INPUT
+              fieldname:  string  - name of MOD02 dataset
+              rad_or_ref: boolean - True for radiance, False for reflectance
+              bands:      list    - MODIS band numbers; all bands if None
+        RETURN
+              2 numpy float arrays, scale factor & offset of size=number of bands
+        '''
+        attributes = self.get_attributes('MOD_02', fieldname)
+        if rad_or_ref:
+            scale  = np.array(attributes['radiance_scales'])
+            offset = np.array(attributes['radiance_offsets'])
+        else:
+            scale  = np.array(attributes['reflectance_scales'])
+            offset = np.array(attributes['reflectance_offsets'])
+
+        if bands is not None:
+            band_idx = self.get_band_index(fieldname, bands)
+            return scale[band_idx], offset[band_idx]
+
+        return scale, offset
+
+    def prepare_data(self, fieldname, rad_or_ref):
+        '''
+        same return as read_MODIS_02.prepare_data without reopening the file
+        RETURN
+              radiance or reflectance at all bands, radiance scales,
+              reflectance scales
+        '''
+        data_raw   = self.get_raw_data('MOD_02', fieldname)
+        data_field = self.get_field('MOD_02', fieldname)
+
+        return get_radiance_or_reflectance(data_raw, data_field, rad_or_ref)
+
+    def get_E_std_0(self, fieldname, bands=None):
+        '''
+        RETURN
+              band weighted solar irradiance at 1 AU for every band of fieldname
+              or only for the requested MODIS bands
+        '''
+        scale_factor_rad, offset = self.get_scale_and_offset(fieldname, True , bands)
+        scale_factor_ref, offset = self.get_scale_and_offset(fieldname, False, bands)
+
+        return np.pi * scale_factor_rad / scale_factor_ref
+
+    def get_radiance_and_reflectance(self, fieldname, bands=None, rad=True,\
+                                     ref=True, fill_invalid=False,\
+                                     regrid_idx=None):
+        '''
+        INPUT
+              fieldname:    string  - name of MOD02 dataset
+              bands:        list    - MODIS band numbers to read & calibrate,
+                                      i.e. read_MODIS_02.MCM_bands[fieldname];
+                                      all bands if None
+              rad:          boolean - calibrate to radiance if True
+              ref:          boolean - calibrate to reflectance if True
+              fill_invalid: boolean - set saturated/invalid counts to -999
+              regrid_idx:   tuple   - (row, col) swath indices of each target
+                                      pixel; if given the raw counts are
+                                      gathered at these indices before they
+                                      are calibrated
+        RETURN
+              radiance, reflectance (float32, None if not requested) and band
+              weighted solar irradiance, all from one read of the raw counts.
+              The first axis follows the order of bands.
+        '''
+        data_raw = self.get_raw_bands(fieldname, bands)
+        if regrid_idx is not None:
+            #only pay the float conversion for the pixels on the target grid
+            data_raw = data_raw[..., regrid_idx[0], regrid_idx[1]]
+        if fill_invalid:
+            calibrate = calibrate_bands_fill
+        else:
+            calibrate = calibrate_bands
+
+        radiance, reflectance = None, None
+        if rad:
+            radiance    = calibrate(data_raw, *self.get_scale_and_offset(fieldname, True , bands))
+        if ref:
+            reflectance = calibrate(data_raw, *self.get_scale_and_offset(fieldname, False, bands))
+
+        return radiance, reflectance, self.get_E_std_0(fieldname, bands)
+
+    #MOD03**********************************************************************
+    def get_scaled_data(self, fieldname, regrid_idx=None):
+        '''
+        INPUT
+              fieldname:  string - name of MOD03 dataset
+              regrid_idx: tuple  - (row, col) swath indices of each target pixel;
+                                   if given the scaled ints are gathered at
+                                   these indices before the scale is applied
+        RETURN
+              MOD03 field corrected by its scale factor
+        '''
+        scale_factor = self.get_attributes('MOD_03', fieldname)['scale_factor']
+
+        return self.get_gathered_data('MOD_03', fieldname, regrid_idx) * scale_factor
+
+    def get_gathered_data(self, product, fieldname, regrid_idx=None):
+        '''
+        RETURN
+              raw (unscaled) 2D field, gathered at regrid_idx if given
+        '''
+        data_raw = self.get_raw_data(product, fieldname)
+        if regrid_idx is not None:
+            return data_raw[regrid_idx[0], regrid_idx[1]]
+
+        return data_raw
+
+    def get_solarZenith(self, regrid_idx=None):
+        return self.get_scaled_data('SolarZenith', regrid_idx)
+
+    def get_sensorZenith(self, regrid_idx=None):
+        return self.get_scaled_data('SensorZenith', regrid_idx)
+
+    def get_solarAzimuth(self, regrid_idx=None):
+        return self.get_scaled_data('SolarAzimuth', regrid_idx)
+
+    def get_sensorAzimuth(self, regrid_idx=None):
+        return self.get_scaled_data('SensorAzimuth', regrid_idx)
+
+    def get_lat(self):
+        return self.get_raw_data('MOD_03', 'Latitude')
+
+    def get_lon(self):
+        return self.get_raw_data('MOD_03', 'Longitude')
+
+    def get_LandSeaMask(self, regrid_idx=None):
+        return self.get_gathered_data('MOD_03', 'Land/SeaMask', regrid_idx)
+
+    #MOD35**********************************************************************
+    def get_cloud_mask(self, regrid_idx=None):
+        '''
+        RETURN
+              Cloud_Mask bytes, shape (6, horizontal, vertical); gathered at
+              regrid_idx before decoding if given
+        '''
+        cloud_mask = self.get_raw_data('MOD_35', 'Cloud_Mask')
+        if regrid_idx is not None:
+            return cloud_mask[:, regrid_idx[0], regrid_idx[1]]
+
+        return cloud_mask
+
+    def get_quality_assurance(self, regrid_idx=None):
+        '''
+        RETURN
+              Quality_Assurance bytes, shape (horizontal, vertical, 10);
+              gathered at regrid_idx before decoding if given
+        '''
+        quality_assurance = self.get_raw_data('MOD_35', 'Quality_Assurance')
+        if regrid_idx is not None:
+            return quality_assurance[regrid_idx[0], regrid_idx[1], :]
+
+        return quality_assurance
@@ -1,7 +1,7 @@
 from read_MODIS_02 import get_data, get_radiance_or_reflectance, prepare_data
 from read_MODIS_03 import get_lat, get_lon
 from read_MODIS_35 import *
-import pytaf#from PTA_Subset import crop_PTA
+#from PTA_Subset import crop_PTA
 #from multicore_processing import multi_core_crop
 import h5py
 import sys
@@ -10,6 +10,165 @@ import time
 from pyhdf.SD import SD
 
 
+#radius of the MODIS geolocation sphere in meters
+earth_radius = 6371007.181
+
+def get_unit_vectors(lat, lon):
+    '''
+    Objective:
+        convert lat/lon in degrees to unit vectors on the sphere so euclidean
+        distance (chord) is monotonic with great circle distance
+    Arguments:
+        lat, lon {narrays} -- any shape, degrees
+    Returns:
+        {2D narray} -- shape (lat.size, 3), x/y/z of each point
+    '''
+    lat = np.deg2rad(np.ravel(lat).astype(np.float64))
+    lon = np.deg2rad(np.ravel(lon).astype(np.float64))
+    cos_lat = np.cos(lat)
+
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+def get_chord_radius(max_radius):
+    '''
+    Arguments:
+        max_radius {float} -- great circle distance in meters
+    Returns:
+        {float} -- same distance as a chord between unit vectors
+    '''
+    return 2. * np.sin(max_radius / (2. * earth_radius))
+
+def get_valid_geolocation(lat, lon):
+    '''
+    Returns:
+        {1D bool narray} -- True where lat/lon are not fill values
+    '''
+    lat, lon = np.ravel(lat), np.ravel(lon)
+    return (np.abs(lat) <= 90.) & (np.abs(lon) <= 180.)
+
+def get_regrid_idx(source_lat, source_lon, target_lat, target_lon,\
+                   max_radius=5556., workers=-1):
+    '''
+    Objective:
+        nearest neighbor of each target pixel in the source swath, found with
+        one KD-tree over the swath instead of one pytaf search per regridded
+        field.
+    Arguments:
+        source_lat, source_lon {2D narrays} -- lat/lon of data to be regridded
+        target_lat, target_lon {2D narrays} -- lat/lon of refrence grid
+        max_radius {float} -- radius in meters to search around pixel for a
+                              neighbor
+        workers {int} -- threads used for the tree queries; -1 uses all cores
+    Returns:
+        regrid_row_idx, regrid_col_idx {2D int narrays} -- source row/col of
+            each target pixel; -999 where there is no neighbor
+        fill_mask {2D bool narray} -- True where there is no neighbor
+    '''
+    from scipy.spatial import cKDTree
+
+    source_shape = np.shape(source_lat)
+    valid_source = np.flatnonzero(get_valid_geolocation(source_lat, source_lon))
+    source_xyz   = get_unit_vectors(source_lat, source_lon)[valid_source]
+
+    source_tree = cKDTree(source_xyz)
+    distance, idx = source_tree.query(get_unit_vectors(target_lat, target_lon),\
+                                      distance_upper_bound=get_chord_radius(max_radius),\
+                                      workers=workers)
+
+    return get_row_col(distance, idx, valid_source, source_shape, np.shape(target_lat))
+
+def get_row_col(distance, idx, valid_source, source_shape, target_shape):
+    '''
+    Objective:
+        turn KD-tree query results into source row/col indices on the target
+        grid with -999 fill where no neighbor was within the search radius
+    Arguments:
+        distance, idx {1D narrays} -- cKDTree.query return for every target pixel
+        valid_source {1D int narray} -- flat source index of each tree point
+        source_shape, target_shape {tuples} -- 2D shapes of the two grids
+    Returns:
+        regrid_row_idx, regrid_col_idx, fill_mask -- see get_regrid_idx
+    '''
+    fill_val  = -999
+    fill_mask = ~np.isfinite(distance)
+
+    flat_idx  = np.full(idx.shape, fill_val, dtype=np.int64)
+    flat_idx[~fill_mask] = valid_source[idx[~fill_mask]]
+
+    regrid_row_idx = np.full(idx.shape, fill_val, dtype=np.int64)
+    regrid_col_idx = np.full(idx.shape, fill_val, dtype=np.int64)
+    regrid_row_idx[~fill_mask], regrid_col_idx[~fill_mask] = \
+                    np.unravel_index(flat_idx[~fill_mask], source_shape)
+
+    return regrid_row_idx.reshape(target_shape),\
+           regrid_col_idx.reshape(target_shape),\
+           fill_mask.reshape(target_shape)
+
+class TargetGrid(object):
+    '''
+    Objective:
+        KD-tree over the fixed MAIA target grid, built once and reused for
+        every granule. For each granule the tree first keeps only the swath
+        pixels within max_radius of the grid (most of a swath falls outside
+        the PTA), then the nearest neighbor of each target pixel is searched
+        among those pixels only. The result is the same as get_regrid_idx.
+    Arguments:
+        target_lat, target_lon {2D narrays} -- lat/lon of refrence grid
+        max_radius {float} -- radius in meters to search around pixel for a
+                              neighbor
+    '''
+
+    def __init__(self, target_lat, target_lon, max_radius=5556.):
+        from scipy.spatial import cKDTree
+
+        self.shape        = np.shape(target_lat)
+        self.chord_radius = get_chord_radius(max_radius)
+        self.target_xyz   = get_unit_vectors(target_lat, target_lon)
+        self.target_tree  = cKDTree(self.target_xyz)
+
+        #bounding box of the grid padded by the search radius; cheap first cut
+        self.xyz_min = self.target_xyz.min(axis=0) - self.chord_radius
+        self.xyz_max = self.target_xyz.max(axis=0) + self.chord_radius
+
+    def get_regrid_idx(self, source_lat, source_lon, workers=-1):
+        '''
+        Arguments:
+            source_lat, source_lon {2D narrays} -- lat/lon of data to be regridded
+            workers {int} -- threads used for the tree queries; -1 uses all cores
+        Returns:
+            regrid_row_idx, regrid_col_idx, fill_mask -- see get_regrid_idx
+        '''
+        from scipy.spatial import cKDTree
+
+        source_shape = np.shape(source_lat)
+        valid_source = np.flatnonzero(get_valid_geolocation(source_lat, source_lon))
+        source_xyz   = get_unit_vectors(source_lat, source_lon)[valid_source]
+
+        #keep swath pixels inside the padded bounding box of the grid
+        in_box = np.all((source_xyz >= self.xyz_min) & (source_xyz <= self.xyz_max), axis=1)
+        valid_source, source_xyz = valid_source[in_box], source_xyz[in_box]
+
+        #keep swath pixels within the search radius of any grid pixel; only
+        #these can be the nearest neighbor of a grid pixel
+        if valid_source.size > 0:
+            distance, idx = self.target_tree.query(source_xyz,\
+                                    distance_upper_bound=self.chord_radius,\
+                                    workers=workers)
+            near = np.isfinite(distance)
+            valid_source, source_xyz = valid_source[near], source_xyz[near]
+
+        if valid_source.size == 0:
+            distance = np.full(self.target_xyz.shape[0], np.inf)
+            idx      = np.zeros(self.target_xyz.shape[0], dtype=np.int64)
+            return get_row_col(distance, idx, valid_source, source_shape, self.shape)
+
+        source_tree = cKDTree(source_xyz)
+        distance, idx = source_tree.query(self.target_xyz,\
+                                          distance_upper_bound=self.chord_radius,\
+                                          workers=workers)
+
+        return get_row_col(distance, idx, valid_source, source_shape, self.shape)
+
 def regrid_MODIS_2_MAIA(source_lat, source_lon, target_lat, target_lon, source_data):
     '''
     Objective:
@@ -23,6 +182,8 @@ def regrid_MODIS_2_MAIA(source_lat, source_lon, target_lat, target_lon, source_d
         target_data {2D narray} -- returns regridded source data, such that it
                                    matches up with the target lat/lon
     '''
+    import pytaf
+
     #radius in meters to search around pixel for a neighbor
     max_radius = 5556.
     target_data = pytaf.resample_n(source_lat, source_lon, target_lat,\
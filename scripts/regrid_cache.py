@@ -0,0 +1,193 @@
+'''
+author: Javier Villegas
+
+On disk cache of MODIS -> MAIA regrid indices. Terra repeats its ground
+track every 16 days, so granules over the PTA that share a time of day have
+nearly the same swath geometry. The nearest neighbor indices of one pass are
+saved under a fingerprint of the quantized MOD03 corner and centre lat/lon
+and reused by later passes, after checking that the swath has its fill
+geolocation at the same pixels and that the swath geolocation at the cached
+indices moved less than a tolerance. The tolerance is a small fraction of
+the 1 km pixel spacing, so a target pixel only keeps a cached neighbor that
+is still its nearest one, short of near ties.
+'''
+import numpy as np
+import hashlib
+import os
+import tempfile
+from regrid import get_regrid_idx, get_unit_vectors, earth_radius,\
+                   get_valid_geolocation
+
+def get_corners_and_centre(lat, lon):
+    '''
+    Arguments:
+        lat, lon {2D narrays} -- swath or grid geolocation
+    Returns:
+        {1D narray} -- lat/lon of the 4 corners and the centre pixel
+    '''
+    nx, ny = np.shape(lat)
+    rows = [0, 0, nx-1, nx-1, nx//2]
+    cols = [0, ny-1, 0, ny-1, ny//2]
+
+    return np.concatenate((lat[rows, cols], lon[rows, cols])).astype(np.float64)
+
+def get_great_circle_distance(lat_1, lon_1, lat_2, lon_2):
+    '''
+    Returns:
+        {narray} -- distance in meters between the two sets of points
+    '''
+    chord = np.linalg.norm(get_unit_vectors(lat_1, lon_1) - \
+                           get_unit_vectors(lat_2, lon_2), axis=1)
+
+    return 2. * earth_radius * np.arcsin(np.clip(chord / 2., 0., 1.))
+
+class RegridCache(object):
+    '''
+    Objective:
+        persistent cache of (regrid_row_idx, regrid_col_idx, fill_mask)
+    Arguments:
+        cache_dir {str} -- directory to keep one .npz file per fingerprint
+        quantization {float} -- degrees the corner/centre lat/lon are rounded
+                                to when making the fingerprint
+        tolerance {float} -- max distance in meters the swath geolocation at
+                             the cached indices may move for a hit to be used;
+                             well below half the 1 km pixel spacing
+    '''
+
+    def __init__(self, cache_dir, quantization=0.05, tolerance=50.):
+        self.cache_dir    = cache_dir
+        self.quantization = quantization
+        self.tolerance    = tolerance
+        self.hits         = 0
+        self.misses       = 0
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_fingerprint(self, source_lat, source_lon, target_lat, target_lon):
+        '''
+        Returns:
+            {str} -- hex key of the quantized swath corners/centre, the swath
+                     shape and the target grid it was regridded to
+        '''
+        source_key = np.round(get_corners_and_centre(source_lat, source_lon)\
+                              / self.quantization).astype(np.int64)
+        target_key = np.round(get_corners_and_centre(target_lat, target_lon)\
+                              , 4)
+        shapes     = np.array(np.shape(source_lat) + np.shape(target_lat), dtype=np.int64)
+
+        fingerprint = hashlib.sha1()
+        for key in (source_key, target_key, shapes):
+            fingerprint.update(np.ascontiguousarray(key).tobytes())
+
+        return fingerprint.hexdigest()
+
+    def get_cache_path(self, fingerprint):
+        return os.path.join(self.cache_dir, 'regrid_idx_{}.npz'.format(fingerprint))
+
+    def load(self, fingerprint):
+        '''
+        Returns:
+            {dict} -- cached arrays, or None if there is no (readable) entry
+        '''
+        cache_path = self.get_cache_path(fingerprint)
+        if not os.path.isfile(cache_path):
+            return None
+        try:
+            with np.load(cache_path) as cached:
+                return {key: cached[key] for key in cached.files}
+        except (IOError, ValueError, KeyError):
+            return None
+
+    def save(self, fingerprint, regrid_row_idx, regrid_col_idx, fill_mask,\
+             source_lat, source_lon):
+        '''
+        save the indices with the swath lat/lon found at them; written to a
+        temporary file first so other ranks never read a partial entry
+        '''
+        valid = ~fill_mask
+        row, col = regrid_row_idx[valid], regrid_col_idx[valid]
+
+        cache_path = self.get_cache_path(fingerprint)
+        #unique name in the cache directory; ranks on different nodes can
+        #have the same pid and write the same entry at the same time
+        temp_file, temp_path = tempfile.mkstemp(suffix='.tmp.npz',\
+                                   prefix=os.path.basename(cache_path)[:-4] + '.',\
+                                   dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(temp_file, 'wb') as temp:
+                np.savez(temp,\
+                         regrid_row_idx=regrid_row_idx.astype(np.int16),\
+                         regrid_col_idx=regrid_col_idx.astype(np.int16),\
+                         fill_mask=fill_mask,\
+                         valid_source=np.packbits(get_valid_geolocation(\
+                                                  source_lat, source_lon)),\
+                         matched_lat=source_lat[row, col].astype(np.float32),\
+                         matched_lon=source_lon[row, col].astype(np.float32))
+            os.replace(temp_path, cache_path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def is_valid(self, cached, source_lat, source_lon):
+        '''
+        Returns:
+            {bool} -- True if the swath has fill geolocation at the same
+                      pixels as when cached (the fill_mask depends on it) and
+                      the swath lat/lon at the cached indices are all within
+                      tolerance of where they were when cached
+        '''
+        #entries cached before the swath fill was saved are searched again
+        if 'valid_source' not in cached or not np.array_equal(cached['valid_source'],\
+           np.packbits(get_valid_geolocation(source_lat, source_lon))):
+            return False
+
+        shape = np.shape(source_lat)
+        valid = ~cached['fill_mask']
+        row   = cached['regrid_row_idx'][valid].astype(np.int64)
+        col   = cached['regrid_col_idx'][valid].astype(np.int64)
+        if row.size == 0:
+            return True
+        if row.max() >= shape[0] or col.max() >= shape[1]:
+            return False
+
+        lat, lon = source_lat[row, col], source_lon[row, col]
+        if np.any(np.abs(lat) > 90.) or np.any(np.abs(lon) > 180.):
+            return False
+
+        error = get_great_circle_distance(lat, lon, cached['matched_lat'],\
+                                          cached['matched_lon'])
+
+        return error.max() < self.tolerance
+
+    def get_regrid_idx(self, source_lat, source_lon, target_lat, target_lon,\
+                       target_grid=None):
+        '''
+        Objective:
+            cached version of regrid.get_regrid_idx; falls back to a full
+            search (over target_grid if given) on a miss and caches the result
+        Returns:
+            regrid_row_idx, regrid_col_idx, fill_mask -- see regrid.get_regrid_idx
+        '''
+        fingerprint = self.get_fingerprint(source_lat, source_lon, target_lat, target_lon)
+        cached      = self.load(fingerprint)
+
+        if cached is not None and self.is_valid(cached, source_lat, source_lon):
+            self.hits += 1
+            fill_mask      = cached['fill_mask']
+            regrid_row_idx = cached['regrid_row_idx'].astype(np.int64)
+            regrid_col_idx = cached['regrid_col_idx'].astype(np.int64)
+            return regrid_row_idx, regrid_col_idx, fill_mask
+
+        self.misses += 1
+        if target_grid is None:
+            regrid_row_idx, regrid_col_idx, fill_mask = \
+                    get_regrid_idx(source_lat, source_lon, target_lat, target_lon)
+        else:
+            regrid_row_idx, regrid_col_idx, fill_mask = \
+                    target_grid.get_regrid_idx(source_lat, source_lon)
+
+        self.save(fingerprint, regrid_row_idx, regrid_col_idx, fill_mask,\
+                  source_lat, source_lon)
+
+        return regrid_row_idx, regrid_col_idx, fill_mask
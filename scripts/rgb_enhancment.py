@@ -1,5 +1,7 @@
-import scipy.misc
-import matplotlib.pyplot as plt
+'''
+RGB images of MODIS granules for plotting. matplotlib is only imported
+when a plot is drawn, so the readers and MPI jobs never load it.
+'''
 import numpy as np
 from read_MODIS_03 import get_solarZenith
 from read_MODIS_02 import prepare_data
@@ -124,6 +126,44 @@ def get_BRF_RGB(filename_MOD_02, filename_MOD_03, path):
 
     return RGB
 
+def plt_RGB(filename, fieldnames_list, rad_or_ref, plot=True):
+    '''
+    INPUT
+          filename:        - string     , filepath to file
+          fieldnames_list: - string list, contains 500m res and 250m reshape
+                                          such that bands 1,4,3 for RGB
+                                          i.e. 'EV_500_Aggr1km_RefSB'
+    RETURN
+          plots RGB picture of MODIS 02 product data
+    '''
+
+
+    #make channels for RGB photo (index 01234 -> band 34567)
+    image_blue  = prepare_data(filename, fieldnames_list[0],rad_or_ref)[0,:,:] #band 3 from 500 meter res
+    image_green = prepare_data(filename, fieldnames_list[0],rad_or_ref)[1,:,:] #band 4 from 500 meter res
+    image_red   = prepare_data(filename, fieldnames_list[1],rad_or_ref)[0,:,:] #band 1 from 250 meter res
+
+    #force reflectance values to max out at 1.0/ normalize radiance
+    if not rad_or_ref:
+        np.place(image_red, image_red>1.0, 1.0) #2d image array, condition, value
+        np.place(image_blue, image_blue>1.0, 1.0)
+        np.place(image_green, image_green>1.0, 1.0)
+        image_RGB = np.dstack([image_red, image_green, image_blue])
+
+    else:
+        #use astropy to normalize radiance values to usable pixel brightness
+        from astropy.visualization import make_lupton_rgb
+        image_RGB = make_lupton_rgb(image_red, image_green, image_blue, stretch=0.5)
+
+
+    #plot or return image
+    if plot:
+        import matplotlib.pyplot as plt
+        plt.imshow(image_RGB)
+        plt.show()
+    else:
+        return image_RGB
+
 if __name__ == '__main__':
 
     import matplotlib.pyplot as plt
@@ -13,7 +13,7 @@ import numpy as np
 import sys
 from fetch_MCM_input_data import *
 import time
-from svi_calculation import svi_calculation#svi_dynamic_size_input import svi_calculation
+from spatial_variability import get_SVI
 
 
 #define arbitrary shape for granule/orbit to process
@@ -86,6 +86,58 @@ def get_R(radiance, SZA, d, E_std_0b):
 
     return R
 
+def get_R_stack(radiance, SZA, d, E_std_0b, RDQI=None, Max_RDQI=None, out=None):
+    """
+    convert the radiances of every band to BRF in one pass
+
+    [Sections 3.2.1.3 and 3.3.1.2]
+    Same result as mark_bad_radiance (if RDQI is given) then get_R on each
+    band, in float32. cos(SZA) is computed once for all bands and the masked
+    ufuncs (where=) only convert valid pixels in place, so there are no index
+    tuples or full size temporaries per band.
+
+    Arguments:
+        radiance {3D narray} -- (bands, rows, cols) MAIA radiance,
+                                i.e. MAIA bands 6,9,4,5,12,13
+        SZA {2D narray} -- (rows, cols); solar zenith angles in degrees
+        d {float} -- earth sun distance in Astonomical Units(AU)
+        E_std_0b {1D narray} -- band weight solar irradiance at 1 AU of
+                                each band of radiance
+        RDQI {3D narray} -- same shape as radiance; radiance quality flag;
+                            not checked if None
+        Max_RDQI {integer} -- from configuration file;
+                              denotes minimum usable quality flag
+        out {3D narray} -- float32 array to write BRF into, may be radiance
+                           itself; a new array if None
+
+    Returns:
+        3D narray -- float32 BRF; same shape as radiance
+    """
+    if out is None:
+        out = np.empty(np.shape(radiance), dtype=np.float32)
+    if out is not radiance:
+        np.copyto(out, radiance, casting='unsafe')
+
+    #mark bad radiance, same order as mark_bad_radiance
+    if RDQI is not None:
+        np.copyto(out, -998, where=(RDQI > Max_RDQI) & (RDQI < 3))
+        np.copyto(out, -998, where=(out < 0) & (out > -998))
+        np.copyto(out, -999, where=RDQI == 3)
+
+    #now filter out where cosSZA is too small with fill value
+    #cos(SZA) once per granule, so it is done in float64 like get_R
+    cosSZA = np.cos(np.deg2rad(SZA))
+    np.copyto(out, -998, where=cosSZA <= 0.01)
+    cosSZA = cosSZA.astype(np.float32)
+
+    #condition to not step on fill values when converting to BRF(R)
+    valid_rad = out >= 0.0
+    scale     = (np.pi * np.square(d) / np.asarray(E_std_0b, dtype=np.float64))
+    np.divide(out, cosSZA, out=out, where=valid_rad)
+    np.multiply(out, scale.astype(np.float32).reshape(-1, 1, 1), out=out, where=valid_rad)
+
+    return out
+
 #calculate sun-glint flag*******************************************************
 #section 3.3.2.3
 def get_sun_glint_mask(solarZenith, sensorZenith, solarAzimuth, sensorAzimuth,\
@@ -266,7 +318,8 @@ def get_spatial_variability_index(R_band_6, numrows, numcols):
 
     [Section 3.3.2.1.2]
     SVI for a pixel is calculated as the standard deviation of aggregated 1-km R_0.64
-    within a 3X3 matrix centered at the pixel.
+    within a 3X3 matrix centered at the pixel. Any granule shape, see
+    spatial_variability.get_SVI.
 
     Arguments:
         R_band_6 {2D narray} -- BRF narray for band 6
@@ -281,8 +334,7 @@ def get_spatial_variability_index(R_band_6, numrows, numcols):
     R_band_6_[R_band_6_ == -998] = -999
     bad_value = -999
     min_valid_pixels = 9
-    spatial_variability_index = \
-                            svi_calculation(R_band_6_, bad_value, min_valid_pixels)
+    spatial_variability_index = get_SVI(R_band_6_, bad_value, min_valid_pixels)
 
     #data quality house keeping
     spatial_variability_index[R_band_6 == -998] = -998
@@ -306,6 +358,113 @@ def get_cirrus_Ref(R_band_13):
     """
     return R_band_13
 
+#observables engine*************************************************************
+class BufferPool(object):
+    """
+    preallocated arrays reused from granule to granule
+
+    Arrays are keyed by name, shape and dtype, so a granule of the same shape
+    as the last one gets the same memory back instead of new allocations.
+    Whatever get() returned is overwritten when the next granule asks for it.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.float32):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        if key not in self.buffers:
+            self.buffers[key] = np.empty(shape, dtype=dtype)
+
+        return self.buffers[key]
+
+def fill_invalid(observable, R_bands):
+    """
+    data quality house keeping to retain fill values
+
+    Arguments:
+        observable {2D narray} -- set to -999 where any of R_bands is -999,
+                                  -998 where any other band is negative
+        R_bands {tuple} -- BRF narrays the observable is calculated from
+    """
+    invalid = R_bands[0] < 0
+    missing = R_bands[0] == -999
+    for R_band in R_bands[1:]:
+        invalid |= R_band < 0
+        missing |= R_band == -999
+
+    np.putmask(observable, invalid, -998)
+    np.putmask(observable, missing, -999)
+
+def get_observables(R, out=None, buffer_pool=None):
+    """
+    calculate all seven observables into one array
+
+    [Section 3.3.2.1.2]
+    Same values as get_whiteness_index, get_NDVI, get_NDSI,
+    get_visible_reflectance, get_NIR_reflectance,
+    get_spatial_variability_index and get_cirrus_Ref, in float32. Every
+    pixel is calculated in place (out=) and the fill values are put back
+    afterwards, which is faster than masking each ufunc, and the visible
+    average is divided out once; the only temporaries are two scratch planes
+    and the fill masks.
+
+    Arguments:
+        R {3D narray} -- (6, rows, cols) BRF of MAIA bands 6,9,4,5,12,13,
+                         i.e. from get_R_stack
+        out {3D narray} -- (7, rows, cols) float32 array to write to; taken
+                           from buffer_pool if None
+        buffer_pool {BufferPool} -- output and scratch arrays reused across
+                                    granules; new arrays if None
+
+    Returns:
+        3D narray -- (7, rows, cols) float32 WI, NDVI, NDSI, visible
+                     reflectance, NIR reflectance, SVI, cirrus reflectance
+    """
+    R_band_6, R_band_9, R_band_4, R_band_5, R_band_12, R_band_13 = R
+    shape = np.shape(R_band_6)
+
+    if buffer_pool is None:
+        buffer_pool = BufferPool()
+    if out is None:
+        out = buffer_pool.get('observables', (7,) + shape)
+    visible_average, scratch = buffer_pool.get('observables_scratch', (2,) + shape)
+    whiteness_index, NDVI, NDSI = out[0], out[1], out[2]
+
+    #fill pixels give meaningless values until fill_invalid overwrites them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #WI = sum |R - visible average| / visible average over bands 6, 5, 4
+        np.add(R_band_6, R_band_5, out=visible_average)
+        np.add(visible_average, R_band_4, out=visible_average)
+        np.divide(visible_average, 3, out=visible_average)
+        np.subtract(R_band_6, visible_average, out=whiteness_index)
+        np.abs(whiteness_index, out=whiteness_index)
+        for R_band in (R_band_5, R_band_4):
+            np.subtract(R_band, visible_average, out=scratch)
+            np.abs(scratch, out=scratch)
+            np.add(whiteness_index, scratch, out=whiteness_index)
+        np.divide(whiteness_index, visible_average, out=whiteness_index)
+        fill_invalid(whiteness_index, (R_band_6, R_band_5, R_band_4))
+
+        #normalized differences
+        for observable, R_band_a, R_band_b in ((NDVI, R_band_9, R_band_6),\
+                                               (NDSI, R_band_5, R_band_12)):
+            np.subtract(R_band_a, R_band_b, out=observable)
+            np.add(R_band_a, R_band_b, out=scratch)
+            np.divide(observable, scratch, out=observable)
+            fill_invalid(observable, (R_band_a, R_band_b))
+
+    #reflectances are the BRFs themselves
+    np.copyto(out[3], R_band_6)
+    np.copyto(out[4], R_band_9)
+    np.copyto(out[5], get_spatial_variability_index(R_band_6, shape[0], shape[1]))
+    np.copyto(out[6], R_band_13)
+
+    return out
+
+#arrays reused by every MCM_wrapper call in this process
+MCM_buffer_pool = BufferPool()
+
 #calculate bins of each pixel to query the threshold database*******************
 
 def get_observable_level_parameter(SZA, VZA, SAA, VAA, Target_Area,\
@@ -784,7 +943,7 @@ def get_cm_confidence(DTT, activation, N, fill_val_2, fill_val_3):
     return final_cm
 
 def MCM_wrapper(test_data_JPL_path, Target_Area_X, threshold_filepath,\
-                sfc_ID_filepath, config_filepath):
+                sfc_ID_filepath, config_filepath, buffer_pool=MCM_buffer_pool):
     """
     simply executes function to get the final cloud mask
 
@@ -796,7 +955,9 @@ def MCM_wrapper(test_data_JPL_path, Target_Area_X, threshold_filepath,\
         threshold_filepath {string} -- ancillary threshold dataset filepath
         sfc_ID_filepath {string} -- ancillary surface ID dataset filepath
         config_filepath {string} -- ancillary configuration file filepath
-
+        buffer_pool {BufferPool} -- radiance/BRF and observables arrays reused
+                                    from call to call; defaults to one pool
+                                    per process
 
     Returns:
         Sun_glint_exclusion_angle {float} -- from configuration file in degrees;
@@ -869,23 +1030,21 @@ def MCM_wrapper(test_data_JPL_path, Target_Area_X, threshold_filepath,\
 
     #now put data through algorithm flow****************************************
 
-    #mark bad radiance**********************************************************
-    rad_band_4  = mark_bad_radiance(rad_band_4[:],  RDQI_band_4[:],  Max_RDQI)
-    rad_band_5  = mark_bad_radiance(rad_band_5[:],  RDQI_band_5[:],  Max_RDQI)
-    rad_band_6  = mark_bad_radiance(rad_band_6[:],  RDQI_band_6[:],  Max_RDQI)
-    rad_band_9  = mark_bad_radiance(rad_band_9[:],  RDQI_band_9[:],  Max_RDQI)
-    rad_band_12 = mark_bad_radiance(rad_band_12[:], RDQI_band_12[:], Max_RDQI)
-    rad_band_13 = mark_bad_radiance(rad_band_13[:], RDQI_band_13[:], Max_RDQI)
-
-    #get R**********************************************************************
+    #mark bad radiance and get R************************************************
     #in order MAIA  bands 6,9,4,5,12,13
     #in order MODIS bands 1,2,3,4,6 ,26
-    R_band_4  = get_R(rad_band_4[:],  SZA[:], d, E_std_0b[2])
-    R_band_5  = get_R(rad_band_5[:],  SZA[:], d, E_std_0b[3])
-    R_band_6  = get_R(rad_band_6[:],  SZA[:], d, E_std_0b[0])
-    R_band_9  = get_R(rad_band_9[:],  SZA[:], d, E_std_0b[1])
-    R_band_12 = get_R(rad_band_12[:], SZA[:], d, E_std_0b[4])
-    R_band_13 = get_R(rad_band_13[:], SZA[:], d, E_std_0b[5])
+    #one pass over all six bands, cos(SZA) computed once
+    radiance = buffer_pool.get('radiance', (6,) + np.shape(rad_band_6))
+    RDQI     = buffer_pool.get('RDQI', (6,) + np.shape(RDQI_band_6), RDQI_band_6.dtype)
+    for i, (rad_band, RDQI_band) in enumerate(((rad_band_6 , RDQI_band_6 ),\
+                                               (rad_band_9 , RDQI_band_9 ),\
+                                               (rad_band_4 , RDQI_band_4 ),\
+                                               (rad_band_5 , RDQI_band_5 ),\
+                                               (rad_band_12, RDQI_band_12),\
+                                               (rad_band_13, RDQI_band_13))):
+        radiance[i], RDQI[i] = rad_band[:], RDQI_band[:]
+    R = get_R_stack(radiance, SZA[:], d, E_std_0b, RDQI, Max_RDQI, out=radiance)
+    R_band_6, R_band_9, R_band_4, R_band_5, R_band_12, R_band_13 = R
 
     BRFs = np.dstack((R_band_4,\
                       R_band_5,\
@@ -901,13 +1060,8 @@ def MCM_wrapper(test_data_JPL_path, Target_Area_X, threshold_filepath,\
     #calculate observables******************************************************
     #0.86, 1.61, 1.88 micrometers -> bands 9, 12, 13
     #RGB channels -> bands 6, 5, 4
-    WI      = get_whiteness_index(R_band_6, R_band_5, R_band_4)
-    NDVI    = get_NDVI(R_band_6, R_band_9)
-    NDSI    = get_NDSI(R_band_5, R_band_12)
-    VIS_Ref = get_visible_reflectance(R_band_6)
-    NIR_Ref = get_NIR_reflectance(R_band_9)
-    Cirrus  = get_cirrus_Ref(R_band_13)
-    SVI     = get_spatial_variability_index(R_band_6, shape[0], shape[1])
+    #WI, NDVI, NDSI, VIS_Ref, NIR_Ref, SVI, Cirrus along the first axis
+    observables = get_observables(R, buffer_pool=buffer_pool)
     
     #SVI_Sfc_ID = get_spatial_variability_index(sfc_ID, shape[0], shape[1])
     #SVI = SVI - SVI_Sfc_ID
@@ -931,19 +1085,17 @@ def MCM_wrapper(test_data_JPL_path, Target_Area_X, threshold_filepath,\
                       sun_glint_mask[:]   ]
 
     #get test determination*****************************************************
-    #combine observables into one array along third dimesnion
-    observables = np.dstack((WI, NDVI, NDSI, VIS_Ref, NIR_Ref, SVI, Cirrus))
     observable_names = ['WI', 'NDVI', 'NDSI', 'VIS_Ref', 'NIR_Ref', 'SVI',\
                         'Cirrus']
 
-    observable_data = np.empty(np.shape(observables))
-    T = np.empty(np.shape(observables))
+    observable_data = np.empty(np.shape(R_band_6) + (len(observable_names),))
+    T = np.empty(np.shape(R_band_6) + (len(observable_names),))
     for i in range(len(observable_names)):
         #threshold_observable_i = threhsold_database[observable_names[i]][:]
 
         observable_data[:,:,i], T[:,:,i] = \
         get_test_determination(observable_level_parameter,\
-        observables[:,:,i],\
+        observables[i],\
         threshold_filepath,\
         observable_names[i],\
         fill_val_1, fill_val_2, fill_val_3)
@@ -2,6 +2,7 @@ import numpy as np
 from pyhdf.SD import SD
 import h5py
 import matplotlib.pyplot as plt
+from database_encoding import read_decoded
 
 ### from MOD_organize.py
 def MOD021KM_read(mod02_file):
@@ -104,24 +105,25 @@ def MOD35_read(mod35_file):
 def make_JPL_data_from_MODIS(out_path):#MOD021KM_path, MOD03_path, MOD35_path, out_path):
 
     time_stamp = '2002051.1820'
-    home       = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/LA_database_60_cores/'
-    with h5py.File(home + 'LA_PTA_database_mpi_start_00000_end_00331_try2.hdf5', 'r') as hf_database:
-        rad_b4       = hf_database[time_stamp + '/radiance/band_3'][()]
-        rad_b5       = hf_database[time_stamp + '/radiance/band_4'][()]
-        rad_b6       = hf_database[time_stamp + '/radiance/band_1'][()]
-        rad_b9       = hf_database[time_stamp + '/radiance/band_2'][()]
-        rad_b12      = hf_database[time_stamp + '/radiance/band_6'][()]
-        rad_b13      = hf_database[time_stamp + '/radiance/band_26'][()]
-        E_std_0      = hf_database[time_stamp + '/band_weighted_solar_irradiance'][()]
-        lat          = hf_database[time_stamp + '/geolocation/lat'][()]
-        lon          = hf_database[time_stamp + '/geolocation/lon'][()]
-        sza          = hf_database[time_stamp + '/sunView_geometry/solarZenith'][()]
-        vza          = hf_database[time_stamp + '/sunView_geometry/sensorZenith'][()]
-        saa          = hf_database[time_stamp + '/sunView_geometry/solarAzimuth'][()]
-        vaa          = hf_database[time_stamp + '/sunView_geometry/sensorAzimuth'][()]
-        modcm        = hf_database[time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag'][()]
-        snow_ice_mask = hf_database[time_stamp + '/cloud_mask/Snow_Ice_Background_Flag'][()]
-        water_mask   = hf_database[time_stamp + '/cloud_mask/Land_Water_Flag'][()]
+    home       = '/data/keeling/a/vllgsbr2/c/old_MAIA_Threshold_dev/LA_PTA_MODIS_Data/try2_database/'
+    #master file, links every time stamp of the rank files
+    with h5py.File(home + 'LA_PTA_database.hdf5', 'r') as hf_database:
+        rad_b4       = read_decoded(hf_database, time_stamp + '/radiance/band_3')
+        rad_b5       = read_decoded(hf_database, time_stamp + '/radiance/band_4')
+        rad_b6       = read_decoded(hf_database, time_stamp + '/radiance/band_1')
+        rad_b9       = read_decoded(hf_database, time_stamp + '/radiance/band_2')
+        rad_b12      = read_decoded(hf_database, time_stamp + '/radiance/band_6')
+        rad_b13      = read_decoded(hf_database, time_stamp + '/radiance/band_26')
+        E_std_0      = read_decoded(hf_database, time_stamp + '/band_weighted_solar_irradiance')
+        lat          = read_decoded(hf_database, time_stamp + '/geolocation/lat')
+        lon          = read_decoded(hf_database, time_stamp + '/geolocation/lon')
+        sza          = read_decoded(hf_database, time_stamp + '/sunView_geometry/solarZenith')
+        vza          = read_decoded(hf_database, time_stamp + '/sunView_geometry/sensorZenith')
+        saa          = read_decoded(hf_database, time_stamp + '/sunView_geometry/solarAzimuth')
+        vaa          = read_decoded(hf_database, time_stamp + '/sunView_geometry/sensorAzimuth')
+        modcm        = read_decoded(hf_database, time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag')
+        snow_ice_mask = read_decoded(hf_database, time_stamp + '/cloud_mask/Snow_Ice_Background_Flag')
+        water_mask   = read_decoded(hf_database, time_stamp + '/cloud_mask/Land_Water_Flag')
 
     #create hdf5 file
     hf = h5py.File(out_path, 'w')
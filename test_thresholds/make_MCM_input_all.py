@@ -3,6 +3,7 @@ from pyhdf.SD import SD
 import h5py
 import matplotlib.pyplot as plt
 import os
+from database_encoding import read_decoded
 
 def make_JPL_data_from_MODIS():
 
@@ -17,23 +18,23 @@ def make_JPL_data_from_MODIS():
 
             if len(keys) > 0:
                 for time_stamp in keys:
-                    rad_b4       = hf_database[time_stamp + '/radiance/band_3'][()]
-                    rad_b5       = hf_database[time_stamp + '/radiance/band_4'][()]
-                    rad_b6       = hf_database[time_stamp + '/radiance/band_1'][()]
-                    rad_b9       = hf_database[time_stamp + '/radiance/band_2'][()]
-                    rad_b12      = hf_database[time_stamp + '/radiance/band_6'][()]
-                    rad_b13      = hf_database[time_stamp + '/radiance/band_26'][()]
-                    E_std0b      = hf_database[time_stamp + '/band_weighted_solar_irradiance'][()]
-                    lat          = hf_database[time_stamp + '/geolocation/lat'][()]
-                    lon          = hf_database[time_stamp + '/geolocation/lon'][()]
-                    SZA          = hf_database[time_stamp + '/sunView_geometry/solarZenith'][()]
-                    VZA          = hf_database[time_stamp + '/sunView_geometry/sensorZenith'][()]
-                    SAA          = hf_database[time_stamp + '/sunView_geometry/solarAzimuth'][()]
-                    VAA          = hf_database[time_stamp + '/sunView_geometry/sensorAzimuth'][()]
-                    modcm        = hf_database[time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag'][()]
-                    snow_ice_mask = hf_database[time_stamp + '/cloud_mask/Snow_Ice_Background_Flag'][()]
-                    water_mask   = hf_database[time_stamp + '/cloud_mask/Land_Water_Flag'][()]
-                    earth_sun_distance = hf_database[time_stamp + '/earth_sun_distance'][()]
+                    rad_b4       = read_decoded(hf_database, time_stamp + '/radiance/band_3')
+                    rad_b5       = read_decoded(hf_database, time_stamp + '/radiance/band_4')
+                    rad_b6       = read_decoded(hf_database, time_stamp + '/radiance/band_1')
+                    rad_b9       = read_decoded(hf_database, time_stamp + '/radiance/band_2')
+                    rad_b12      = read_decoded(hf_database, time_stamp + '/radiance/band_6')
+                    rad_b13      = read_decoded(hf_database, time_stamp + '/radiance/band_26')
+                    E_std0b      = read_decoded(hf_database, time_stamp + '/band_weighted_solar_irradiance')
+                    lat          = read_decoded(hf_database, time_stamp + '/geolocation/lat')
+                    lon          = read_decoded(hf_database, time_stamp + '/geolocation/lon')
+                    SZA          = read_decoded(hf_database, time_stamp + '/sunView_geometry/solarZenith')
+                    VZA          = read_decoded(hf_database, time_stamp + '/sunView_geometry/sensorZenith')
+                    SAA          = read_decoded(hf_database, time_stamp + '/sunView_geometry/solarAzimuth')
+                    VAA          = read_decoded(hf_database, time_stamp + '/sunView_geometry/sensorAzimuth')
+                    modcm        = read_decoded(hf_database, time_stamp + '/cloud_mask/Unobstructed_FOV_Quality_Flag')
+                    snow_ice_mask = read_decoded(hf_database, time_stamp + '/cloud_mask/Snow_Ice_Background_Flag')
+                    water_mask   = read_decoded(hf_database, time_stamp + '/cloud_mask/Land_Water_Flag')
+                    earth_sun_distance = read_decoded(hf_database, time_stamp + '/earth_sun_distance')
 
                     #create hdf5 file
                     hf = h5py.File(output_path + '/test_JPL_data_{}.HDF5'.format(time_stamp), 'w')
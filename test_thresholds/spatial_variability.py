@@ -0,0 +1,129 @@
+'''
+author: Javier Villegas
+
+Spatial variability index (SVI) of any granule shape, with the same result
+as the f2py svi_calculation module (svi_calculation.F), which only takes
+1000x1000 arrays. SVI is the population standard deviation of the valid
+values in the 3x3 window centered at each pixel; windows are cut at the
+granule edges (6 values on an edge, 4 at a corner) and a pixel whose window
+has fewer than min_valid_pixels valid values gets -999.
+
+Instead of a loop over pixels, the sum, sum of squares and count of valid
+values of every window are built from shifted slices, 3 adds per axis.
+get_SVI_tiled does the same over blocks of rows with a 1 row halo, so a
+swath (or an h5py dataset) larger than memory is streamed through.
+
+compare against the Fortran module on random fixtures with
+    python spatial_variability.py [n_fixtures]
+'''
+import numpy as np
+
+def box_sum_3x3(data):
+    '''
+    INPUT:
+          data - 2D narray
+    RETURN:
+          2D narray - float64 sum of the 3x3 window around each pixel,
+                      windows cut at the edges of data
+    '''
+    rows, cols = np.shape(data)
+    padded = np.zeros((rows + 2, cols + 2))
+    padded[1:-1, 1:-1] = data
+
+    row_sum = padded[:-2] + padded[1:-1]
+    row_sum += padded[2:]
+    box_sum = row_sum[:, :-2] + row_sum[:, 1:-1]
+    box_sum += row_sum[:, 2:]
+
+    return box_sum
+
+def get_SVI(R, bad_value=-999., min_valid_pixels=9):
+    '''
+    INPUT:
+          R                - 2D narray - any shape, i.e. BRF of band 6
+          bad_value        - float     - values of R left out of the windows
+          min_valid_pixels - int       - fewest valid values in a window to
+                                         calculate SVI (NUMBER_MIN_VALID)
+    RETURN:
+          2D narray - float32 SVI, -999 where the window has too few valid
+                      values
+    '''
+    #same precision as the REAL arrays of the Fortran
+    R     = np.asarray(R, dtype=np.float32)
+    valid = R != np.float32(bad_value)
+
+    R_valid = np.where(valid, R, 0).astype(np.float64)
+    n_valid = box_sum_3x3(valid)
+    R_sum   = box_sum_3x3(R_valid)
+    np.square(R_valid, out=R_valid)
+    R_sum_squares = box_sum_3x3(R_valid)
+
+    #sum((R - mean)**2)/n = (sum(R**2) - sum(R)**2/n)/n
+    enough = n_valid >= min_valid_pixels
+    n_valid[~enough] = 1
+    variance = R_sum_squares - R_sum**2 / n_valid
+    variance /= n_valid
+    #rounding can leave a constant window slightly negative
+    np.maximum(variance, 0, out=variance)
+
+    SVI = np.sqrt(variance).astype(np.float32)
+    SVI[~enough] = -999
+
+    return SVI
+
+def get_SVI_tiled(R, bad_value=-999., min_valid_pixels=9, tile_rows=512, out=None):
+    '''
+    INPUT:
+          R         - 2D narray or h5py dataset - read tile_rows + 2 rows at
+                      a time
+          bad_value, min_valid_pixels - see get_SVI
+          tile_rows - int - rows of SVI calculated per block
+          out       - 2D narray or h5py dataset - float32, same shape as R;
+                      new narray if None
+    RETURN:
+          out - SVI, identical to get_SVI(R)
+    '''
+    rows = R.shape[0]
+    if out is None:
+        out = np.empty(R.shape, dtype=np.float32)
+
+    for start in range(0, rows, tile_rows):
+        end = min(start + tile_rows, rows)
+        #1 row of halo on each side, except past the granule edge where the
+        #windows are cut like get_SVI
+        halo_start, halo_end = max(start - 1, 0), min(end + 1, rows)
+        SVI = get_SVI(R[halo_start:halo_end], bad_value, min_valid_pixels)
+        out[start:end] = SVI[start - halo_start:end - halo_start]
+
+    return out
+
+if __name__ == '__main__':
+    import sys
+    from svi_calculation import svi_calculation
+
+    n_fixtures = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rng = np.random.default_rng(0)
+
+    failed = False
+    for fixture in range(n_fixtures):
+        #BRF like values with scattered and clustered bad values, some
+        #constant patches and fewer min valid pixels for half the fixtures
+        R = rng.uniform(0, 1.2, (1000, 1000)).astype(np.float32)
+        R[rng.random(R.shape) < 0.02 * fixture] = -999
+        R[100 * fixture:100 * fixture + 50, 200:400] = -999
+        R[500:520, 500:520] = 0.3
+        min_valid_pixels = 9 if fixture % 2 == 0 else 4
+
+        SVI_fortran = svi_calculation(R, -999, min_valid_pixels)
+        SVI         = get_SVI(R, -999, min_valid_pixels)
+        SVI_tiled   = get_SVI_tiled(R, -999, min_valid_pixels, tile_rows=97)
+
+        same_fill  = np.array_equal(SVI_fortran == -999, SVI == -999)
+        difference = np.abs(SVI - SVI_fortran).max()
+        same_tiled = np.array_equal(SVI, SVI_tiled)
+        failed |= not (same_fill and same_tiled and difference < 1e-5)
+        print('fixture {} min valid {}: fill {} max |difference| {:.2e} tiled {}'.format(\
+              fixture, min_valid_pixels, 'same' if same_fill else 'DIFFERENT',\
+              difference, 'same' if same_tiled else 'DIFFERENT'))
+
+    sys.exit(1 if failed else 0)